@@ -0,0 +1,48 @@
+"""Indices para consultas de mensajes y participantes
+
+Revision ID: b7c41e9d2a63
+Revises: 5794c6dba0a0
+Create Date: 2026-10-16 10:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7c41e9d2a63'
+down_revision: Union[str, None] = '5794c6dba0a0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Historial de sala: WHERE room_id = ? AND NOT is_deleted ORDER BY created_at DESC, id DESC
+    op.create_index(
+        'ix_messages_room_created_live',
+        'messages',
+        ['room_id', sa.text('created_at DESC'), sa.text('id DESC')],
+        unique=False,
+        postgresql_where=sa.text('NOT is_deleted'),
+        sqlite_where=sa.text('is_deleted = 0'),
+    )
+    # Salas de un usuario: WHERE user_id = ? (uq_room_user cubre room_id, user_id)
+    op.create_index('ix_room_participants_user_room', 'room_participants', ['user_id', 'room_id'], unique=False)
+    # Solicitudes recibidas: WHERE contact_id = ? AND status = ?
+    op.create_index('ix_contacts_contact_status', 'contacts', ['contact_id', 'status'], unique=False)
+    # Adjuntos de un mensaje (y carga joined de Message.attachments)
+    op.create_index(op.f('ix_attachments_message_id'), 'attachments', ['message_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_attachments_message_id'), table_name='attachments')
+    op.drop_index('ix_contacts_contact_status', table_name='contacts')
+    op.drop_index('ix_room_participants_user_room', table_name='room_participants')
+    op.drop_index(
+        'ix_messages_room_created_live',
+        table_name='messages',
+        postgresql_where=sa.text('NOT is_deleted'),
+        sqlite_where=sa.text('is_deleted = 0'),
+    )
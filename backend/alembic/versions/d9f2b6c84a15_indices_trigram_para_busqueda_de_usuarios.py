@@ -0,0 +1,67 @@
+"""Indices trigram para busqueda de usuarios
+
+Revision ID: d9f2b6c84a15
+Revises: c3d5a8f1e947
+Create Date: 2026-10-16 13:41:09.275316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9f2b6c84a15'
+down_revision: Union[str, None] = 'c3d5a8f1e947'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Solo PostgreSQL. La búsqueda filtra con lower(columna) LIKE patrón:
+# - Con pg_trgm: GIN gin_trgm_ops sobre lower(columna), sirve prefijos y subcadenas
+# - Sin pg_trgm (el servidor no trae contrib): B-tree text_pattern_ops, solo prefijos
+# No se declaran en el modelo porque create_all no instala la extensión.
+SEARCH_COLUMNS = ('username', 'email')
+
+
+def _has_pg_trgm(bind) -> bool:
+    """La extensión está instalada o se puede instalar en este servidor"""
+    return bind.execute(sa.text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+    )).scalar() is not None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    if _has_pg_trgm(bind):
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in SEARCH_COLUMNS:
+            op.create_index(
+                f'ix_users_{column}_trgm',
+                'users',
+                [sa.text(f'lower({column}) gin_trgm_ops')],
+                unique=False,
+                postgresql_using='gin',
+            )
+    else:
+        for column in SEARCH_COLUMNS:
+            op.create_index(
+                f'ix_users_{column}_prefix',
+                'users',
+                [sa.text(f'lower({column}) text_pattern_ops')],
+                unique=False,
+            )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for column in SEARCH_COLUMNS:
+        op.execute(f'DROP INDEX IF EXISTS ix_users_{column}_trgm')
+        op.execute(f'DROP INDEX IF EXISTS ix_users_{column}_prefix')
+    # La extensión se deja instalada: puede haber otros índices o funciones que la usen
@@ -4,11 +4,13 @@ Dependencies para autenticación JWT
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_db
+from app.database import get_async_db
 from app.models.user import User
 from app.auth.jwt import verify_token
+from app.services.room_membership import room_membership
+from app.services.user_principal import Principal, user_principal_cache
 
 # Configurar esquema de seguridad Bearer
 security = HTTPBearer()
@@ -16,11 +18,14 @@ security = HTTPBearer()
 
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """
     Obtener el usuario actual desde el token JWT
 
+    Carga el modelo ORM completo en cada petición: usar solo si el endpoint
+    necesita más que id/username/is_active (si no, get_current_principal).
+
     Args:
         credentials: Credenciales HTTP Bearer (token)
         db: Sesión de base de datos
@@ -46,7 +51,7 @@ async def get_current_user(
         raise credentials_exception
 
     # Buscar usuario en BD
-    user = db.query(User).filter(User.id == token_data.user_id).first()
+    user = await db.get(User, token_data.user_id)
     if user is None:
         raise credentials_exception
 
@@ -59,9 +64,48 @@ async def get_current_user(
     return user
 
 
+async def get_current_principal(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
+    """
+    Obtener el usuario actual (id, username, is_active) sin cargar el modelo ORM
+
+    Usa el caché de principals (LRU local + Redis): en la mayoría de
+    peticiones no hay ninguna consulta a la DB.
+
+    Returns:
+        Principal del usuario autenticado
+
+    Raises:
+        HTTPException: Si el token es inválido, el usuario no existe o está inactivo
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    token_data = verify_token(credentials.credentials)
+    if token_data is None or token_data.user_id is None:
+        raise credentials_exception
+
+    principal = await user_principal_cache.get(token_data.user_id, db)
+    if principal is None:
+        raise credentials_exception
+
+    if not principal.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Inactive user"
+        )
+
+    return principal
+
+
 async def get_current_user_optional(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> Optional[User]:
     """
     Obtener el usuario actual desde el token JWT (opcional)
@@ -83,5 +127,31 @@ async def get_current_user_optional(
     if token_data is None or token_data.user_id is None:
         return None
 
-    user = db.query(User).filter(User.id == token_data.user_id).first()
+    user = await db.get(User, token_data.user_id)
     return user
+
+
+async def require_room_member(
+    room_id: int,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+) -> Principal:
+    """
+    Exigir que el usuario actual sea participante de la sala `room_id` (parámetro de ruta)
+
+    La comprobación usa el caché de participantes (LRU local + Redis) y
+    solo consulta la DB si la sala no está cacheada.
+
+    Returns:
+        Principal del usuario autenticado
+
+    Raises:
+        HTTPException: 403 si el usuario no es participante de la sala
+    """
+    if not await room_membership.is_member(room_id, current_user.id, db):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not a participant of this chat room"
+        )
+
+    return current_user
@@ -1,19 +1,53 @@
 """
 Utilidades para manejo de JWT (JSON Web Tokens)
 """
+import hashlib
+import logging
+import os
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+
+from app.services.local_cache import LocalTTLCache
+
+logger = logging.getLogger(__name__)
 
 # Configuración JWT
 SECRET_KEY = "your-secret-key-change-this-in-production-use-env-variable"  # TODO: Mover a .env
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 días
 
+# Implementación JWT: pyjwt (más rápida) o jose. Si PyJWT no está instalado se usa python-jose
+JWT_BACKEND = os.getenv("JWT_BACKEND", "pyjwt").lower()
+# Caché de tokens ya verificados (por worker): TTL máximo por entrada y tamaño
+JWT_CACHE_TTL = int(os.getenv("JWT_CACHE_TTL", "300"))
+JWT_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000"))
+
+
+def _load_backend():
+    """Elegir la implementación de encode/decode según JWT_BACKEND"""
+    if JWT_BACKEND == "pyjwt":
+        try:
+            import jwt as pyjwt
+            return "pyjwt", pyjwt.encode, pyjwt.decode, pyjwt.PyJWTError
+        except ImportError:
+            logger.warning("⚠️ JWT_BACKEND=pyjwt pero PyJWT no está instalado, usando python-jose")
+    return "jose", jwt.encode, jwt.decode, JWTError
+
+
+_backend, _encode, _decode, _DecodeError = _load_backend()
+
+# sha256(token) -> TokenData. Solo tokens válidos, nunca más allá de su exp
+_verified_tokens = LocalTTLCache(JWT_CACHE_TTL, JWT_CACHE_MAX_ENTRIES)
+_verify_stats = {"hits": 0, "misses": 0}
+
 
 class TokenData(BaseModel):
-    """Schema de datos del token"""
+    """Schema de datos del token (inmutable: se comparte desde el caché)"""
+    model_config = ConfigDict(frozen=True)
+
     user_id: Optional[int] = None
     username: Optional[str] = None
 
@@ -37,7 +71,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = _encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
     return encoded_jwt
 
@@ -46,14 +80,25 @@ def verify_token(token: str) -> Optional[TokenData]:
     """
     Verificar y decodificar un token JWT
 
+    Los tokens válidos se memorizan por su hash hasta JWT_CACHE_TTL segundos
+    (o hasta su exp si es antes): un cliente que reutiliza su token no paga
+    la verificación HMAC en cada petición.
+
     Args:
         token: Token JWT a verificar
 
     Returns:
         TokenData si el token es válido, None si no
     """
+    digest = hashlib.sha256(token.encode()).digest()
+    cached = _verified_tokens.get(digest)
+    if cached is not None:
+        _verify_stats["hits"] += 1
+        return cached
+
+    _verify_stats["misses"] += 1
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id_raw = payload.get("sub")
         username: str = payload.get("username")
 
@@ -63,6 +108,22 @@ def verify_token(token: str) -> Optional[TokenData]:
         # Convertir user_id a int (puede venir como string o int del JWT)
         user_id = int(user_id_raw) if isinstance(user_id_raw, str) else user_id_raw
 
-        return TokenData(user_id=user_id, username=username)
-    except JWTError:
-        return None
\ No newline at end of file
+        token_data = TokenData(user_id=user_id, username=username)
+    except _DecodeError:
+        return None
+
+    # Nunca servir desde el caché un token ya expirado
+    exp = payload.get("exp")
+    _verified_tokens.set(digest, token_data, ttl=exp - time.time() if exp is not None else None)
+
+    return token_data
+
+
+def get_verify_stats() -> dict:
+    """Estadísticas de la verificación de tokens en este worker"""
+    return {
+        "backend": _backend,
+        "cached_tokens": len(_verified_tokens),
+        "cache_ttl": JWT_CACHE_TTL,
+        **_verify_stats
+    }
@@ -1,10 +1,41 @@
 """
 Utilidades para manejo de contraseñas con bcrypt
+
+bcrypt cuesta ~100-300ms de CPU por operación. Desde código async usar
+hash_password_async / verify_password_async: se ejecutan en un pool de hilos
+acotado (bcrypt libera el GIL) y el event loop sigue atendiendo sockets.
+Las versiones síncronas quedan para scripts y código sin event loop (init_data).
 """
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
 from passlib.context import CryptContext
 
+logger = logging.getLogger(__name__)
+
+# Factor de trabajo de bcrypt (2^rounds iteraciones). Los hashes existentes con
+# otro valor se siguen verificando igual
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Hilos dedicados a bcrypt por worker y máximo de operaciones en curso + en cola
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
 # Configurar bcrypt para hashing de contraseñas
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_in_flight = 0
+_hasher_stats = {"completed": 0, "failed": 0, "rejected": 0}
+# Los contadores se liberan desde los hilos de bcrypt
+_stats_lock = threading.Lock()
+
+
+class PasswordHasherBusy(Exception):
+    """El pool de bcrypt tiene PASSWORD_HASH_MAX_PENDING operaciones pendientes"""
 
 
 def hash_password(password: str) -> str:
@@ -32,3 +63,82 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         True si coinciden, False si no
     """
     return pwd_context.verify(plain_password, hashed_password)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Pool de hilos de bcrypt (se crea con la primera operación)"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+
+def _release_slot(future: Future) -> None:
+    """
+    Liberar el hueco cuando la operación termina de verdad
+
+    Si la petición se cancela con bcrypt ya ejecutándose, el hilo sigue
+    ocupado hasta acabar: el hueco se libera entonces y no al cancelar el await.
+    """
+    global _in_flight
+    with _stats_lock:
+        _in_flight -= 1
+        if future.cancelled() or future.exception() is not None:
+            # Error de bcrypt (hash malformado...) o cancelada antes de empezar
+            _hasher_stats["failed"] += 1
+        else:
+            _hasher_stats["completed"] += 1
+
+
+async def _run_in_pool(func, *args):
+    """
+    Ejecutar una operación de bcrypt en el pool sin bloquear el event loop
+
+    Raises:
+        PasswordHasherBusy: Si ya hay PASSWORD_HASH_MAX_PENDING operaciones pendientes
+    """
+    global _in_flight
+    with _stats_lock:
+        if _in_flight >= PASSWORD_HASH_MAX_PENDING:
+            _hasher_stats["rejected"] += 1
+            logger.warning(f"⚠️ Cola de bcrypt llena ({_in_flight} pendientes), petición rechazada")
+            raise PasswordHasherBusy(f"{_in_flight} password operations pending")
+        _in_flight += 1
+
+    try:
+        future = _get_executor().submit(func, *args)
+    except BaseException:
+        with _stats_lock:
+            _in_flight -= 1
+        raise
+    future.add_done_callback(_release_slot)
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password_async(password: str) -> str:
+    """Versión async de hash_password (pool de hilos acotado)"""
+    return await _run_in_pool(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Versión async de verify_password (pool de hilos acotado)"""
+    return await _run_in_pool(verify_password, plain_password, hashed_password)
+
+
+def get_hasher_stats() -> dict:
+    """
+    Estadísticas del pool de bcrypt de este worker
+
+    in_flight incluye las operaciones ejecutándose y las que esperan hilo;
+    queued son solo las que esperan. completed cuenta las que terminaron bien y
+    failed las que lanzaron una excepción o se cancelaron antes de empezar
+    (una petición cancelada con bcrypt en marcha cuenta al terminar el hilo).
+    """
+    return {
+        "rounds": BCRYPT_ROUNDS,
+        "workers": PASSWORD_HASH_WORKERS,
+        "max_pending": PASSWORD_HASH_MAX_PENDING,
+        "in_flight": _in_flight,
+        "queued": max(0, _in_flight - PASSWORD_HASH_WORKERS),
+        **_hasher_stats
+    }
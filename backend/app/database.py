@@ -1,6 +1,8 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from typing import AsyncGenerator, Generator
 import os
 from dotenv import load_dotenv
 
@@ -16,16 +18,80 @@ if not DATABASE_URL:
 # Configurar echo desde variable de entorno (por defecto False)
 DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
 
-# Crear engine de SQLAlchemy
+# Tamaño del pool de conexiones (por engine y por worker)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+# Segundos tras los cuales se recicla una conexión (evita conexiones muertas por timeouts de red/PgBouncer)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# Segundos de espera por una conexión libre antes de fallar
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+
+# Drivers async equivalentes a los drivers síncronos de DATABASE_URL
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_database_url(url: str) -> str:
+    """
+    Derivar la URL async (asyncpg / aiosqlite) a partir de DATABASE_URL
+
+    Ej: postgresql+psycopg2://... -> postgresql+asyncpg://...
+    """
+    parsed = make_url(url)
+    async_driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if async_driver is None:
+        return url
+    return parsed.set(drivername=async_driver).render_as_string(hide_password=False)
+
+
+def get_pool_options(url: str) -> dict:
+    """
+    Opciones de pool comunes a los engines sync y async
+
+    SQLite (tests/desarrollo) usa pools sin tamaño configurable, así que solo
+    se aplica el dimensionamiento a bases de datos servidor (PostgreSQL).
+    """
+    options = {"pool_pre_ping": True}  # Verifica conexiones antes de usarlas
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_timeout=DB_POOL_TIMEOUT
+        )
+    return options
+
+
+# URL async: se puede fijar explícitamente o se deriva de DATABASE_URL
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or get_async_database_url(DATABASE_URL)
+
+# Crear engine de SQLAlchemy (síncrono: scripts, init_data, routers no migrados)
 engine = create_engine(
     DATABASE_URL,
     echo=DB_ECHO,  # Mostrar queries SQL solo si DB_ECHO=true en .env
-    pool_pre_ping=True  # Verifica conexiones antes de usarlas
+    **get_pool_options(DATABASE_URL)
 )
 
 # Crear SessionLocal factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine async para endpoints y WebSockets (no bloquea el event loop)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=DB_ECHO,
+    **get_pool_options(ASYNC_DATABASE_URL)
+)
+
+# expire_on_commit=False: los objetos siguen accesibles tras el commit sin
+# recargas implícitas (que en async no están permitidas)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False
+)
+
 # Dependency para obtener sesión de base de datos
 def get_db() -> Generator[Session, None, None]:
     """
@@ -41,3 +107,18 @@ def get_db() -> Generator[Session, None, None]:
         raise
     finally:
         db.close()
+
+
+# Dependency async para obtener sesión de base de datos
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency que proporciona una sesión async de base de datos.
+    Se usa en los endpoints con Depends(get_async_db)
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
@@ -1,16 +1,23 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from pathlib import Path
 
-from app.routers import users, chat_rooms, messages, attachments, websocket, contacts
-from app.database import get_db
-from app.redis_client import redis_client
+from app.routers import users, chat_rooms, messages, attachments, websocket, contacts, uploads
+from app.database import get_async_db, async_engine
+from app.redis_client import async_redis_client
 from app.services.message_cache import message_cache
+from app.services.room_membership import room_membership
+from app.services.user_principal import user_principal_cache
+from app.auth.jwt import get_verify_stats
+from app.auth.password import PasswordHasherBusy, get_hasher_stats
 from app.services.init_data import init_default_data
+from app.websockets.manager import manager
+from app.services.message_ingest import message_ingest
+from app.services.room_cleanup import room_cleanup
+from app.services.thumbnails import thumbnail_service
 
 load_dotenv()
 
@@ -35,25 +42,50 @@ app.include_router(chat_rooms.router)
 app.include_router(messages.router)
 app.include_router(attachments.router)
 app.include_router(contacts.router)
+app.include_router(uploads.router)  # Descarga de archivos subidos (/uploads)
 app.include_router(websocket.router)  # WebSocket router
 
-# Configurar directorio de archivos estáticos (uploads)
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
+# Pool de bcrypt saturado (registro, login, cambio de contraseña)
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    """Responder 503 con Retry-After para que el cliente reintente"""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, please retry"},
+        headers={"Retry-After": "1"}
+    )
 
 # Evento de inicio: crear datos por defecto
 @app.on_event("startup")
 async def startup_event():
     """Inicializar datos por defecto al iniciar la aplicación"""
     init_default_data()
+    # Listener Pub/Sub para broadcast entre workers (si WS_BROADCAST_MODE=redis)
+    await manager.start()
+    # Flusher de mensajes por lotes (si WS_PERSISTENCE_MODE=write_behind)
+    await message_ingest.start()
+    # Salas cuya eliminación por lotes quedó a medias
+    await room_cleanup.resume()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Liberar recursos al detener la aplicación"""
+    # Persistir los mensajes pendientes antes de cerrar Redis y la DB
+    await message_ingest.stop()
+    await room_cleanup.stop()
+    await thumbnail_service.stop()
+    await manager.stop()
+    # Cerrar el pool asyncio de Redis (sus conexiones pertenecen a este event loop)
+    await async_redis_client.close()
+    # Cerrar conexiones del engine async de la DB
+    await async_engine.dispose()
 
 @app.get("/")
 async def root():
     return {"message": "Chat API is running"}
 
 @app.get("/health")
-async def health(db: Session = Depends(get_db)):
+async def health(db: AsyncSession = Depends(get_async_db)):
     """
     Healthcheck endpoint que verifica:
     - API está corriendo
@@ -71,7 +103,7 @@ async def health(db: Session = Depends(get_db)):
 
     # Verificar PostgreSQL
     try:
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         health_status["services"]["database"] = "ok"
     except Exception as e:
         health_status["services"]["database"] = f"error: {str(e)}"
@@ -79,7 +111,7 @@ async def health(db: Session = Depends(get_db)):
 
     # Verificar Redis
     try:
-        if redis_client.ping():
+        if await async_redis_client.ping():
             health_status["services"]["redis"] = "ok"
         else:
             health_status["services"]["redis"] = "error: no ping response"
@@ -93,4 +125,13 @@ async def health(db: Session = Depends(get_db)):
 @app.get("/cache/stats")
 async def cache_stats():
     """Obtener estadísticas del caché Redis"""
-    return message_cache.get_cache_stats()
+    stats = await message_cache.get_cache_stats()
+    stats["memberships"] = room_membership.get_stats()
+    stats["principals"] = user_principal_cache.get_stats()
+    stats["tokens"] = get_verify_stats()
+    return stats
+
+@app.get("/auth/stats")
+async def auth_stats():
+    """Obtener estadísticas del pool de bcrypt (profundidad de cola, rechazos)"""
+    return get_hasher_stats()
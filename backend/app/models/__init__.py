@@ -9,5 +9,6 @@ from .message import Message
 from .attachment import Attachment
 from .room_participant import RoomParticipant
 from .contact import Contact
+from .upload_preview import UploadPreview
 
-__all__ = ["Base", "User", "ChatRoom", "Message", "Attachment", "RoomParticipant", "Contact"]
+__all__ = ["Base", "User", "ChatRoom", "Message", "Attachment", "RoomParticipant", "Contact", "UploadPreview"]
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 from sqlalchemy import String, DateTime, ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from . import Base
@@ -8,19 +9,47 @@ class Attachment(Base):
     __tablename__ = "attachments"
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
-    message_id: Mapped[int] = mapped_column(ForeignKey("messages.id"), nullable=False)
-    file_url: Mapped[str] = mapped_column(String(500), nullable=False)
+    message_id: Mapped[int] = mapped_column(ForeignKey("messages.id"), nullable=False, index=True)
+    file_url: Mapped[str] = mapped_column(String(500), nullable=False, index=True)
     file_type: Mapped[str] = mapped_column(String(50), nullable=False)
     uploaded_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
 
     # Relación con message
     message: Mapped["Message"] = relationship("Message", back_populates="attachments")
 
+    # Vista previa del blob (imágenes, se genera en segundo plano tras la subida)
+    preview: Mapped[Optional["UploadPreview"]] = relationship(
+        "UploadPreview",
+        primaryjoin="foreign(Attachment.file_url) == UploadPreview.file_url",
+        viewonly=True,
+        lazy="joined"
+    )
+
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return self.preview.thumbnail_url if self.preview else None
+
+    @property
+    def blurhash(self) -> Optional[str]:
+        return self.preview.blurhash if self.preview else None
+
+    @property
+    def width(self) -> Optional[int]:
+        return self.preview.width if self.preview else None
+
+    @property
+    def height(self) -> Optional[int]:
+        return self.preview.height if self.preview else None
+
     def to_dict(self):
         return {
             "id": self.id,
             "message_id": self.message_id,
             "file_url": self.file_url,
             "file_type": self.file_type,
+            "thumbnail_url": self.thumbnail_url,
+            "blurhash": self.blurhash,
+            "width": self.width,
+            "height": self.height,
             "uploaded_at": self.uploaded_at.isoformat() if self.uploaded_at else None
         }
@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import String, Integer, ForeignKey, DateTime, UniqueConstraint
+from sqlalchemy import String, Integer, ForeignKey, DateTime, UniqueConstraint, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from . import Base
 
@@ -18,6 +18,8 @@ class Contact(Base):
     # Constraint para evitar duplicados
     __table_args__ = (
         UniqueConstraint('user_id', 'contact_id', name='unique_contact_relationship'),
+        # Solicitudes recibidas por estado (el UNIQUE ya cubre las búsquedas por user_id)
+        Index('ix_contacts_contact_status', 'contact_id', 'status'),
     )
 
     def to_dict(self):
@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional, List
-from sqlalchemy import String, Boolean, DateTime, Integer, ForeignKey, Text
+from sqlalchemy import String, Boolean, DateTime, Integer, ForeignKey, Text, Index, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from . import Base
 
@@ -19,6 +19,17 @@ class Message(Base):
     # Relación con attachments
     attachments: Mapped[List["Attachment"]] = relationship("Attachment", back_populates="message", lazy="joined")
 
+    # Índice para el historial de una sala: filtro por room_id sobre mensajes no
+    # eliminados y orden (created_at DESC, id DESC), igual que las consultas keyset
+    __table_args__ = (
+        Index(
+            "ix_messages_room_created_live",
+            "room_id", created_at.desc(), id.desc(),
+            postgresql_where=text("NOT is_deleted"),
+            sqlite_where=text("is_deleted = 0"),
+        ),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
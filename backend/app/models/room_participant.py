@@ -1,5 +1,6 @@
 from datetime import datetime
-from sqlalchemy import DateTime, Integer, ForeignKey, UniqueConstraint
+from typing import Optional
+from sqlalchemy import DateTime, Integer, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.orm import Mapped, mapped_column
 from . import Base
 
@@ -11,9 +12,13 @@ class RoomParticipant(Base):
     room_id: Mapped[int] = mapped_column(ForeignKey("chat_rooms.id", ondelete="CASCADE"), nullable=False)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     joined_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
+    # Último mensaje leído por el usuario en la sala (sin FK: los mensajes se pueden borrar)
+    last_read_message_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     __table_args__ = (
         UniqueConstraint('room_id', 'user_id', name='uq_room_user'),
+        # Salas de un usuario (el UNIQUE ya cubre las búsquedas por room_id)
+        Index('ix_room_participants_user_room', 'user_id', 'room_id'),
     )
 
     def to_dict(self):
@@ -21,5 +26,6 @@ class RoomParticipant(Base):
             "id": self.id,
             "room_id": self.room_id,
             "user_id": self.user_id,
-            "joined_at": self.joined_at.isoformat() if self.joined_at else None
+            "joined_at": self.joined_at.isoformat() if self.joined_at else None,
+            "last_read_message_id": self.last_read_message_id
         }
@@ -0,0 +1,26 @@
+from datetime import datetime
+from sqlalchemy import String, DateTime, Integer
+from sqlalchemy.orm import Mapped, mapped_column
+from . import Base
+
+class UploadPreview(Base):
+    """Modelo de Vista Previa de un archivo subido (una por blob, compartida por sus adjuntos)"""
+    __tablename__ = "upload_previews"
+
+    file_url: Mapped[str] = mapped_column(String(500), primary_key=True)
+    thumbnail_url: Mapped[str] = mapped_column(String(500), nullable=False)
+    blurhash: Mapped[str] = mapped_column(String(100), nullable=False)
+    # Dimensiones de la imagen original (el cliente reserva el espacio antes de cargarla)
+    width: Mapped[int] = mapped_column(Integer, nullable=False)
+    height: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, nullable=False)
+
+    def to_dict(self):
+        return {
+            "file_url": self.file_url,
+            "thumbnail_url": self.thumbnail_url,
+            "blurhash": self.blurhash,
+            "width": self.width,
+            "height": self.height,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
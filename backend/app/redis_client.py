@@ -1,4 +1,5 @@
 import redis
+import redis.asyncio
 import json
 import os
 from typing import Optional, Any, List
@@ -12,8 +13,26 @@ logger = logging.getLogger(__name__)
 # Cargar variables de entorno
 load_dotenv()
 
+# Máximo de conexiones del pool compartido del cliente asyncio (por worker)
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+# Segundos que una operación espera una conexión libre cuando el pool está agotado
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+
+
+def _serialize(value: Any) -> Any:
+    """Serializar a JSON si es dict/list"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
 class RedisClient:
-    """Cliente Redis para caché y Pub/Sub"""
+    """
+    Cliente Redis síncrono para caché y Pub/Sub
+
+    Se conserva para scripts y código síncrono (init_data, test_redis.py).
+    El código async de la API debe usar `async_redis_client`.
+    """
 
     def __init__(self):
         """Inicializar conexión a Redis"""
@@ -366,5 +385,344 @@ class RedisClient:
             logger.error(f"Error cerrando conexión: {e}")
 
 
-# Instancia global de Redis
+class AsyncRedisClient:
+    """
+    Cliente Redis asyncio (redis.asyncio) para los paths async de la API
+
+    Usa un único pool compartido por worker; las operaciones no bloquean el
+    event loop mientras esperan la respuesta de Redis. El pool es bloqueante:
+    con todas las conexiones en uso, una ráfaga espera turno (hasta
+    pool_timeout) en lugar de fallar con "Too many connections".
+    """
+
+    def __init__(self, max_connections: int = REDIS_MAX_CONNECTIONS, pool_timeout: float = REDIS_POOL_TIMEOUT):
+        """Crear el pool de conexiones (las conexiones se abren bajo demanda)"""
+        self.host = os.getenv("REDIS_HOST", "localhost")
+        self.port = int(os.getenv("REDIS_PORT", 6379))
+        self.db = int(os.getenv("REDIS_DB", 0))
+        self.password = os.getenv("REDIS_PASSWORD", None)
+        self.max_connections = max_connections
+
+        self.pool = redis.asyncio.BlockingConnectionPool(
+            host=self.host,
+            port=self.port,
+            db=self.db,
+            password=self.password if self.password else None,
+            decode_responses=True,
+            socket_connect_timeout=5,
+            socket_timeout=5,
+            max_connections=max_connections,
+            timeout=pool_timeout
+        )
+        self.client = redis.asyncio.Redis(connection_pool=self.pool)
+
+    # ==================== OPERACIONES BÁSICAS ====================
+
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
+        """Guardar valor en Redis (ver RedisClient.set)"""
+        try:
+            value = _serialize(value)
+            if ttl:
+                return await self.client.setex(key, ttl, value)
+            return await self.client.set(key, value)
+        except Exception as e:
+            logger.error(f"Error en set({key}): {e}")
+            return False
+
+    async def get(self, key: str, as_json: bool = False) -> Optional[Any]:
+        """Obtener valor de Redis (ver RedisClient.get)"""
+        try:
+            value = await self.client.get(key)
+            if value is None:
+                return None
+            return json.loads(value) if as_json else value
+        except Exception as e:
+            logger.error(f"Error en get({key}): {e}")
+            return None
+
+    async def delete(self, *keys: str) -> int:
+        """Eliminar una o más claves"""
+        try:
+            return await self.client.delete(*keys)
+        except Exception as e:
+            logger.error(f"Error en delete({keys}): {e}")
+            return 0
+
+    async def exists(self, *keys: str) -> int:
+        """Verificar si una o más claves existen"""
+        try:
+            return await self.client.exists(*keys)
+        except Exception as e:
+            logger.error(f"Error en exists({keys}): {e}")
+            return 0
+
+    async def expire(self, key: str, seconds: int) -> bool:
+        """Establecer tiempo de expiración para una clave"""
+        try:
+            return await self.client.expire(key, seconds)
+        except Exception as e:
+            logger.error(f"Error en expire({key}): {e}")
+            return False
+
+    async def ttl(self, key: str) -> int:
+        """Obtener tiempo de vida restante de una clave"""
+        try:
+            return await self.client.ttl(key)
+        except Exception as e:
+            logger.error(f"Error en ttl({key}): {e}")
+            return -2
+
+    # ==================== OPERACIONES DE LISTAS ====================
+
+    async def lpush(self, key: str, *values: Any) -> int:
+        """Agregar valores al inicio de una lista"""
+        try:
+            return await self.client.lpush(key, *[_serialize(v) for v in values])
+        except Exception as e:
+            logger.error(f"Error en lpush({key}): {e}")
+            return 0
+
+    async def rpush(self, key: str, *values: Any) -> int:
+        """Agregar valores al final de una lista"""
+        try:
+            return await self.client.rpush(key, *[_serialize(v) for v in values])
+        except Exception as e:
+            logger.error(f"Error en rpush({key}): {e}")
+            return 0
+
+    async def lrange(self, key: str, start: int = 0, end: int = -1, as_json: bool = False) -> List[Any]:
+        """Obtener elementos de una lista"""
+        try:
+            values = await self.client.lrange(key, start, end)
+            if as_json:
+                return [json.loads(v) for v in values]
+            return values
+        except Exception as e:
+            logger.error(f"Error en lrange({key}): {e}")
+            return []
+
+    async def ltrim(self, key: str, start: int, end: int) -> bool:
+        """Recortar lista para mantener solo elementos en el rango"""
+        try:
+            return await self.client.ltrim(key, start, end)
+        except Exception as e:
+            logger.error(f"Error en ltrim({key}): {e}")
+            return False
+
+    async def llen(self, key: str) -> int:
+        """Obtener longitud de una lista"""
+        try:
+            return await self.client.llen(key)
+        except Exception as e:
+            logger.error(f"Error en llen({key}): {e}")
+            return 0
+
+    # ==================== OPERACIONES DE SETS ====================
+
+    async def sadd(self, key: str, *members: Any) -> int:
+        """Agregar miembros a un set"""
+        try:
+            return await self.client.sadd(key, *members)
+        except Exception as e:
+            logger.error(f"Error en sadd({key}): {e}")
+            return 0
+
+    async def srem(self, key: str, *members: Any) -> int:
+        """Eliminar miembros de un set"""
+        try:
+            return await self.client.srem(key, *members)
+        except Exception as e:
+            logger.error(f"Error en srem({key}): {e}")
+            return 0
+
+    async def smembers(self, key: str) -> set:
+        """Obtener todos los miembros de un set"""
+        try:
+            return await self.client.smembers(key)
+        except Exception as e:
+            logger.error(f"Error en smembers({key}): {e}")
+            return set()
+
+    async def sismember(self, key: str, member: Any) -> bool:
+        """Verificar si un miembro está en el set"""
+        try:
+            return bool(await self.client.sismember(key, member))
+        except Exception as e:
+            logger.error(f"Error en sismember({key}): {e}")
+            return False
+
+    async def scard(self, key: str) -> int:
+        """Obtener número de miembros en un set"""
+        try:
+            return await self.client.scard(key)
+        except Exception as e:
+            logger.error(f"Error en scard({key}): {e}")
+            return 0
+
+    # ==================== PUB/SUB (para WebSockets) ====================
+
+    async def publish(self, channel: str, message: Any) -> int:
+        """Publicar mensaje en un canal"""
+        try:
+            return await self.client.publish(channel, _serialize(message))
+        except Exception as e:
+            logger.error(f"Error en publish({channel}): {e}")
+            return 0
+
+    def pubsub(self) -> "redis.asyncio.client.PubSub":
+        """
+        Crear un objeto PubSub asyncio
+
+        Al suscribirse toma una conexión dedicada del pool compartido.
+        """
+        return self.client.pubsub()
+
+    # ==================== SCRIPTS Y TRANSACCIONES ====================
+
+    def register_script(self, script: str) -> "redis.commands.core.AsyncScript":
+        """
+        Registrar un script Lua (se ejecuta con EVALSHA, atómico y en un solo round trip)
+
+        Uso: `await script(keys=[...], args=[...])`
+        """
+        return self.client.register_script(script)
+
+    def pipeline(self, transaction: bool = True) -> "redis.asyncio.client.Pipeline":
+        """Crear un pipeline (MULTI/EXEC si transaction=True) sobre el pool compartido"""
+        return self.client.pipeline(transaction=transaction)
+
+    # ==================== STREAMS ====================
+
+    async def xadd(self, key: str, fields: dict) -> Optional[str]:
+        """
+        Agregar una entrada a un stream
+
+        Returns:
+            ID de la entrada o None si falló
+        """
+        try:
+            return await self.client.xadd(key, {k: _serialize(v) for k, v in fields.items()})
+        except Exception as e:
+            logger.error(f"Error en xadd({key}): {e}")
+            return None
+
+    async def xgroup_create(self, key: str, group: str, start_id: str = "0") -> bool:
+        """Crear un consumer group (y el stream si no existe); idempotente"""
+        try:
+            return await self.client.xgroup_create(key, group, id=start_id, mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" in str(e):
+                return True
+            logger.error(f"Error en xgroup_create({key}, {group}): {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Error en xgroup_create({key}, {group}): {e}")
+            return False
+
+    async def xreadgroup(
+        self,
+        group: str,
+        consumer: str,
+        key: str,
+        count: int,
+        block_ms: Optional[int] = None,
+        start_id: str = ">"
+    ) -> List[tuple]:
+        """
+        Leer entradas de un stream como parte de un consumer group
+
+        Args:
+            start_id: ">" para entradas nuevas, "0" para las pendientes de este consumer
+
+        Returns:
+            Lista de (entry_id, fields)
+        """
+        try:
+            response = await self.client.xreadgroup(group, consumer, {key: start_id}, count=count, block=block_ms)
+            return response[0][1] if response else []
+        except Exception as e:
+            logger.error(f"Error en xreadgroup({key}): {e}")
+            return []
+
+    async def xautoclaim(
+        self,
+        key: str,
+        group: str,
+        consumer: str,
+        min_idle_ms: int,
+        count: int
+    ) -> List[tuple]:
+        """
+        Reclamar entradas pendientes de otros consumers inactivos (p.ej. un worker caído)
+
+        Returns:
+            Lista de (entry_id, fields) reclamadas
+        """
+        try:
+            response = await self.client.xautoclaim(key, group, consumer, min_idle_ms, count=count)
+            return [entry for entry in response[1] if entry[1]]
+        except Exception as e:
+            logger.error(f"Error en xautoclaim({key}): {e}")
+            return []
+
+    async def xack(self, key: str, group: str, *entry_ids: str) -> int:
+        """Confirmar entradas procesadas por el consumer group"""
+        try:
+            return await self.client.xack(key, group, *entry_ids)
+        except Exception as e:
+            logger.error(f"Error en xack({key}): {e}")
+            return 0
+
+    async def xdel(self, key: str, *entry_ids: str) -> int:
+        """Eliminar entradas de un stream"""
+        try:
+            return await self.client.xdel(key, *entry_ids)
+        except Exception as e:
+            logger.error(f"Error en xdel({key}): {e}")
+            return 0
+
+    async def xlen(self, key: str) -> int:
+        """Obtener número de entradas de un stream"""
+        try:
+            return await self.client.xlen(key)
+        except Exception as e:
+            logger.error(f"Error en xlen({key}): {e}")
+            return 0
+
+    # ==================== UTILIDADES ====================
+
+    async def ping(self) -> bool:
+        """Verificar conexión a Redis"""
+        try:
+            return await self.client.ping()
+        except Exception as e:
+            logger.error(f"Error en ping: {e}")
+            return False
+
+    async def flushdb(self) -> bool:
+        """ELIMINAR TODA LA BASE DE DATOS (usar solo en desarrollo)"""
+        try:
+            return await self.client.flushdb()
+        except Exception as e:
+            logger.error(f"Error en flushdb: {e}")
+            return False
+
+    async def close(self):
+        """
+        Cerrar las conexiones del pool
+
+        El pool se puede seguir usando después: abrirá conexiones nuevas
+        (necesario cuando cambia el event loop, por ejemplo entre tests).
+        """
+        try:
+            await self.pool.disconnect()
+            logger.info("🔌 Pool asyncio de Redis cerrado")
+        except Exception as e:
+            logger.error(f"Error cerrando pool asyncio: {e}")
+
+
+# Instancia global de Redis (síncrona, para scripts)
 redis_client = RedisClient()
+
+# Instancia global de Redis asyncio (para endpoints, WebSockets y servicios)
+async_redis_client = AsyncRedisClient()
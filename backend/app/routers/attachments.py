@@ -1,19 +1,28 @@
-from fastapi import APIRouter, HTTPException, status, Query, Depends, UploadFile, File
+from fastapi import APIRouter, BackgroundTasks, HTTPException, status, Query, Depends, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from typing import List
-from datetime import datetime
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-import hashlib
-import uuid
-from pathlib import Path
 
-from app.schemas.attachment import AttachmentCreate, AttachmentUpdate, AttachmentResponse
+from app.schemas.attachment import AttachmentCreate, AttachmentUpdate, AttachmentResponse, AttachmentUploadByHash
 from app.models.attachment import Attachment
 from app.models.message import Message
-from app.models.room_participant import RoomParticipant
-from app.models.user import User
-from app.database import get_db
-from app.auth.dependencies import get_current_user
+from app.database import get_async_db, get_db
+from app.auth.dependencies import get_current_principal
+from app.services.user_principal import Principal
+from app.services.message_cache import message_cache
+from app.services.room_membership import room_membership
+from app.services.thumbnails import thumbnail_service
+from app.services.uploads import (
+    UPLOAD_URL_PREFIX,
+    FileTooLargeError,
+    StoredUpload,
+    claim_upload,
+    delete_unreferenced_uploads,
+    find_blob,
+    save_upload,
+)
 
 router = APIRouter(
     prefix="/attachments",
@@ -21,8 +30,6 @@ router = APIRouter(
 )
 
 # Configuración de archivos
-UPLOAD_DIR = Path("uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
 # Tipos de archivo permitidos
@@ -46,20 +53,28 @@ def get_file_type_category(content_type: str) -> str:
     return "document"
 
 
-def generate_hashed_filename(original_filename: str, content: bytes) -> str:
-    """Generar nombre único usando hash del contenido + UUID"""
-    extension = Path(original_filename).suffix.lower()
-    file_hash = hashlib.sha256(content).hexdigest()[:16]
-    unique_id = str(uuid.uuid4())[:8]
-    timestamp = datetime.now().strftime("%Y%m%d")
-    return f"{timestamp}_{file_hash}_{unique_id}{extension}"
+async def build_upload_response(stored: StoredUpload, file_name: str, content_type: str) -> dict:
+    """Respuesta de subida; un blob reutilizado queda protegido hasta que se cree su adjunto"""
+    if not stored.created:
+        await claim_upload(stored.filename)
+
+    return {
+        # URL del archivo (será servida por FastAPI static files)
+        "file_url": f"{UPLOAD_URL_PREFIX}{stored.filename}",
+        "file_name": file_name,
+        "file_type": get_file_type_category(content_type),
+        "file_size": stored.size,
+        "sha256": stored.sha256,
+        "deduplicated": not stored.created
+    }
 
 
 @router.post("/upload", status_code=status.HTTP_201_CREATED)
 async def upload_file(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Subir un archivo al servidor (requiere JWT)
@@ -67,7 +82,10 @@ async def upload_file(
     - **file**: Archivo a subir (imágenes: jpg, png, gif, webp | documentos: pdf, doc, docx)
     - Tamaño máximo: 10MB
 
-    Retorna información del archivo incluyendo file_url para usar en mensajes
+    Retorna información del archivo incluyendo file_url para usar en mensajes.
+    Si el mismo contenido ya estaba subido se reutiliza (deduplicated=true).
+    De las imágenes se genera en segundo plano una miniatura WebP y un blurhash
+    (campos thumbnail_url y blurhash de los adjuntos)
     """
     # Validar tipo MIME
     if file.content_type not in ALLOWED_MIME_TYPES:
@@ -76,48 +94,71 @@ async def upload_file(
             detail=f"File type not allowed. Allowed: images (jpg, png, gif, webp) and documents (pdf, doc, docx)"
         )
 
-    # Leer contenido del archivo
-    contents = await file.read()
-
-    # Validar tamaño
-    if len(contents) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"File too large. Maximum size: {MAX_FILE_SIZE / 1024 / 1024}MB"
-        )
+    file_too_large = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"File too large. Maximum size: {MAX_FILE_SIZE / 1024 / 1024}MB"
+    )
 
-    # Generar nombre hasheado único
-    hashed_filename = generate_hashed_filename(file.filename or "file", contents)
-    file_path = UPLOAD_DIR / hashed_filename
+    # Tamaño conocido al parsear el multipart: rechazar sin copiar nada
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        raise file_too_large
 
-    # Guardar archivo en el servidor
+    # Copiar por bloques a un temporal (hash incremental) y renombrar al blob
     try:
-        with open(file_path, "wb") as f:
-            f.write(contents)
-    except Exception as e:
+        stored = await run_in_threadpool(
+            save_upload, file.file, ALLOWED_MIME_TYPES[file.content_type], MAX_FILE_SIZE
+        )
+    except FileTooLargeError:
+        raise file_too_large
+    except OSError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error saving file: {str(e)}"
         )
 
-    # Determinar categoría del archivo
-    file_type = get_file_type_category(file.content_type)
+    # Vista previa fuera de la petición (no hace nada si el blob ya la tiene)
+    if thumbnail_service.enabled and get_file_type_category(file.content_type) == "image":
+        background_tasks.add_task(thumbnail_service.generate, stored.filename, bind=db.bind)
 
-    # Construir URL del archivo (será servida por FastAPI static files)
-    file_url = f"/uploads/{hashed_filename}"
+    return await build_upload_response(stored, file.filename, file.content_type)
 
-    return {
-        "file_url": file_url,
-        "file_name": file.filename,
-        "file_type": file_type,
-        "file_size": len(contents)
-    }
+
+@router.post("/upload/by-hash")
+async def upload_file_by_hash(
+    upload_data: AttachmentUploadByHash,
+    current_user: Principal = Depends(get_current_principal)
+):
+    """
+    Reutilizar un archivo ya subido sin enviar su contenido (requiere JWT)
+
+    - **sha256**: Hash del contenido calculado por el cliente
+    - **content_type**: Tipo MIME (mismos tipos que /upload)
+
+    Retorna lo mismo que /upload, o 404 si el contenido no está almacenado
+    (el cliente debe subirlo con /upload)
+    """
+    if upload_data.content_type not in ALLOWED_MIME_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"File type not allowed. Allowed: images (jpg, png, gif, webp) and documents (pdf, doc, docx)"
+        )
+
+    stored = await run_in_threadpool(
+        find_blob, upload_data.sha256, ALLOWED_MIME_TYPES[upload_data.content_type]
+    )
+    if stored is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found, upload its content"
+        )
+
+    return await build_upload_response(stored, upload_data.file_name, upload_data.content_type)
 
 
 @router.post("/", response_model=AttachmentResponse, status_code=status.HTTP_201_CREATED)
 async def create_attachment(
     attachment_data: AttachmentCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -150,13 +191,16 @@ async def create_attachment(
     db.commit()
     db.refresh(attachment)
 
+    # Los adjuntos forman parte de los mensajes cacheados de la sala
+    await message_cache.invalidate_room_cache(message.room_id)
+
     return attachment
 
 @router.get("/", response_model=List[AttachmentResponse])
 async def get_attachments(
     message_id: int = Query(None, description="Filtrar por mensaje"),
     file_type: str = Query(None, description="Filtrar por tipo de archivo"),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -177,10 +221,7 @@ async def get_attachments(
             )
 
         # Validar que el usuario es participante de la sala del mensaje
-        is_participant = db.query(RoomParticipant).filter(
-            RoomParticipant.room_id == message.room_id,
-            RoomParticipant.user_id == current_user.id
-        ).first()
+        is_participant = await room_membership.is_member(message.room_id, current_user.id, db)
 
         if not is_participant:
             raise HTTPException(
@@ -205,7 +246,7 @@ async def get_attachments(
 @router.get("/{attachment_id}", response_model=AttachmentResponse)
 async def get_attachment(
     attachment_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -229,10 +270,7 @@ async def get_attachment(
         )
 
     # Validar que el usuario es participante de la sala del mensaje
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == message.room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(message.room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -246,7 +284,7 @@ async def get_attachment(
 async def update_attachment(
     attachment_id: int,
     attachment_data: AttachmentUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -276,6 +314,8 @@ async def update_attachment(
             detail="You can only update attachments of your own messages"
         )
 
+    previous_file_url = attachment.file_url
+
     # Actualizar campos si se proporcionan
     if attachment_data.file_url is not None:
         attachment.file_url = attachment_data.file_url
@@ -286,12 +326,16 @@ async def update_attachment(
     db.commit()
     db.refresh(attachment)
 
+    await message_cache.invalidate_room_cache(message.room_id)
+    if attachment.file_url != previous_file_url:
+        await delete_unreferenced_uploads([previous_file_url], db)
+
     return attachment
 
 @router.delete("/{attachment_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_attachment(
     attachment_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -321,13 +365,18 @@ async def delete_attachment(
             detail="You can only delete attachments of your own messages"
         )
 
+    file_url = attachment.file_url
     db.delete(attachment)
     db.commit()
 
+    await message_cache.invalidate_room_cache(message.room_id)
+    # El blob se conserva mientras otro adjunto lo use
+    await delete_unreferenced_uploads([file_url], db)
+
 @router.get("/message/{message_id}/all", response_model=List[AttachmentResponse])
 async def get_message_attachments(
     message_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -344,10 +393,7 @@ async def get_message_attachments(
         )
 
     # Validar que el usuario es participante de la sala del mensaje
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == message.room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(message.room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -364,7 +410,7 @@ async def get_message_attachments(
 @router.get("/message/{message_id}/count", response_model=dict)
 async def count_message_attachments(
     message_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -381,10 +427,7 @@ async def count_message_attachments(
         )
 
     # Validar que el usuario es participante de la sala del mensaje
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == message.room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(message.room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -397,7 +440,7 @@ async def count_message_attachments(
 
 @router.get("/stats/by-type", response_model=dict)
 async def get_attachments_stats_by_type(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
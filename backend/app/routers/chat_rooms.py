@@ -1,28 +1,37 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, BackgroundTasks, HTTPException, status, Depends, Query, Response
+from fastapi.responses import JSONResponse
 from typing import List
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
-from app.schemas.chat_room import ChatRoomCreate, ChatRoomUpdate, ChatRoomResponse
+from app.schemas.chat_room import ChatRoomCreate, ChatRoomUpdate, ChatRoomResponse, InboxRoomResponse
 from app.schemas.room_participant import RoomParticipantCreate, RoomParticipantResponse
 from app.models.chat_room import ChatRoom
 from app.models.room_participant import RoomParticipant
 from app.models.message import Message
-from app.models.attachment import Attachment
 from app.models.user import User
-from app.database import get_db
-from app.auth.dependencies import get_current_user
+from app.database import get_async_db
+from app.auth.dependencies import get_current_principal, require_room_member
+from app.services.user_principal import Principal
+from app.services.room_membership import room_membership
+from app.services.unread_counter import unread_counter
+from app.services.room_cleanup import room_cleanup
 
 router = APIRouter(
     prefix="/chat-rooms",
     tags=["chat-rooms"]
 )
 
+# Caracteres del último mensaje incluidos en la bandeja de entrada
+INBOX_PREVIEW_LENGTH = 200
+
 @router.post("/", response_model=ChatRoomResponse, status_code=status.HTTP_201_CREATED)
 async def create_chat_room(
     room_data: ChatRoomCreate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Crear una nueva sala de chat (requiere autenticación JWT)
@@ -38,8 +47,8 @@ async def create_chat_room(
     )
 
     db.add(chat_room)
-    db.commit()
-    db.refresh(chat_room)
+    await db.commit()
+    await db.refresh(chat_room)
 
     # Agregar al creador como participante automáticamente
     participant = RoomParticipant(
@@ -48,51 +57,132 @@ async def create_chat_room(
     )
 
     db.add(participant)
-    db.commit()
+    await db.commit()
+
+    # Descartar participantes cacheados para este ID (p.ej. una consulta previa a la creación)
+    await room_membership.invalidate_room(chat_room.id)
 
     return chat_room
 
 @router.get("/", response_model=List[ChatRoomResponse])
-async def get_chat_rooms(is_group: bool = None, db: Session = Depends(get_db)):
+async def get_chat_rooms(is_group: bool = None, db: AsyncSession = Depends(get_async_db)):
     """
     Obtener todas las salas de chat
 
     - **is_group**: Filtrar por tipo de sala (True=grupal, False=1 a 1, None=todas)
     """
-    query = db.query(ChatRoom)
+    query = select(ChatRoom)
 
     # Filtrar por tipo si se especifica
     if is_group is not None:
-        query = query.filter(ChatRoom.is_group == is_group)
+        query = query.where(ChatRoom.is_group == is_group)
 
-    return query.all()
+    return (await db.scalars(query)).all()
 
 @router.get("/my-rooms", response_model=List[ChatRoomResponse])
 async def get_user_rooms(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Obtener todas las salas donde el usuario autenticado es participante (requiere JWT)
     """
     # Obtener todas las salas donde el usuario es participante
-    room_ids = db.query(RoomParticipant.room_id).filter(
-        RoomParticipant.user_id == current_user.id
-    ).all()
-
-    # Extraer los IDs
-    room_ids = [room_id[0] for room_id in room_ids]
+    room_ids = (await db.scalars(
+        select(RoomParticipant.room_id).where(RoomParticipant.user_id == current_user.id)
+    )).all()
 
     # Obtener las salas
-    rooms = db.query(ChatRoom).filter(ChatRoom.id.in_(room_ids)).all()
+    rooms = (await db.scalars(select(ChatRoom).where(ChatRoom.id.in_(room_ids)))).all()
 
     return rooms
 
+@router.get("/inbox", response_model=List[InboxRoomResponse])
+async def get_inbox(
+    limit: int = Query(50, ge=1, le=200, description="Número de salas"),
+    offset: int = Query(0, ge=0, description="Salas a omitir (paginación)"),
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Bandeja de entrada del usuario autenticado (requiere JWT)
+
+    Cada sala con la vista previa de su último mensaje, la fecha de última
+    actividad y el número de mensajes no leídos, ordenadas por actividad
+    (más reciente primero). Salas y últimos mensajes salen de una única
+    consulta SQL; los no leídos, de los contadores de Redis.
+
+    - **limit** / **offset**: Paginación
+    """
+    # Último mensaje visible de cada sala: subconsulta correlacionada que
+    # recorre ix_messages_room_created_live y se detiene en la primera fila
+    last_message_id = (
+        select(Message.id)
+        .where(Message.room_id == RoomParticipant.room_id, Message.is_deleted == False)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+
+    my_rooms = (
+        select(
+            RoomParticipant.room_id,
+            last_message_id.label("last_message_id")
+        )
+        .where(RoomParticipant.user_id == current_user.id)
+        .subquery()
+    )
+
+    last_message = aliased(Message)
+    sender = aliased(User)
+    last_activity = func.coalesce(last_message.created_at, ChatRoom.created_at)
+
+    # Columnas sueltas del último mensaje: sin cargar la entidad (ni sus adjuntos)
+    rows = (await db.execute(
+        select(
+            ChatRoom,
+            last_message.id.label("message_id"),
+            last_message.user_id.label("message_user_id"),
+            sender.username.label("message_username"),
+            func.substr(last_message.content, 1, INBOX_PREVIEW_LENGTH).label("message_content"),
+            last_message.created_at.label("message_created_at"),
+            last_activity.label("last_activity")
+        )
+        .join(my_rooms, my_rooms.c.room_id == ChatRoom.id)
+        .outerjoin(last_message, last_message.id == my_rooms.c.last_message_id)
+        .outerjoin(sender, sender.id == last_message.user_id)
+        .order_by(last_activity.desc(), ChatRoom.id.desc())
+        .limit(limit)
+        .offset(offset)
+    )).all()
+
+    # No leídos desde los contadores de Redis (sin COUNT sobre messages)
+    unread_counts = await unread_counter.get_counts(current_user.id, db)
+
+    return [
+        {
+            "id": row.ChatRoom.id,
+            "name": row.ChatRoom.name,
+            "is_group": row.ChatRoom.is_group,
+            "created_at": row.ChatRoom.created_at,
+            "last_message": {
+                "id": row.message_id,
+                "user_id": row.message_user_id,
+                "username": row.message_username,
+                "content": row.message_content,
+                "created_at": row.message_created_at
+            } if row.message_id is not None else None,
+            "last_activity": row.last_activity,
+            "unread_count": unread_counts.get(row.ChatRoom.id, 0)
+        }
+        for row in rows
+    ]
+
 @router.get("/{room_id}", response_model=ChatRoomResponse)
 async def get_chat_room(
     room_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Obtener una sala de chat por ID (requiere JWT y validación de acceso)
@@ -100,7 +190,7 @@ async def get_chat_room(
     - **room_id**: ID de la sala
     """
     # Verificar que la sala existe
-    chat_room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
+    chat_room = await db.get(ChatRoom, room_id)
     if not chat_room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -108,10 +198,7 @@ async def get_chat_room(
         )
 
     # Verificar que el usuario es participante de la sala
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -125,8 +212,8 @@ async def get_chat_room(
 async def update_chat_room(
     room_id: int,
     room_data: ChatRoomUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Actualizar una sala de chat (requiere JWT y validación de acceso)
@@ -135,7 +222,7 @@ async def update_chat_room(
     - **room_data**: Datos a actualizar
     """
     # Verificar que la sala existe
-    chat_room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
+    chat_room = await db.get(ChatRoom, room_id)
     if not chat_room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -143,10 +230,7 @@ async def update_chat_room(
         )
 
     # Verificar que el usuario es participante de la sala
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -161,26 +245,29 @@ async def update_chat_room(
     if room_data.is_group is not None:
         chat_room.is_group = room_data.is_group
 
-    db.commit()
-    db.refresh(chat_room)
+    await db.commit()
+    await db.refresh(chat_room)
 
     return chat_room
 
 @router.delete("/{room_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_chat_room(
     room_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Eliminar una sala de chat (requiere JWT y validación de acceso)
 
     - **room_id**: ID de la sala
 
-    Elimina en cascada: attachments → messages → participants → chat_room
+    La sala deja de ser accesible al instante (se eliminan sus participantes).
+    Mensajes, adjuntos y archivos subidos se borran por lotes: en la misma
+    petición si la sala es pequeña (204) o en segundo plano si no (202).
     """
     # Verificar que la sala existe
-    chat_room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
+    chat_room = await db.get(ChatRoom, room_id)
     if not chat_room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -188,10 +275,7 @@ async def delete_chat_room(
         )
 
     # Verificar que el usuario es participante de la sala
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -199,24 +283,17 @@ async def delete_chat_room(
             detail="You are not a participant of this chat room"
         )
 
-    # Eliminar todo en el orden correcto para evitar violaciones de foreign key
+    fits_in_one_batch = await room_cleanup.start_deletion(room_id, db)
 
-    # 1. Obtener todos los mensajes de este room
-    messages = db.query(Message).filter(Message.room_id == room_id).all()
+    if fits_in_one_batch:
+        await room_cleanup.purge_room(room_id, bind=db.bind)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
 
-    # 2. Para cada mensaje, eliminar sus attachments
-    for message in messages:
-        db.query(Attachment).filter(Attachment.message_id == message.id).delete()
-
-    # 3. Eliminar todos los mensajes
-    db.query(Message).filter(Message.room_id == room_id).delete()
-
-    # 4. Eliminar todos los participantes
-    db.query(RoomParticipant).filter(RoomParticipant.room_id == room_id).delete()
-
-    # 5. Finalmente eliminar el chat room
-    db.delete(chat_room)
-    db.commit()
+    background_tasks.add_task(room_cleanup.purge_room, room_id, bind=db.bind)
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"room_id": room_id, "status": "deleting"}
+    )
 
 # --- ENDPOINTS DE GESTIÓN DE PARTICIPANTES ---
 
@@ -224,8 +301,8 @@ async def delete_chat_room(
 async def add_participant(
     room_id: int,
     user_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Agregar un participante a una sala (requiere JWT)
@@ -236,7 +313,7 @@ async def add_participant(
     Solo los participantes actuales de una sala pueden agregar nuevos participantes
     """
     # Verificar que la sala existe
-    chat_room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
+    chat_room = await db.get(ChatRoom, room_id)
     if not chat_room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -244,10 +321,7 @@ async def add_participant(
         )
 
     # Verificar que el usuario autenticado es participante de la sala
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -256,7 +330,7 @@ async def add_participant(
         )
 
     # Verificar que el usuario a agregar existe
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -264,10 +338,10 @@ async def add_participant(
         )
 
     # Verificar que no sea ya participante
-    existing = db.query(RoomParticipant).filter(
+    existing = await db.scalar(select(RoomParticipant).where(
         RoomParticipant.room_id == room_id,
         RoomParticipant.user_id == user_id
-    ).first()
+    ))
 
     if existing:
         raise HTTPException(
@@ -282,8 +356,12 @@ async def add_participant(
     )
 
     db.add(participant)
-    db.commit()
-    db.refresh(participant)
+    await db.commit()
+    await db.refresh(participant)
+
+    await room_membership.invalidate_room(room_id)
+    # Sus contadores no incluyen el historial de la sala: se recalculan
+    await unread_counter.invalidate([user_id])
 
     return participant
 
@@ -291,8 +369,8 @@ async def add_participant(
 async def remove_participant(
     room_id: int,
     user_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(require_room_member),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Remover un participante de una sala (requiere JWT)
@@ -302,23 +380,11 @@ async def remove_participant(
 
     Solo los participantes de una sala pueden remover participantes (incluido a sí mismos)
     """
-    # Verificar que el usuario autenticado es participante de la sala
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
-
-    if not is_participant:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You are not a participant of this chat room"
-        )
-
     # Buscar al participante a remover
-    participant = db.query(RoomParticipant).filter(
+    participant = await db.scalar(select(RoomParticipant).where(
         RoomParticipant.room_id == room_id,
         RoomParticipant.user_id == user_id
-    ).first()
+    ))
 
     if not participant:
         raise HTTPException(
@@ -326,14 +392,16 @@ async def remove_participant(
             detail="Participant not found in this room"
         )
 
-    db.delete(participant)
-    db.commit()
+    await db.delete(participant)
+    await db.commit()
+
+    await room_membership.invalidate_room(room_id)
 
 @router.get("/{room_id}/participants", response_model=List[RoomParticipantResponse])
 async def get_room_participants(
     room_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Obtener todos los participantes de una sala (requiere JWT)
@@ -343,7 +411,7 @@ async def get_room_participants(
     Solo los participantes de una sala pueden ver la lista de participantes
     """
     # Verificar que la sala existe
-    chat_room = db.query(ChatRoom).filter(ChatRoom.id == room_id).first()
+    chat_room = await db.get(ChatRoom, room_id)
     if not chat_room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -351,10 +419,7 @@ async def get_room_participants(
         )
 
     # Verificar que el usuario autenticado es participante de la sala
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -362,8 +427,8 @@ async def get_room_participants(
             detail="You are not a participant of this chat room"
         )
 
-    participants = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == room_id
-    ).all()
+    participants = (await db.scalars(
+        select(RoomParticipant).where(RoomParticipant.room_id == room_id)
+    )).all()
 
     return participants
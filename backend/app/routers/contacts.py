@@ -1,24 +1,29 @@
 from fastapi import APIRouter, HTTPException, status, Depends, Query
-from typing import List
+from typing import List, Optional
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, case, exists, func
 
 from app.schemas.contact import ContactCreate, ContactUpdate, ContactResponse, ContactWithUser
 from app.schemas.user import UserResponse
 from app.models.contact import Contact
 from app.models.user import User
 from app.database import get_db
-from app.auth.dependencies import get_current_user
+from app.auth.dependencies import get_current_principal
+from app.services.user_principal import Principal
+from app.services.contact_cache import contact_list_cache
 
 router = APIRouter(
     prefix="/contacts",
     tags=["contacts"]
 )
 
+# Longitud mínima para buscar por subcadena (los trigramas necesitan 3 caracteres)
+SEARCH_MIN_SUBSTRING_LENGTH = 3
+
 @router.post("/", response_model=ContactResponse, status_code=status.HTTP_201_CREATED)
 async def send_contact_request(
     contact_data: ContactCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -81,93 +86,103 @@ async def send_contact_request(
         db.add(reverse_contact)
         db.commit()
 
+    await contact_list_cache.invalidate(current_user.id, contact_data.contact_id)
+
     return new_contact
 
+# Listas de contactos: (columna del dueño de la lista, columna del otro usuario, estado)
+CONTACT_LISTS = {
+    "accepted": (Contact.user_id, Contact.contact_id, "accepted"),
+    "pending": (Contact.contact_id, Contact.user_id, "pending"),
+    "sent": (Contact.user_id, Contact.contact_id, "pending"),
+}
+
+async def _list_contacts(list_name: str, user_id: int, limit: Optional[int], offset: int, db: Session) -> List[dict]:
+    """
+    Página de una lista de contactos con los datos del otro usuario (limit None = completa)
+
+    Una sola consulta (contacts JOIN users) por página; la página serializada
+    se cachea en Redis hasta que cambie alguna relación del usuario.
+    """
+    cached = await contact_list_cache.get_page(user_id, list_name, limit, offset)
+    if cached is not None:
+        return cached
+
+    # Versión antes de leer la DB: un cambio concurrente descarta esta página
+    version = await contact_list_cache.get_version(user_id)
+
+    owner_column, other_column, contact_status = CONTACT_LISTS[list_name]
+    rows = db.query(Contact, User).join(User, User.id == other_column).filter(
+        owner_column == user_id,
+        Contact.status == contact_status
+    ).order_by(Contact.created_at.desc(), Contact.id.desc()).limit(limit).offset(offset).all()
+
+    items = [
+        ContactWithUser.model_validate({
+            **contact.to_dict(),
+            "contact": UserResponse.model_validate(contact_user)
+        }).model_dump(mode="json")
+        for contact, contact_user in rows
+    ]
+
+    await contact_list_cache.set_page(user_id, list_name, limit, offset, items, version)
+    return items
+
 @router.get("/my-contacts", response_model=List[ContactWithUser])
 async def get_my_contacts(
-    current_user: User = Depends(get_current_user),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Número máximo de contactos (por defecto todos)"),
+    offset: int = Query(0, ge=0, description="Contactos a omitir (paginación)"),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
-    Obtener todos mis contactos aceptados (requiere JWT)
+    Obtener mis contactos aceptados (requiere JWT)
+
+    Retorna solo contactos con status='accepted', más recientes primero
 
-    Retorna solo contactos con status='accepted'
+    - **limit** / **offset**: Paginación opcional (sin limit se devuelve la lista completa)
     """
-    contacts = db.query(Contact).filter(
-        Contact.user_id == current_user.id,
-        Contact.status == "accepted"
-    ).all()
-
-    # Enriquecer con información del usuario
-    result = []
-    for contact in contacts:
-        contact_user = db.query(User).filter(User.id == contact.contact_id).first()
-        if contact_user:
-            contact_dict = contact.to_dict()
-            contact_dict['contact'] = contact_user
-            result.append(contact_dict)
-
-    return result
+    return await _list_contacts("accepted", current_user.id, limit, offset, db)
 
 @router.get("/pending", response_model=List[ContactWithUser])
 async def get_pending_requests(
-    current_user: User = Depends(get_current_user),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Número máximo de solicitudes (por defecto todas)"),
+    offset: int = Query(0, ge=0, description="Solicitudes a omitir (paginación)"),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     Obtener solicitudes de contacto pendientes RECIBIDAS (requiere JWT)
 
-    Retorna solicitudes recibidas con status='pending'
+    Retorna solicitudes recibidas con status='pending' y los datos de quien la envió
+
+    - **limit** / **offset**: Paginación opcional (sin limit se devuelve la lista completa)
     """
     # Solicitudes donde YO soy el contacto (contact_id) y están pendientes
-    pending_requests = db.query(Contact).filter(
-        Contact.contact_id == current_user.id,
-        Contact.status == "pending"
-    ).all()
-
-    # Enriquecer con información del usuario que envió la solicitud
-    result = []
-    for contact in pending_requests:
-        requester_user = db.query(User).filter(User.id == contact.user_id).first()
-        if requester_user:
-            contact_dict = contact.to_dict()
-            contact_dict['contact'] = requester_user
-            result.append(contact_dict)
-
-    return result
+    return await _list_contacts("pending", current_user.id, limit, offset, db)
 
 @router.get("/sent", response_model=List[ContactWithUser])
 async def get_sent_requests(
-    current_user: User = Depends(get_current_user),
+    limit: Optional[int] = Query(None, ge=1, le=500, description="Número máximo de solicitudes (por defecto todas)"),
+    offset: int = Query(0, ge=0, description="Solicitudes a omitir (paginación)"),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     Obtener solicitudes de contacto ENVIADAS (requiere JWT)
 
     Retorna solicitudes enviadas con status='pending'
+
+    - **limit** / **offset**: Paginación opcional (sin limit se devuelve la lista completa)
     """
     # Solicitudes donde YO soy el que envió (user_id) y están pendientes
-    sent_requests = db.query(Contact).filter(
-        Contact.user_id == current_user.id,
-        Contact.status == "pending"
-    ).all()
-
-    # Enriquecer con información del usuario al que envié la solicitud
-    result = []
-    for contact in sent_requests:
-        contact_user = db.query(User).filter(User.id == contact.contact_id).first()
-        if contact_user:
-            contact_dict = contact.to_dict()
-            contact_dict['contact'] = contact_user
-            result.append(contact_dict)
-
-    return result
+    return await _list_contacts("sent", current_user.id, limit, offset, db)
 
 @router.put("/{contact_id}", response_model=ContactResponse)
 async def update_contact_status(
     contact_id: int,
     contact_update: ContactUpdate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -217,12 +232,14 @@ async def update_contact_status(
     db.commit()
     db.refresh(contact)
 
+    await contact_list_cache.invalidate(contact.user_id, contact.contact_id)
+
     return contact
 
 @router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_contact(
     contact_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -255,36 +272,82 @@ async def delete_contact(
     if reverse_contact:
         db.delete(reverse_contact)
 
+    user_ids = (contact.user_id, contact.contact_id)
     db.delete(contact)
     db.commit()
 
+    await contact_list_cache.invalidate(*user_ids)
+
+def _escape_like(value: str) -> str:
+    """Escapar los comodines de LIKE para buscar el texto literal"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
 #TODO mejorar el nombre del enpoint
 @router.get("/search-public-users", response_model=List[UserResponse])
 async def search_public_users(
     query: str = Query(..., min_length=1, description="Search query (username or email)"),
-    current_user: User = Depends(get_current_user),
+    limit: int = Query(20, ge=1, le=50, description="Número máximo de resultados"),
+    after: Optional[str] = Query(None, description="Username del último resultado de la página anterior"),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     Buscar todos los usuarios para agregar como contactos (requiere JWT)
 
     - No incluye al usuario actual
-    - No incluye usuarios que ya son contactos
+    - No incluye usuarios con los que ya hay una relación de contacto (en cualquier sentido)
+    - Orden: coincidencia exacta, prefijo de username, prefijo de email y luego el resto
+    - **after**: Paginación keyset; enviar el username del último resultado
+
+    En PostgreSQL las búsquedas usan los índices trigram sobre lower(username)/lower(email).
+    Con menos de SEARCH_MIN_SUBSTRING_LENGTH caracteres solo se buscan prefijos
+    (una subcadena tan corta coincide con casi toda la tabla).
     """
-    # Buscar usuarios públicos que coincidan con la búsqueda
-    public_users = db.query(User).filter(
-        User.id != current_user.id,
-        or_(
-            User.username.ilike(f"%{query}%"),
-            User.email.ilike(f"%{query}%")
-        )
-    ).limit(20).all()
+    term = query.strip().lower()
+    if not term:
+        return []
+    prefix = f"{_escape_like(term)}%"
+
+    # lower(columna) LIKE: es la expresión que indexa la migración de búsqueda
+    username = func.lower(User.username)
+    email = func.lower(User.email)
+
+    rank = case(
+        (username == term, 0),
+        (username.like(prefix, escape="\\"), 1),
+        (email.like(prefix, escape="\\"), 2),
+        else_=3
+    )
 
-    # Filtrar usuarios que ya son contactos
-    my_contact_ids = [c.contact_id for c in db.query(Contact).filter(
-        Contact.user_id == current_user.id
-    ).all()]
+    if len(term) >= SEARCH_MIN_SUBSTRING_LENGTH:
+        substring = f"%{_escape_like(term)}%"
+        matches = or_(username.like(substring, escape="\\"), email.like(substring, escape="\\"))
+    else:
+        matches = or_(username.like(prefix, escape="\\"), email.like(prefix, escape="\\"))
 
-    filtered_users = [user for user in public_users if user.id not in my_contact_ids]
+    # Anti-join en SQL: sin cargar los contactos del usuario en memoria
+    existing_contact = exists().where(or_(
+        and_(Contact.user_id == current_user.id, Contact.contact_id == User.id),
+        and_(Contact.user_id == User.id, Contact.contact_id == current_user.id)
+    ))
+
+    search = db.query(User).filter(
+        User.id != current_user.id,
+        matches,
+        ~existing_contact
+    )
+
+    # Keyset por (rank, username): el rank del ancla se calcula con la misma expresión
+    if after is not None:
+        after_rank = db.query(rank).filter(User.username == after).scalar()
+        if after_rank is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cursor user not found"
+            )
+        search = search.filter(or_(
+            rank > after_rank,
+            and_(rank == after_rank, User.username > after)
+        ))
 
-    return filtered_users
+    return search.order_by(rank, User.username).limit(limit).all()
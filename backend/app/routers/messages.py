@@ -1,18 +1,20 @@
 from fastapi import APIRouter, HTTPException, status, Query, Depends
-from typing import List
+from typing import List, Optional
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 import logging
 
-from app.schemas.message import MessageCreate, MessageCreateRequest, MessageUpdate, MessageResponse
+from app.schemas.message import MessageCreate, MessageCreateRequest, MessageUpdate, MessageResponse, MessagePage, MessageReadResponse
 from app.models.message import Message
 from app.models.attachment import Attachment
-from app.models.room_participant import RoomParticipant
 from app.models.chat_room import ChatRoom
-from app.models.user import User
-from app.database import get_db
+from app.database import get_async_db
 from app.services.message_cache import message_cache
-from app.auth.dependencies import get_current_user
+from app.services.room_membership import room_membership
+from app.services.unread_counter import unread_counter
+from app.auth.dependencies import get_current_principal, require_room_member
+from app.services.user_principal import Principal
 
 logger = logging.getLogger(__name__)
 
@@ -21,11 +23,56 @@ router = APIRouter(
     tags=["messages"]
 )
 
+
+async def _apply_keyset(
+    query,
+    db: AsyncSession,
+    before_id: Optional[int],
+    after_id: Optional[int],
+    room_id: Optional[int] = None
+):
+    """
+    Aplicar paginación keyset por (created_at, id) a partir de un mensaje ancla
+
+    Solo se leen las filas de la página (O(limit) con índice), sin OFFSET.
+    Con room_id el ancla debe pertenecer a esa sala (si no, 400 como un
+    cursor inexistente).
+
+    Returns:
+        (query, ascending): query filtrada y ordenada, y si el orden es ascendente (after_id)
+    """
+    if before_id is not None and after_id is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Use before_id or after_id, not both"
+        )
+
+    if before_id is None and after_id is None:
+        return query.order_by(Message.created_at.desc(), Message.id.desc()), False
+
+    # Posición del ancla: los IDs no son necesariamente crecientes en el tiempo
+    anchor_query = select(Message.created_at, Message.id).where(
+        Message.id == (before_id if before_id is not None else after_id)
+    )
+    if room_id is not None:
+        anchor_query = anchor_query.where(Message.room_id == room_id)
+    anchor = (await db.execute(anchor_query)).first()
+    if anchor is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor message not found"
+        )
+
+    position = tuple_(Message.created_at, Message.id)
+    if before_id is not None:
+        return query.where(position < tuple_(*anchor)).order_by(Message.created_at.desc(), Message.id.desc()), False
+    return query.where(position > tuple_(*anchor)).order_by(Message.created_at.asc(), Message.id.asc()), True
+
 @router.post("/", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
 async def create_message(
     message_data: MessageCreateRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Crear un nuevo mensaje (requiere JWT y validación de acceso)
@@ -34,7 +81,7 @@ async def create_message(
     Puede incluir adjuntos opcionales que se crearán junto con el mensaje.
     """
     # Validar que la sala existe
-    room = db.query(ChatRoom).filter(ChatRoom.id == message_data.room_id).first()
+    room = await db.get(ChatRoom, message_data.room_id)
     if not room:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -42,10 +89,7 @@ async def create_message(
         )
 
     # Validar que el usuario es participante de la sala
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == message_data.room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(message_data.room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -62,7 +106,7 @@ async def create_message(
     )
 
     db.add(message)
-    db.flush()  # Obtener el ID sin hacer commit aún
+    await db.flush()  # Obtener el ID sin hacer commit aún
 
     # Crear adjuntos si existen
     if message_data.attachments:
@@ -75,25 +119,19 @@ async def create_message(
             db.add(attachment)
 
     # Hacer commit de todo en una transacción
-    db.commit()
-    db.refresh(message)
+    await db.commit()
+    await db.refresh(message)
 
     # Cachear mensaje en Redis
     try:
-        message_dict = {
-            "id": message.id,
-            "room_id": message.room_id,
-            "user_id": message.user_id,
-            "content": message.content,
-            "created_at": message.created_at.isoformat(),
-            "updated_at": message.updated_at.isoformat() if message.updated_at else None,
-            "is_deleted": message.is_deleted
-        }
-        message_cache.cache_message(message.room_id, message_dict)
+        await message_cache.cache_message(message.room_id, message_cache.serialize_message(message))
     except Exception as e:
         logger.warning(f"No se pudo cachear mensaje {message.id}: {e}")
         # No fallar la request si falla el caché
 
+    # Un no leído más para el resto de participantes
+    await unread_counter.notify_new_message(message.room_id, current_user.id, db)
+
     return message
 
 @router.get("/", response_model=List[MessageResponse])
@@ -101,8 +139,11 @@ async def get_messages(
     room_id: int = Query(None, description="Filtrar por sala de chat"),
     user_id: int = Query(None, description="Filtrar por usuario"),
     include_deleted: bool = Query(False, description="Incluir mensajes eliminados"),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    before_id: Optional[int] = Query(None, description="Mensajes anteriores a este ID (paginación keyset)"),
+    after_id: Optional[int] = Query(None, description="Mensajes posteriores a este ID (paginación keyset)"),
+    limit: int = Query(100, ge=1, le=500, description="Número máximo de mensajes"),
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Obtener mensajes con filtros opcionales (requiere JWT y validación de acceso)
@@ -110,13 +151,12 @@ async def get_messages(
     - **room_id**: Filtrar por sala específica
     - **user_id**: Filtrar por autor
     - **include_deleted**: Incluir mensajes marcados como eliminados
+    - **before_id** / **after_id**: Paginación keyset a partir de un mensaje
+    - **limit**: Tamaño de página (más recientes primero)
     """
     # Si se filtra por room_id, validar que el usuario es participante
     if room_id is not None:
-        is_participant = db.query(RoomParticipant).filter(
-            RoomParticipant.room_id == room_id,
-            RoomParticipant.user_id == current_user.id
-        ).first()
+        is_participant = await room_membership.is_member(room_id, current_user.id, db)
 
         if not is_participant:
             raise HTTPException(
@@ -124,35 +164,40 @@ async def get_messages(
                 detail="You are not a participant of this chat room"
             )
 
-    query = db.query(Message)
+    query = select(Message)
 
     # Aplicar filtros
     if room_id is not None:
-        query = query.filter(Message.room_id == room_id)
+        query = query.where(Message.room_id == room_id)
 
     if user_id is not None:
-        query = query.filter(Message.user_id == user_id)
+        query = query.where(Message.user_id == user_id)
 
     if not include_deleted:
-        query = query.filter(Message.is_deleted == False)
+        query = query.where(Message.is_deleted == False)
+
+    # Ordenar por fecha de creación y paginar desde el cursor
+    query, ascending = await _apply_keyset(query, db, before_id, after_id, room_id)
 
-    # Ordenar por fecha de creación (más recientes primero)
-    query = query.order_by(Message.created_at.desc())
+    # unique(): attachments se cargan con joined eager loading
+    result = await db.execute(query.limit(limit))
+    messages = result.unique().scalars().all()
 
-    return query.all()
+    # Respuesta siempre con los más recientes primero
+    return list(reversed(messages)) if ascending else messages
 
 @router.get("/{message_id}", response_model=MessageResponse)
 async def get_message(
     message_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Obtener un mensaje por ID (requiere JWT y validación de acceso)
 
     - **message_id**: ID del mensaje
     """
-    message = db.query(Message).filter(Message.id == message_id).first()
+    message = await db.get(Message, message_id)
     if not message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -160,10 +205,7 @@ async def get_message(
         )
 
     # Validar que el usuario es participante de la sala del mensaje
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == message.room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(message.room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -177,8 +219,8 @@ async def get_message(
 async def update_message(
     message_id: int,
     message_data: MessageUpdate,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Actualizar el contenido de un mensaje (requiere JWT)
@@ -188,7 +230,7 @@ async def update_message(
 
     Solo el autor del mensaje puede editarlo
     """
-    message = db.query(Message).filter(Message.id == message_id).first()
+    message = await db.get(Message, message_id)
     if not message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -213,8 +255,11 @@ async def update_message(
     message.content = message_data.content
     message.updated_at = datetime.now()
 
-    db.commit()
-    db.refresh(message)
+    await db.commit()
+    await db.refresh(message)
+
+    # El caché de la sala tiene el contenido anterior
+    await message_cache.invalidate_room_cache(message.room_id)
 
     return message
 
@@ -222,8 +267,8 @@ async def update_message(
 async def delete_message(
     message_id: int,
     soft_delete: bool = Query(True, description="Soft delete (marcar como eliminado) o hard delete"),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Eliminar un mensaje (requiere JWT)
@@ -234,7 +279,7 @@ async def delete_message(
 
     Solo el autor del mensaje puede eliminarlo
     """
-    message = db.query(Message).filter(Message.id == message_id).first()
+    message = await db.get(Message, message_id)
     if not message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -252,17 +297,21 @@ async def delete_message(
         # Soft delete: marcar como eliminado
         message.is_deleted = True
         message.updated_at = datetime.now()
-        db.commit()
+        await db.commit()
     else:
         # Hard delete: eliminar completamente
-        db.delete(message)
-        db.commit()
+        await db.delete(message)
+        await db.commit()
+
+    # El mensaje ya no debe aparecer en /latest ni contar como no leído
+    await message_cache.invalidate_room_cache(message.room_id)
+    await unread_counter.invalidate_room(message.room_id, db)
 
 @router.post("/{message_id}/restore", response_model=MessageResponse)
 async def restore_message(
     message_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Restaurar un mensaje eliminado (requiere JWT)
@@ -271,7 +320,7 @@ async def restore_message(
 
     Solo el autor del mensaje puede restaurarlo
     """
-    message = db.query(Message).filter(Message.id == message_id).first()
+    message = await db.get(Message, message_id)
     if not message:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -294,8 +343,12 @@ async def restore_message(
     message.is_deleted = False
     message.updated_at = datetime.now()
 
-    db.commit()
-    db.refresh(message)
+    await db.commit()
+    await db.refresh(message)
+
+    # El mensaje restaurado vuelve a formar parte de los recientes (y de los no leídos)
+    await message_cache.invalidate_room_cache(message.room_id)
+    await unread_counter.invalidate_room(message.room_id, db)
 
     return message
 
@@ -303,8 +356,8 @@ async def restore_message(
 async def get_latest_messages(
     room_id: int,
     limit: int = Query(50, ge=1, le=100, description="Número de mensajes recientes"),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(require_room_member),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Obtener los últimos N mensajes de una sala (requiere JWT y validación de acceso)
@@ -312,46 +365,104 @@ async def get_latest_messages(
     - **room_id**: ID de la sala
     - **limit**: Número de mensajes a obtener
 
-    Usa caché Redis para mejor rendimiento. Si no hay caché,
-    consulta la DB y actualiza el caché.
+    Read-through: si el caché de la sala está poblado se responde desde
+    Redis sin tocar la DB (también si la sala no tiene mensajes). Si no hay
+    caché, consulta la DB y lo puebla.
     """
-    # Validar que el usuario es participante de la sala
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    # Caché caliente: contiene los últimos MAX_CACHED_MESSAGES mensajes de la sala
+    if limit <= message_cache.MAX_CACHED_MESSAGES:
+        cached = await message_cache.get_cached_messages(room_id, limit)
+        if cached is not None:
+            # El caché va del más reciente al más antiguo: devolver en orden cronológico
+            return list(reversed(cached))
+
+    # Versión del caché antes de leer la DB: si entra un mensaje mientras tanto no se pisa
+    cache_version = await message_cache.get_cache_version(room_id)
+
+    # Miss: consultar DB (orden descendente para obtener los más recientes primero).
+    # Se leen al menos MAX_CACHED_MESSAGES para que el caché sirva cualquier limit después
+    result = await db.execute(
+        select(Message).where(
+            Message.room_id == room_id,
+            Message.is_deleted == False
+        ).order_by(Message.created_at.desc(), Message.id.desc()).limit(max(limit, message_cache.MAX_CACHED_MESSAGES))
+    )
+    messages = result.unique().scalars().all()
 
-    if not is_participant:
+    # Poblar caché con resultados de la DB
+    try:
+        await message_cache.update_cache_with_db_messages(
+            room_id,
+            [message_cache.serialize_message(msg) for msg in messages[:message_cache.MAX_CACHED_MESSAGES]],
+            version=cache_version
+        )
+    except Exception as e:
+        logger.warning(f"No se pudo actualizar caché: {e}")
+
+    # Invertir el orden para mostrarlos cronológicamente (más antiguo primero)
+    return list(reversed(messages[:limit]))
+
+@router.post("/room/{room_id}/read", response_model=MessageReadResponse)
+async def mark_room_read(
+    room_id: int,
+    message_id: Optional[int] = Query(None, description="Último mensaje leído (por defecto el más reciente)"),
+    current_user: Principal = Depends(require_room_member),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Marcar una sala como leída (requiere JWT y validación de acceso)
+
+    - **room_id**: ID de la sala
+    - **message_id**: Mensaje hasta el que se leyó; sin él, hasta el último
+
+    Avanza el cursor de lectura del usuario y reinicia su contador de no leídos.
+    Equivale al evento WebSocket `read`.
+    """
+    result = await unread_counter.mark_read(room_id, current_user.id, db, message_id=message_id)
+    if result is None:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You are not a participant of this chat room"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Message not found in this chat room"
         )
 
-    # Consultar DB (orden descendente para obtener los más recientes primero)
-    messages = db.query(Message).filter(
-        Message.room_id == room_id,
-        Message.is_deleted == False
-    ).order_by(Message.created_at.desc()).limit(limit).all()
+    return result
 
-    # Invertir el orden para mostrarlos cronológicamente (más antiguo primero)
-    messages = list(reversed(messages))
+@router.get("/room/{room_id}/history", response_model=MessagePage)
+async def get_message_history(
+    room_id: int,
+    before_id: Optional[int] = Query(None, description="Mensajes anteriores a este ID (scroll hacia atrás)"),
+    after_id: Optional[int] = Query(None, description="Mensajes posteriores a este ID (ponerse al día)"),
+    limit: int = Query(50, ge=1, le=100, description="Tamaño de página"),
+    current_user: Principal = Depends(require_room_member),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Historial paginado de una sala con cursor (requiere JWT y validación de acceso)
 
-    # Actualizar caché con resultados de la DB
-    try:
-        messages_dict = [
-            {
-                "id": msg.id,
-                "room_id": msg.room_id,
-                "user_id": msg.user_id,
-                "content": msg.content,
-                "created_at": msg.created_at.isoformat(),
-                "updated_at": msg.updated_at.isoformat() if msg.updated_at else None,
-                "is_deleted": msg.is_deleted
-            }
-            for msg in messages
-        ]
-        message_cache.update_cache_with_db_messages(room_id, messages_dict)
-    except Exception as e:
-        logger.warning(f"No se pudo actualizar caché: {e}")
+    - **before_id**: Página de mensajes más antiguos que este (scroll infinito)
+    - **after_id**: Página de mensajes más nuevos que este
+    - Sin cursor: la página más reciente
 
-    return messages
+    Los mensajes se devuelven en orden cronológico. `next_cursor` es el ID a
+    enviar en la siguiente petición con el mismo parámetro (before_id o after_id).
+    """
+    query = select(Message).where(
+        Message.room_id == room_id,
+        Message.is_deleted == False
+    )
+    query, ascending = await _apply_keyset(query, db, before_id, after_id, room_id)
+
+    # Pedir una fila extra para saber si hay más páginas
+    result = await db.execute(query.limit(limit + 1))
+    messages = result.unique().scalars().all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    # El último de la página en el orden de lectura es el cursor de la siguiente
+    next_cursor = messages[-1].id if has_more else None
+
+    return {
+        "messages": messages if ascending else list(reversed(messages)),
+        "next_cursor": next_cursor,
+        "has_more": has_more
+    }
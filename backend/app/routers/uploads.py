@@ -0,0 +1,140 @@
+import os
+import re
+from mimetypes import guess_type
+from stat import S_ISREG
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, RedirectResponse
+
+from app.services.storage import IMMUTABLE_CACHE_CONTROL, storage
+from app.services.uploads import UPLOAD_URL_PREFIX, get_upload_key
+
+router = APIRouter(
+    prefix="/uploads",
+    tags=["uploads"]
+)
+
+# Tiempo que el cliente puede reutilizar la redirección (la URL prefirmada sigue siendo válida)
+REDIRECT_MAX_AGE = getattr(storage, "presigned_url_ttl", 0) // 2
+
+# Detrás de nginx: delegar el envío con X-Accel-Redirect a esta location `internal`
+# (alias al directorio de uploads). nginx usa sendfile y resuelve los rangos; vacío = desactivado
+UPLOADS_ACCEL_REDIRECT_PREFIX = os.getenv("UPLOADS_ACCEL_REDIRECT_PREFIX", "")
+
+# Archivos con nombre no derivado del contenido (miniaturas, subidas antiguas)
+MUTABLE_CACHE_CONTROL = "public, max-age=86400"
+
+# Nombre direccionado por contenido: SHA-256 completo + extensión
+CONTENT_ADDRESSED_KEY = re.compile(r"^([0-9a-f]{64})\.[A-Za-z0-9]+$")
+
+
+class UploadFileResponse(FileResponse):
+    """FileResponse con bloques de lectura más grandes"""
+
+    # Menos saltos al threadpool por archivo que los 64KB por defecto
+    chunk_size = 256 * 1024
+
+
+def get_upload_etag(key: str, stat_result: os.stat_result) -> str:
+    """
+    ETag fuerte de un archivo subido
+
+    Blobs direccionados por contenido: su SHA-256 (igual en todos los nodos y
+    para siempre). Resto: tamaño + fecha de modificación.
+    """
+    match = CONTENT_ADDRESSED_KEY.match(key)
+    if match:
+        return f'"{match.group(1)}"'
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def resolve_if_range(request: Request, etag: str) -> None:
+    """
+    Evaluar If-Range contra nuestro ETag antes de delegar en FileResponse
+
+    FileResponse solo reconoce en If-Range su propio ETag (md5 de mtime +
+    tamaño) y la fecha de modificación. Si If-Range coincide con el ETag que
+    enviamos se quita If-Range y se sirve el rango; si no coincide (otra
+    versión o una fecha) se quita Range y se sirve el archivo completo.
+    """
+    if_range = request.headers.get("if-range")
+    if if_range is None or request.headers.get("range") is None:
+        return
+
+    ignored = b"if-range" if if_range.strip() == etag else b"range"
+    # FileResponse lee las cabeceras del mismo scope ASGI de la petición
+    request.scope["headers"] = [
+        (name, value) for name, value in request.scope["headers"] if name.lower() != ignored
+    ]
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match coincide con el ETag (comparación débil, RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+@router.api_route("/{filename}", methods=["GET", "HEAD"])
+async def download_file(filename: str, request: Request):
+    """
+    Descargar un archivo subido
+
+    - Almacenamiento remoto (S3): redirige a una URL prefirmada, el archivo se
+      descarga directamente del almacenamiento sin pasar por la API
+    - Local: ETag fuerte (SHA-256 del contenido), `Cache-Control: immutable`
+      para los blobs direccionados por contenido, 304 con If-None-Match y
+      rangos de bytes (Range / If-Range) para reanudar descargas
+    """
+    key = get_upload_key(f"{UPLOAD_URL_PREFIX}{filename}")
+    if key is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+
+    download_url = storage.get_download_url(key)
+    if download_url is not None:
+        return RedirectResponse(
+            download_url,
+            status_code=status.HTTP_307_TEMPORARY_REDIRECT,
+            headers={"Cache-Control": f"private, max-age={REDIRECT_MAX_AGE}"}
+        )
+
+    path = storage.local_path(key)
+    try:
+        stat_result = await run_in_threadpool(os.stat, path)
+    except OSError:
+        stat_result = None
+    if stat_result is None or not S_ISREG(stat_result.st_mode):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found"
+        )
+
+    headers = {
+        "ETag": get_upload_etag(key, stat_result),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if CONTENT_ADDRESSED_KEY.match(key) else MUTABLE_CACHE_CONTROL
+    }
+
+    # El cliente ya lo tiene: sin cuerpo
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    media_type = guess_type(key)[0] or "application/octet-stream"
+    if UPLOADS_ACCEL_REDIRECT_PREFIX:
+        # nginx evalúa Range / If-Range contra el ETag de esta respuesta
+        return Response(
+            media_type=media_type,
+            headers={**headers, "X-Accel-Redirect": f"{UPLOADS_ACCEL_REDIRECT_PREFIX}{key}"}
+        )
+
+    resolve_if_range(request, headers["ETag"])
+    return UploadFileResponse(path, stat_result=stat_result, headers=headers, media_type=media_type)
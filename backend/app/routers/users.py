@@ -7,9 +7,11 @@ from app.schemas.user import UserCreate, UserUpdate, UserLogin, UserResponse, To
 from app.models.user import User
 from app.database import get_db
 from app.services.user_online import user_online_service
-from app.auth.password import hash_password, verify_password
+from app.services.room_membership import room_membership
+from app.services.user_principal import Principal, user_principal_cache
+from app.auth.password import hash_password_async, verify_password_async
 from app.auth.jwt import create_access_token
-from app.auth.dependencies import get_current_user
+from app.auth.dependencies import get_current_principal
 
 router = APIRouter(
     prefix="/users",
@@ -39,7 +41,7 @@ async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
     user = User(
         username=user_data.username,
         email=user_data.email,
-        password_hash=hash_password(user_data.password),
+        password_hash=await hash_password_async(user_data.password),
         is_active=True
     )
 
@@ -97,6 +99,8 @@ async def create_user(user_data: UserCreate, db: Session = Depends(get_db)):
                 msg = Message(room_id=room.id, user_id=bot_id, content=welcome)
                 db.add(msg)
                 db.commit()
+
+                await room_membership.invalidate_room(room.id)
     except Exception as e:
         # No queremos que falle la creación del usuario si algo sale mal con la conversación de bienvenida
         print("Warning: could not create bot welcome conversation:", e)
@@ -111,7 +115,7 @@ async def get_users(db: Session = Depends(get_db)):
 
 @router.get("/available-for-chat", response_model=List[UserResponse])
 async def get_available_users_for_chat(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -155,7 +159,7 @@ async def get_available_users_for_chat(
 @router.get("/available-for-room/{room_id}", response_model=List[UserResponse])
 async def get_available_users_for_room(
     room_id: int,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -182,10 +186,7 @@ async def get_available_users_for_room(
         )
 
     # Verificar que el usuario actual es participante de la sala
-    is_participant = db.query(RoomParticipant).filter(
-        RoomParticipant.room_id == room_id,
-        RoomParticipant.user_id == current_user.id
-    ).first()
+    is_participant = await room_membership.is_member(room_id, current_user.id, db)
 
     if not is_participant:
         raise HTTPException(
@@ -253,7 +254,7 @@ async def update_user(user_id: int, user_data: UserUpdate, db: Session = Depends
 
     if user_data.password is not None:
         # Usar bcrypt para hashear la nueva contraseña
-        user.password_hash = hash_password(user_data.password)
+        user.password_hash = await hash_password_async(user_data.password)
 
     if user_data.is_active is not None:
         user.is_active = user_data.is_active
@@ -264,6 +265,9 @@ async def update_user(user_id: int, user_data: UserUpdate, db: Session = Depends
     db.commit()
     db.refresh(user)
 
+    # username / is_active forman parte del principal cacheado
+    await user_principal_cache.invalidate(user_id)
+
     return user
 
 @router.delete("/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -278,6 +282,8 @@ async def delete_user(user_id: int, db: Session = Depends(get_db)):
     db.delete(user)
     db.commit()
 
+    await user_principal_cache.invalidate(user_id)
+
 @router.post("/login", response_model=Token)
 async def login(credentials: UserLogin, db: Session = Depends(get_db)):
     """
@@ -301,8 +307,8 @@ async def login(credentials: UserLogin, db: Session = Depends(get_db)):
             detail="Credenciales invalidas"
         )
 
-    # Verificar contraseña con bcrypt
-    if not verify_password(credentials.password, user.password_hash):
+    # Verificar contraseña con bcrypt (en el pool de hilos, sin bloquear el event loop)
+    if not await verify_password_async(credentials.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Credenciales invalidas"
@@ -339,7 +345,7 @@ async def get_online_users():
     Returns:
         Lista de IDs de usuarios que están conectados actualmente
     """
-    online_users = user_online_service.get_online_users()
+    online_users = await user_online_service.get_online_users()
     # Convertir set de strings a lista de ints
     return [int(user_id) for user_id in online_users]
 
@@ -362,8 +368,8 @@ async def check_user_online(user_id: int, db: Session = Depends(get_db)):
             detail="User not found"
         )
 
-    is_online = user_online_service.is_user_online(user_id)
-    connections_count = user_online_service.get_user_connections_count(user_id)
+    is_online = await user_online_service.is_user_online(user_id)
+    connections_count = await user_online_service.get_user_connections_count(user_id)
 
     return {
         "user_id": user_id,
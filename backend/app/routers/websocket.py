@@ -1,5 +1,4 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
 from datetime import datetime
 import json
 import logging
@@ -8,8 +7,11 @@ from app.websockets.manager import manager
 from app.websockets.events import EventType, create_event
 from app.models.message import Message
 from app.models.user import User
-from app.database import get_db
+from app.database import AsyncSessionLocal
 from app.services.message_cache import message_cache
+from app.services.message_ingest import message_ingest
+from app.services.room_membership import room_membership
+from app.services.unread_counter import unread_counter
 from app.auth.jwt import verify_token
 
 logger = logging.getLogger(__name__)
@@ -38,11 +40,13 @@ async def websocket_endpoint(
     Eventos que se pueden enviar:
         - message: Enviar mensaje
         - typing: Indicar que está escribiendo
+        - read: Marcar la sala como leída
         - ping: Verificar conexión
 
     Eventos que se reciben:
         - message_sent: Confirmación de mensaje enviado
         - message: Nuevo mensaje de otro usuario
+        - message_read: Cursor de lectura actualizado
         - user_joined: Usuario se unió a la sala
         - user_left: Usuario salió de la sala
         - typing: Alguien está escribiendo
@@ -50,31 +54,34 @@ async def websocket_endpoint(
         - error: Error en el servidor
     """
     connection_id = None
-    db = None
-
-    # Obtener sesión de BD
-    from app.database import SessionLocal
-    db = SessionLocal()
 
     # Verificar token JWT
     token_data = verify_token(token)
     if token_data is None or token_data.user_id is None:
         logger.warning(f"❌ Token JWT inválido para room={room_id}")
         await websocket.close(code=1008, reason="Invalid token")
-        db.close()
         return
 
-    try:
-        user = db.query(User).filter(User.id == token_data.user_id).first()
-        if not user:
-            logger.warning(f"❌ Usuario no encontrado: user_id={token_data.user_id}")
-            await websocket.close(code=1008, reason="User not found")
-            db.close()
-            return
+    # La sesión de BD solo se usa para cargar al usuario: no se mantiene una
+    # conexión del pool ocupada durante toda la vida del socket
+    async with AsyncSessionLocal() as db:
+        user = await db.get(User, token_data.user_id)
+        is_participant = user is not None and await room_membership.is_member(room_id, user.id, db)
 
-        user_id = user.id
-        username = user.username
+    if not user:
+        logger.warning(f"❌ Usuario no encontrado: user_id={token_data.user_id}")
+        await websocket.close(code=1008, reason="User not found")
+        return
+
+    if not is_participant:
+        logger.warning(f"❌ Usuario {user.id} no es participante de room={room_id}")
+        await websocket.close(code=1008, reason="Not a participant")
+        return
 
+    user_id = user.id
+    username = user.username
+
+    try:
         # Conectar al manager
         connection_id = await manager.connect(websocket, room_id, user_id, username)
         logger.info(f"🔌 WebSocket conectado: user={username}, room={room_id}")
@@ -98,6 +105,22 @@ async def websocket_endpoint(
             # Procesar según tipo de evento
             event_type = message_data.get("type")
 
+            # Re-validar pertenencia antes de publicar en la sala (caché: normalmente sin red).
+            # Si lo eliminaron de la sala mientras estaba conectado, se cierra el socket
+            if event_type in ("message", "typing", "read") and not await is_room_member(room_id, user_id):
+                logger.warning(f"🚫 Usuario {username} ya no es participante de room={room_id}")
+                # Primero salir del manager (detiene su cola) para que el error se envíe directo
+                await manager.disconnect(room_id, connection_id)
+                await manager.send_personal_message(
+                    create_event(
+                        EventType.ERROR,
+                        message="Ya no eres participante de esta sala"
+                    ),
+                    websocket
+                )
+                await websocket.close(code=1008, reason="Not a participant")
+                break
+
             if event_type == "message":
                 # Guardar mensaje en DB
                 await handle_new_message(
@@ -121,6 +144,15 @@ async def websocket_endpoint(
                     exclude_connection_id=connection_id
                 )
 
+            elif event_type == "read":
+                # Avanzar el cursor de lectura y reiniciar el contador de no leídos
+                await handle_read(
+                    room_id=room_id,
+                    user_id=user_id,
+                    message_id=message_data.get("message_id"),
+                    websocket=websocket
+                )
+
             elif event_type == "ping":
                 # Responder con pong
                 await manager.send_personal_message(
@@ -149,9 +181,14 @@ async def websocket_endpoint(
         if connection_id:
             await manager.disconnect(room_id, connection_id)
 
-        # Cerrar sesión de BD
-        if db:
-            db.close()
+async def is_room_member(room_id: int, user_id: int) -> bool:
+    """
+    Verificar si el usuario sigue siendo participante de la sala
+
+    La sesión solo toma una conexión del pool si la sala no está cacheada.
+    """
+    async with AsyncSessionLocal() as db:
+        return await room_membership.is_member(room_id, user_id, db)
 
 async def handle_new_message(
     room_id: int,
@@ -171,65 +208,67 @@ async def handle_new_message(
         websocket: WebSocket del usuario
     """
     try:
-        # TODO: Obtener sesión de DB de forma correcta
-        # Por ahora creamos una conexión directa
-        from app.database import SessionLocal
-        db = SessionLocal()
+        # Una sola sesión para el INSERT y los no leídos: la conexión solo se toma
+        # del pool mientras hay una transacción abierta (INSERT, o leer los
+        # participantes si no están en Redis)
+        async with AsyncSessionLocal() as db:
+            if message_ingest.enabled:
+                # Write-behind: ID pre-asignado y stream de Redis; el flusher lo inserta en lote
+                message = await message_ingest.submit(room_id, user_id, content)
+            else:
+                # expire_on_commit=False mantiene los atributos accesibles tras el commit
+                message = Message(
+                    room_id=room_id,
+                    user_id=user_id,
+                    content=content,
+                    is_deleted=False,
+                    attachments=[]  # Sin adjuntos: evita una carga lazy (no permitida en async)
+                )
+                db.add(message)
+                await db.commit()
+
+            # Un no leído más para el resto de participantes
+            await unread_counter.notify_new_message(room_id, user_id, db)
 
+        # Preparar datos del mensaje (mismo formato que el caché + username para el frontend)
+        message_dict = message_cache.serialize_message(message, username=username)
+
+        # Cachear mensaje en Redis
         try:
-            # Crear mensaje en DB
-            message = Message(
-                room_id=room_id,
-                user_id=user_id,
-                content=content,
-                is_deleted=False
-            )
+            await message_cache.cache_message(room_id, message_dict)
+        except Exception as cache_error:
+            logger.warning(f"No se pudo cachear mensaje: {cache_error}")
 
-            db.add(message)
-            db.commit()
-            db.refresh(message)
-
-            # Preparar datos del mensaje
-            message_dict = {
-                "id": message.id,
-                "room_id": message.room_id,
-                "user_id": message.user_id,
-                "username": username,  # Agregamos username para el frontend
-                "content": message.content,
-                "created_at": message.created_at.isoformat(),
-                "updated_at": message.updated_at.isoformat() if message.updated_at else None,
-                "is_deleted": message.is_deleted
-            }
-
-            # Cachear mensaje en Redis
-            try:
-                message_cache.cache_message(room_id, message_dict)
-            except Exception as cache_error:
-                logger.warning(f"No se pudo cachear mensaje: {cache_error}")
+        # Enviar confirmación al emisor
+        await manager.send_personal_message(
+            create_event(
+                EventType.MESSAGE_SENT,
+                message_id=message.id,
+                timestamp=message.created_at.isoformat()
+            ),
+            websocket
+        )
 
-            # Enviar confirmación al emisor
+        # Broadcast a toda la sala (incluyendo al emisor)
+        delivered = await manager.broadcast(
+            room_id,
+            create_event(
+                EventType.MESSAGE,
+                **message_dict
+            )
+        )
+        if not delivered:
+            # El mensaje está guardado: los miembros de otros workers lo verán al recargar la sala
             await manager.send_personal_message(
                 create_event(
-                    EventType.MESSAGE_SENT,
-                    message_id=message.id,
-                    timestamp=message.created_at.isoformat()
+                    EventType.ERROR,
+                    message="Mensaje guardado, pero no se pudo entregar en tiempo real a todos los participantes",
+                    message_id=message.id
                 ),
                 websocket
             )
 
-            # Broadcast a toda la sala (incluyendo al emisor)
-            await manager.broadcast(
-                room_id,
-                create_event(
-                    EventType.MESSAGE,
-                    **message_dict
-                )
-            )
-
-            logger.info(f"💬 Mensaje guardado y enviado: room={room_id}, user={username}")
-
-        finally:
-            db.close()
+        logger.info(f"💬 Mensaje guardado y enviado: room={room_id}, user={username}")
 
     except Exception as e:
         logger.error(f"❌ Error guardando mensaje: {e}", exc_info=True)
@@ -242,6 +281,43 @@ async def handle_new_message(
             websocket
         )
 
+async def handle_read(
+    room_id: int,
+    user_id: int,
+    message_id,
+    websocket: WebSocket
+):
+    """
+    Manejar confirmación de lectura: mover el cursor y responder con el estado
+
+    Args:
+        room_id: ID de la sala
+        user_id: ID del usuario
+        message_id: Último mensaje leído (None = el más reciente de la sala)
+        websocket: WebSocket del usuario
+    """
+    if message_id is not None and not isinstance(message_id, int):
+        await manager.send_personal_message(
+            create_event(EventType.ERROR, message="message_id debe ser un entero"),
+            websocket
+        )
+        return
+
+    async with AsyncSessionLocal() as db:
+        result = await unread_counter.mark_read(room_id, user_id, db, message_id=message_id)
+
+    if result is None:
+        await manager.send_personal_message(
+            create_event(EventType.ERROR, message="Mensaje no encontrado en esta sala"),
+            websocket
+        )
+        return
+
+    await manager.send_personal_message(
+        create_event(EventType.MESSAGE_READ, **result),
+        websocket
+    )
+
 @router.get("/stats")
 async def get_websocket_stats():
     """
@@ -250,4 +326,6 @@ async def get_websocket_stats():
     Returns:
         Estadísticas de conexiones activas
     """
-    return manager.get_stats()
+    stats = await manager.get_stats()
+    stats["persistence"] = await message_ingest.get_stats()
+    return stats
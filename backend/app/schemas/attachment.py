@@ -26,11 +26,22 @@ class AttachmentUpdate(BaseModel):
     file_url: Optional[str] = Field(None, min_length=1, max_length=255)
     file_type: Optional[str] = Field(None, min_length=1, max_length=50)
 
+class AttachmentUploadByHash(BaseModel):
+    """Schema para reutilizar un archivo ya subido sin volver a enviarlo"""
+    sha256: str = Field(..., pattern=r"^[0-9a-f]{64}$", description="SHA-256 del contenido (hex)")
+    content_type: str = Field(..., description="Tipo MIME del archivo")
+    file_name: str = Field(..., min_length=1, max_length=255, description="Nombre original")
+
 class AttachmentResponse(AttachmentBase):
     """Schema de respuesta de adjunto"""
     id: int
     message_id: int
     uploaded_at: datetime
+    # Vista previa (solo imágenes, null hasta que se genera)
+    thumbnail_url: Optional[str] = Field(None, description="Miniatura WebP")
+    blurhash: Optional[str] = Field(None, description="Placeholder blurhash")
+    width: Optional[int] = Field(None, description="Ancho de la imagen original")
+    height: Optional[int] = Field(None, description="Alto de la imagen original")
 
     class Config:
         from_attributes = True
@@ -23,3 +23,17 @@ class ChatRoomResponse(ChatRoomBase):
 
     class Config:
         from_attributes = True
+
+class InboxLastMessage(BaseModel):
+    """Vista previa del último mensaje de una sala"""
+    id: int
+    user_id: int
+    username: Optional[str] = None
+    content: str = Field(..., description="Contenido truncado para la vista previa")
+    created_at: datetime
+
+class InboxRoomResponse(ChatRoomResponse):
+    """Sala de la bandeja de entrada: último mensaje, actividad y no leídos"""
+    last_message: Optional[InboxLastMessage] = None
+    last_activity: datetime
+    unread_count: int = 0
@@ -31,6 +31,10 @@ class AttachmentInMessage(BaseModel):
     file_url: str
     file_type: str
     uploaded_at: datetime
+    thumbnail_url: Optional[str] = None
+    blurhash: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -47,3 +51,15 @@ class MessageResponse(MessageBase):
 
     class Config:
         from_attributes = True
+
+class MessagePage(BaseModel):
+    """Página de historial de mensajes (paginación keyset)"""
+    messages: List[MessageResponse] = Field(default_factory=list, description="Mensajes en orden cronológico")
+    next_cursor: Optional[int] = Field(None, description="ID a enviar como before_id/after_id para la siguiente página")
+    has_more: bool = Field(False, description="Indica si hay más mensajes en esa dirección")
+
+class MessageReadResponse(BaseModel):
+    """Estado de lectura de una sala tras marcarla como leída"""
+    room_id: int
+    last_read_message_id: Optional[int] = Field(None, description="Último mensaje leído por el usuario")
+    unread_count: int = Field(0, description="Mensajes de otros usuarios posteriores al cursor")
@@ -15,6 +15,7 @@ class RoomParticipantResponse(RoomParticipantBase):
     """Schema de respuesta de participante"""
     id: int
     joined_at: datetime
+    last_read_message_id: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -0,0 +1,131 @@
+"""
+Caché de las listas de contactos (/contacts/my-contacts, /pending, /sent)
+
+Cada usuario tiene un hash Redis `contacts:{user_id}` con una entrada por
+página ya serializada ("{lista}:{limit}:{offset}" -> JSON; limit "all" = lista
+completa). Cualquier cambio en
+una relación de contacto invalida el hash completo de los dos usuarios
+implicados (send_contact_request, update_contact_status, delete_contact).
+
+Los datos del usuario contacto (username, last_login...) pueden quedar
+desfasados hasta CONTACTS_CACHE_TTL segundos: por eso el TTL es corto.
+"""
+
+import json
+import logging
+import os
+from typing import List, Optional
+
+from app.redis_client import async_redis_client
+
+logger = logging.getLogger(__name__)
+
+# TTL de las páginas cacheadas (segundos)
+CONTACTS_CACHE_TTL = int(os.getenv("CONTACTS_CACHE_TTL", "60"))
+
+# Guardar una página salvo que la versión del usuario haya cambiado
+# KEYS[1]: hash del usuario, KEYS[2]: versión
+# ARGV[1]: versión leída antes de consultar la DB, ARGV[2]: campo, ARGV[3]: JSON, ARGV[4]: TTL
+STORE_PAGE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return -1
+end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+if redis.call('TTL', KEYS[1]) < 0 then
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+end
+return 1
+"""
+
+
+class ContactListCache:
+    """Páginas de listas de contactos por usuario (hash Redis versionado)"""
+
+    _store_page_script = async_redis_client.register_script(STORE_PAGE_SCRIPT)
+
+    @staticmethod
+    def _get_user_key(user_id: int) -> str:
+        """Generar clave Redis del hash de listas de un usuario"""
+        return f"contacts:{user_id}"
+
+    @staticmethod
+    def _get_version_key(user_id: int) -> str:
+        """Generar clave Redis con la versión de los contactos de un usuario"""
+        return f"contacts:{user_id}:version"
+
+    @staticmethod
+    def _get_field(list_name: str, limit: Optional[int], offset: int) -> str:
+        """Campo del hash para una página de una lista (limit None = sin límite)"""
+        return f"{list_name}:{limit or 'all'}:{offset}"
+
+    async def get_version(self, user_id: int) -> str:
+        """Versión actual de los contactos del usuario (leer ANTES de consultar la DB)"""
+        return await async_redis_client.get(self._get_version_key(user_id)) or "0"
+
+    async def get_page(self, user_id: int, list_name: str, limit: Optional[int], offset: int) -> Optional[List[dict]]:
+        """
+        Obtener una página cacheada
+
+        Returns:
+            Lista de contactos serializados o None si no está en caché
+        """
+        try:
+            data = await async_redis_client.client.hget(
+                self._get_user_key(user_id), self._get_field(list_name, limit, offset)
+            )
+        except Exception as e:
+            logger.error(f"❌ Error leyendo contactos cacheados del usuario {user_id}: {e}")
+            return None
+
+        return json.loads(data) if data is not None else None
+
+    async def set_page(self, user_id: int, list_name: str, limit: Optional[int], offset: int, items: List[dict], version: str) -> bool:
+        """
+        Guardar una página leída de la DB
+
+        Args:
+            items: Contactos ya serializados (tipos JSON)
+            version: Resultado de get_version() antes de la consulta
+
+        Returns:
+            True si se guardó (False si la lista cambió mientras tanto o Redis falló)
+        """
+        try:
+            stored = await self._store_page_script(
+                keys=[self._get_user_key(user_id), self._get_version_key(user_id)],
+                args=[version, self._get_field(list_name, limit, offset), json.dumps(items), CONTACTS_CACHE_TTL]
+            )
+        except Exception as e:
+            logger.error(f"❌ Error cacheando contactos del usuario {user_id}: {e}")
+            return False
+
+        if stored < 0:
+            logger.info(f"⏭️ Contactos del usuario {user_id} cambiaron durante la consulta, no se cachean")
+        return stored > 0
+
+    async def invalidate(self, *user_ids: int) -> bool:
+        """
+        Invalidar todas las listas cacheadas de los usuarios
+
+        Llamar DESPUÉS del commit que cambia la tabla contacts.
+
+        Returns:
+            True si se invalidó correctamente en Redis
+        """
+        try:
+            # DEL + INCR de versión en MULTI: una página en curso con datos previos se descarta
+            pipe = async_redis_client.pipeline()
+            for user_id in user_ids:
+                pipe.delete(self._get_user_key(user_id))
+                pipe.incr(self._get_version_key(user_id))
+                pipe.expire(self._get_version_key(user_id), CONTACTS_CACHE_TTL)
+            await pipe.execute()
+            logger.info(f"🗑️ Contactos cacheados invalidados: usuarios {list(user_ids)}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error invalidando contactos de {list(user_ids)}: {e}")
+            return False
+
+
+# Instancia global
+contact_list_cache = ContactListCache()
@@ -0,0 +1,155 @@
+"""
+Generación de vistas previas de imágenes (miniatura WebP + blurhash)
+
+Funciones puras y CPU-bound: se ejecutan en los procesos del pool de
+thumbnails.py, por eso este módulo no importa nada de la aplicación (cada
+proceso lo importa al arrancar).
+
+Pillow es opcional: sin él las vistas previas se desactivan.
+"""
+
+import math
+from typing import List, Sequence, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - depende del entorno
+    Image = None
+
+# Calidad WebP de las miniaturas (0-100)
+THUMBNAIL_QUALITY = 80
+# Lado máximo de la imagen reducida sobre la que se calcula el blurhash
+BLURHASH_SAMPLE_SIZE = 32
+# Componentes DCT del blurhash (horizontal, vertical)
+BLURHASH_COMPONENTS = (4, 3)
+
+# Etiqueta EXIF de orientación; 5-8 giran la imagen 90° (se intercambian ancho y alto)
+EXIF_ORIENTATION_TAG = 0x0112
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+BASE83_CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def create_preview(source_path: str, thumbnail_path: str, size: int) -> dict:
+    """
+    Generar la miniatura WebP y el blurhash de una imagen
+
+    Args:
+        source_path: Imagen original
+        thumbnail_path: Destino de la miniatura (se sobrescribe)
+        size: Lado máximo de la miniatura en píxeles
+
+    Returns:
+        {"width", "height", "blurhash"} con las dimensiones de la imagen original
+
+    Raises:
+        Cualquier error de Pillow si el archivo no es una imagen válida
+    """
+    with Image.open(source_path) as image:
+        # Dimensiones originales (de la cabecera, antes de draft) ya orientadas según EXIF
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION_TAG) in ROTATED_ORIENTATIONS:
+            width, height = height, width
+
+        # JPEG: decodificar directamente a escala reducida (cambia image.size)
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or "A" in image.mode else "RGB")
+        image.save(thumbnail_path, "WEBP", quality=THUMBNAIL_QUALITY)
+
+        sample = image.convert("RGB")
+        sample.thumbnail((BLURHASH_SAMPLE_SIZE, BLURHASH_SAMPLE_SIZE))
+        data = sample.tobytes()
+        pixels = [tuple(data[i:i + 3]) for i in range(0, len(data), 3)]
+        blurhash = encode_blurhash(pixels, sample.width, sample.height, *BLURHASH_COMPONENTS)
+
+    return {"width": width, "height": height, "blurhash": blurhash}
+
+
+def encode_blurhash(
+    pixels: Sequence[Tuple[int, int, int]],
+    width: int,
+    height: int,
+    x_components: int = 4,
+    y_components: int = 3
+) -> str:
+    """
+    Codificar una imagen pequeña como blurhash (https://blurha.sh)
+
+    Args:
+        pixels: Píxeles RGB por filas (width * height)
+        width, height: Dimensiones de la imagen
+        x_components, y_components: Componentes DCT (1-9)
+
+    Returns:
+        Cadena blurhash (base83)
+    """
+    linear = [(_srgb_to_linear(r), _srgb_to_linear(g), _srgb_to_linear(b)) for r, g, b in pixels]
+
+    factors: List[Tuple[float, float, float]] = []
+    for j in range(y_components):
+        cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            normalisation = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[x] * cos_y[y]
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = normalisation / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    blurhash = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+
+    if ac:
+        actual_max = max(abs(value) for factor in ac for value in factor)
+        quantised_max = int(max(0, min(82, math.floor(actual_max * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+        blurhash += _encode83(quantised_max, 1)
+    else:
+        max_value = 1
+        blurhash += _encode83(0, 1)
+
+    dc_value = (_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2])
+    blurhash += _encode83(dc_value, 4)
+
+    for factor in ac:
+        quantised = [
+            int(max(0, min(18, math.floor(_sign_pow(value / max_value, 0.5) * 9 + 9.5))))
+            for value in factor
+        ]
+        blurhash += _encode83(quantised[0] * 19 * 19 + quantised[1] * 19 + quantised[2], 2)
+
+    return blurhash
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exponent: float) -> float:
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def _encode83(value: int, length: int) -> str:
+    return "".join(
+        BASE83_CHARACTERS[(value // 83 ** (length - i)) % 83]
+        for i in range(1, length + 1)
+    )
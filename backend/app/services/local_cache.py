@@ -0,0 +1,72 @@
+"""
+LRU en memoria con TTL por entrada (un dict por worker, sin red)
+
+Lo usan los servicios de caché como primer nivel delante de Redis/DB.
+No es thread-safe: pensado para usarse desde el event loop.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LocalTTLCache:
+    """Caché LRU acotado en número de entradas y con expiración por TTL"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        """
+        Args:
+            ttl: Segundos de vida de cada entrada (0 = caché desactivado)
+            max_entries: Máximo de entradas; al superarlo se expulsa la menos usada
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Obtener un valor vigente (None si no existe o caducó)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Guardar un valor
+
+        Args:
+            key: Clave
+            value: Valor (no None)
+            ttl: TTL propio de esta entrada (por defecto el del caché)
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        """Eliminar una entrada si existe"""
+        self._entries.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[Hashable], bool]):
+        """Eliminar todas las entradas cuya clave cumpla el predicado"""
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+    def clear(self):
+        """Vaciar el caché"""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
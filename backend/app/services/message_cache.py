@@ -1,23 +1,112 @@
 from typing import List, Optional
 from datetime import datetime
+import json
 import logging
-from app.redis_client import redis_client
+from app.redis_client import async_redis_client
 
 logger = logging.getLogger(__name__)
 
+# Agregar un mensaje a un caché existente (EXISTS + LPUSH + LTRIM + EXPIRE en un solo paso atómico)
+# KEYS[1]: lista de la sala, KEYS[2]: versión de la sala
+# ARGV[1]: mensaje JSON, ARGV[2]: máximo de mensajes, ARGV[3]: TTL, ARGV[4]: marcador de sala vacía
+CACHE_MESSAGE_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('LPUSH', KEYS[1], ARGV[1])
+if redis.call('LINDEX', KEYS[1], -1) == ARGV[4] then
+    redis.call('RPOP', KEYS[1])
+end
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# Reconstruir el caché completo de una sala de forma atómica (un lector nunca ve la lista a medias).
+# Si la versión cambió desde que se leyó la DB (mensaje nuevo o invalidación) no se escribe nada,
+# para no pisar datos más nuevos con un resultado viejo.
+# Una sala sin mensajes se guarda como una lista con solo el marcador.
+# KEYS[1]: lista de la sala, KEYS[2]: versión de la sala
+# ARGV[1]: versión leída antes de consultar la DB ("" = sin verificar), ARGV[2]: TTL,
+# ARGV[3]: marcador de sala vacía, ARGV[4..]: mensajes JSON
+REBUILD_CACHE_SCRIPT = """
+if ARGV[1] ~= '' and (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return -1
+end
+redis.call('DEL', KEYS[1])
+if #ARGV > 3 then
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, 4))
+else
+    redis.call('RPUSH', KEYS[1], ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return #ARGV - 3
+"""
+
 class MessageCache:
     """Servicio de caché para mensajes usando Redis"""
 
     CACHE_TTL = 3600  # 1 hora
     MAX_CACHED_MESSAGES = 50  # Últimos 50 mensajes por sala
 
+    # Elemento ficticio: la lista de una sala sin mensajes no puede quedar vacía
+    # (Redis borra las listas vacías y se confundiría con "sala no cargada").
+    # Solo está mientras la sala no tiene mensajes: el primero lo reemplaza
+    LOADED_MARKER = "*"
+
+    # Scripts Lua (registrarlos no contacta a Redis; se cargan con el primer EVALSHA)
+    _cache_message_script = async_redis_client.register_script(CACHE_MESSAGE_SCRIPT)
+    _rebuild_cache_script = async_redis_client.register_script(REBUILD_CACHE_SCRIPT)
+
     @staticmethod
     def _get_room_key(room_id: int) -> str:
         """Generar clave Redis para mensajes de una sala"""
         return f"messages:room:{room_id}"
 
     @staticmethod
-    def cache_message(room_id: int, message_data: dict) -> bool:
+    def _get_version_key(room_id: int) -> str:
+        """
+        Generar clave Redis con la versión del caché de una sala
+
+        Se incrementa con cada escritura o invalidación y permite descartar
+        reconstrucciones hechas con datos leídos antes de esa escritura.
+        """
+        return f"messages:room:{room_id}:version"
+
+    @staticmethod
+    def serialize_message(message, **extra) -> dict:
+        """
+        Convertir un Message (con sus adjuntos) al formato guardado en caché
+
+        El formato es compatible con MessageResponse, para poder servir
+        /messages/room/{id}/latest directamente desde Redis.
+
+        Args:
+            message: Instancia de Message
+            **extra: Campos adicionales (p.ej. username para eventos WebSocket)
+        """
+        return {
+            **message.to_dict(),
+            **extra,
+            "attachments": [
+                {
+                    "id": attachment.id,
+                    "file_url": attachment.file_url,
+                    "file_type": attachment.file_type,
+                    "uploaded_at": attachment.uploaded_at.isoformat(),
+                    "thumbnail_url": attachment.thumbnail_url,
+                    "blurhash": attachment.blurhash,
+                    "width": attachment.width,
+                    "height": attachment.height
+                }
+                for attachment in message.attachments
+            ]
+        }
+
+    @staticmethod
+    async def cache_message(room_id: int, message_data: dict) -> bool:
         """
         Agregar mensaje al caché de una sala (solo si el cache ya existe)
 
@@ -29,23 +118,23 @@ class MessageCache:
             True si se cacheó correctamente
         """
         try:
-            key = MessageCache._get_room_key(room_id)
-
             # Solo agregar si el cache ya existe (fue poblado por DB)
-            # Esto evita crear caches parciales con 1-2 mensajes
-            if not redis_client.exists(key):
+            # Esto evita crear caches parciales con 1-2 mensajes.
+            # Agregar al inicio, recortar a MAX_CACHED_MESSAGES y refrescar TTL: un solo round trip
+            cached = await MessageCache._cache_message_script(
+                keys=[MessageCache._get_room_key(room_id), MessageCache._get_version_key(room_id)],
+                args=[
+                    json.dumps(message_data),
+                    MessageCache.MAX_CACHED_MESSAGES,
+                    MessageCache.CACHE_TTL,
+                    MessageCache.LOADED_MARKER
+                ]
+            )
+
+            if not cached:
                 logger.info(f"⏭️ Cache no existe para sala {room_id}, mensaje no cacheado (se poblará en próxima consulta)")
                 return False
 
-            # Agregar mensaje al inicio de la lista
-            redis_client.lpush(key, message_data)
-
-            # Mantener solo los últimos MAX_CACHED_MESSAGES
-            redis_client.ltrim(key, 0, MessageCache.MAX_CACHED_MESSAGES - 1)
-
-            # Refrescar TTL
-            redis_client.expire(key, MessageCache.CACHE_TTL)
-
             logger.info(f"✅ Mensaje cacheado en sala {room_id}")
             return True
         except Exception as e:
@@ -53,28 +142,32 @@ class MessageCache:
             return False
 
     @staticmethod
-    def get_cached_messages(room_id: int, limit: int = 50) -> Optional[List[dict]]:
+    async def get_cached_messages(room_id: int, limit: int = 50) -> Optional[List[dict]]:
         """
         Obtener mensajes cacheados de una sala
 
+        Un caché existente contiene siempre los últimos MAX_CACHED_MESSAGES
+        mensajes no eliminados de la sala (o todos si tiene menos), así que
+        cualquier limit <= MAX_CACHED_MESSAGES se puede servir desde aquí.
+
         Args:
             room_id: ID de la sala
             limit: Número máximo de mensajes a retornar
 
         Returns:
-            Lista de mensajes o None si no hay caché
+            Lista de mensajes ([] si la sala no tiene mensajes) o None si no hay caché
         """
         try:
             key = MessageCache._get_room_key(room_id)
 
-            # Verificar si existe el caché
-            if not redis_client.exists(key):
+            # Obtener mensajes (del más reciente al más antiguo). Un caché poblado
+            # nunca es una lista vacía, así que vacío = no hay caché (sin EXISTS previo)
+            values = await async_redis_client.lrange(key, 0, limit - 1)
+            if not values:
                 logger.info(f"📭 No hay caché para sala {room_id}")
                 return None
 
-            # Obtener mensajes (del más reciente al más antiguo)
-            messages = redis_client.lrange(key, 0, limit - 1, as_json=True)
-
+            messages = [json.loads(value) for value in values if value != MessageCache.LOADED_MARKER]
             logger.info(f"✅ {len(messages)} mensajes obtenidos del caché de sala {room_id}")
             return messages
         except Exception as e:
@@ -82,7 +175,7 @@ class MessageCache:
             return None
 
     @staticmethod
-    def invalidate_room_cache(room_id: int) -> bool:
+    async def invalidate_room_cache(room_id: int) -> bool:
         """
         Invalidar caché de una sala
 
@@ -93,8 +186,13 @@ class MessageCache:
             True si se invalidó correctamente
         """
         try:
-            key = MessageCache._get_room_key(room_id)
-            deleted = redis_client.delete(key)
+            # DEL + INCR de versión en una transacción MULTI (un round trip): una
+            # reconstrucción en curso con datos previos a la invalidación se descarta
+            pipe = async_redis_client.pipeline()
+            pipe.delete(MessageCache._get_room_key(room_id))
+            pipe.incr(MessageCache._get_version_key(room_id))
+            pipe.expire(MessageCache._get_version_key(room_id), MessageCache.CACHE_TTL)
+            deleted, _, _ = await pipe.execute()
             logger.info(f"🗑️ Caché de sala {room_id} invalidado")
             return deleted > 0
         except Exception as e:
@@ -102,39 +200,62 @@ class MessageCache:
             return False
 
     @staticmethod
-    def update_cache_with_db_messages(room_id: int, messages: List[dict]) -> bool:
+    async def get_cache_version(room_id: int) -> str:
+        """
+        Obtener la versión actual del caché de una sala
+
+        Leerla ANTES de consultar la DB y pasarla a update_cache_with_db_messages.
+        """
+        try:
+            return await async_redis_client.get(MessageCache._get_version_key(room_id)) or "0"
+        except Exception as e:
+            logger.error(f"❌ Error obteniendo versión del caché de sala {room_id}: {e}")
+            return "0"
+
+    @staticmethod
+    async def update_cache_with_db_messages(
+        room_id: int,
+        messages: List[dict],
+        version: Optional[str] = None
+    ) -> bool:
         """
         Actualizar caché con mensajes de la base de datos
 
+        Reemplaza la lista de forma atómica en un solo round trip (script Lua).
+
         Args:
             room_id: ID de la sala
             messages: Lista de mensajes (del más reciente al más antiguo)
+            version: Versión leída con get_cache_version antes de consultar la DB.
+                     Si cambió (hubo escrituras entretanto) el caché no se actualiza.
 
         Returns:
             True si se actualizó correctamente
         """
         try:
-            key = MessageCache._get_room_key(room_id)
-
-            # Eliminar caché existente
-            redis_client.delete(key)
-
-            # Agregar mensajes (en orden inverso para que queden del más reciente al más antiguo)
-            if messages:
-                for message in reversed(messages[:MessageCache.MAX_CACHED_MESSAGES]):
-                    redis_client.rpush(key, message)
-
-                # Establecer TTL
-                redis_client.expire(key, MessageCache.CACHE_TTL)
+            # Mensajes en el mismo orden (la cabeza de la lista es el más reciente)
+            written = await MessageCache._rebuild_cache_script(
+                keys=[MessageCache._get_room_key(room_id), MessageCache._get_version_key(room_id)],
+                args=[
+                    version or "",
+                    MessageCache.CACHE_TTL,
+                    MessageCache.LOADED_MARKER,
+                    *[json.dumps(message) for message in messages[:MessageCache.MAX_CACHED_MESSAGES]]
+                ]
+            )
+
+            if written < 0:
+                logger.info(f"⏭️ Caché de sala {room_id} cambió durante la consulta, no se reconstruye")
+                return False
 
-                logger.info(f"✅ Caché de sala {room_id} actualizado con {len(messages)} mensajes")
+            logger.info(f"✅ Caché de sala {room_id} actualizado con {written} mensajes")
             return True
         except Exception as e:
             logger.error(f"❌ Error actualizando caché de sala {room_id}: {e}")
             return False
 
     @staticmethod
-    def get_cache_stats() -> dict:
+    async def get_cache_stats() -> dict:
         """
         Obtener estadísticas del caché
 
@@ -144,7 +265,7 @@ class MessageCache:
         try:
             # Esto es un ejemplo básico, podrías expandirlo
             return {
-                "redis_connected": redis_client.ping(),
+                "redis_connected": await async_redis_client.ping(),
                 "ttl": MessageCache.CACHE_TTL,
                 "max_messages_per_room": MessageCache.MAX_CACHED_MESSAGES
             }
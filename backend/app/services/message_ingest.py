@@ -0,0 +1,329 @@
+"""
+Persistencia write-behind de mensajes del chat (WebSocket)
+
+Con WS_PERSISTENCE_MODE=write_behind los mensajes no se insertan uno a uno:
+
+1. Al recibirlo se le asigna un ID pre-reservado de la secuencia de `messages`
+   (bloques de `nextval`, así no choca con los inserts directos de la API REST).
+2. Se agrega al stream de Redis `messages:ingest` (XADD). En ese momento el
+   mensaje se confirma al emisor y se difunde a la sala.
+3. Un flusher por worker lee el stream con un consumer group y lo persiste con
+   INSERT multi-fila (ON CONFLICT DO NOTHING) cada pocos ms o N mensajes, y
+   recién después hace XACK + XDEL.
+
+Recuperación ante caídas: las entradas leídas pero no confirmadas quedan en la
+lista de pendientes (PEL) del consumer group. Al arrancar, cada worker
+reprocesa sus pendientes y reclama (XAUTOCLAIM) las de workers inactivos. Como
+el insert es idempotente por ID, reprocesar un lote nunca duplica mensajes.
+
+Requiere PostgreSQL (secuencias); con otro motor se usa el modo directo.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from collections import deque
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+
+from app.database import AsyncSessionLocal, async_engine
+from app.models.message import Message
+from app.redis_client import async_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Modo de persistencia de mensajes WebSocket: "direct" (INSERT por mensaje) o "write_behind"
+WS_PERSISTENCE_MODE = os.getenv("WS_PERSISTENCE_MODE", "direct").lower()
+
+# Máximo de mensajes por INSERT y tiempo máximo de espera para completar un lote
+WS_INGEST_BATCH_SIZE = int(os.getenv("WS_INGEST_BATCH_SIZE", 200))
+WS_INGEST_FLUSH_MS = int(os.getenv("WS_INGEST_FLUSH_MS", 20))
+
+# IDs reservados por cada llamada a la secuencia
+WS_INGEST_ID_BLOCK = int(os.getenv("WS_INGEST_ID_BLOCK", 100))
+
+# Tiempo sin actividad tras el cual las entradas de otro worker se consideran huérfanas
+WS_INGEST_CLAIM_IDLE_MS = int(os.getenv("WS_INGEST_CLAIM_IDLE_MS", 30000))
+
+PERSISTENCE_DIRECT = "direct"
+PERSISTENCE_WRITE_BEHIND = "write_behind"
+
+
+class MessageIngestService:
+    """Pipeline write-behind: stream de Redis + INSERTs por lotes"""
+
+    STREAM_KEY = "messages:ingest"
+    GROUP = "messages:writers"
+    RETRY_DELAY = 1.0        # Segundos entre reintentos si la DB falla
+    CLAIM_INTERVAL = 10.0    # Segundos entre búsquedas de entradas huérfanas
+
+    def __init__(
+        self,
+        mode: str = WS_PERSISTENCE_MODE,
+        batch_size: int = WS_INGEST_BATCH_SIZE,
+        flush_interval_ms: int = WS_INGEST_FLUSH_MS,
+        id_block_size: int = WS_INGEST_ID_BLOCK,
+        claim_idle_ms: int = WS_INGEST_CLAIM_IDLE_MS
+    ):
+        if mode not in (PERSISTENCE_DIRECT, PERSISTENCE_WRITE_BEHIND):
+            raise ValueError(f"WS_PERSISTENCE_MODE inválido: {mode} (usar direct o write_behind)")
+
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval_ms = flush_interval_ms
+        self.id_block_size = id_block_size
+        self.claim_idle_ms = claim_idle_ms
+        # Nombre estable del consumer (en contenedores el PID suele repetirse tras reiniciar)
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        # Métricas
+        self.flushed = 0
+        self.failed_flushes = 0
+        self._id_block: deque = deque()
+        self._id_lock: Optional[asyncio.Lock] = None
+        self._flusher_task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        """Indica si los mensajes WebSocket pasan por el pipeline write-behind"""
+        return self._flusher_task is not None
+
+    async def start(self):
+        """Crear el consumer group, recuperar pendientes y lanzar el flusher"""
+        if self.mode != PERSISTENCE_WRITE_BEHIND or self.enabled:
+            return
+
+        if async_engine.dialect.name != "postgresql":
+            logger.warning("⚠️ write_behind requiere PostgreSQL, usando persistencia directa")
+            return
+
+        if not await async_redis_client.xgroup_create(self.STREAM_KEY, self.GROUP):
+            logger.error("❌ No se pudo crear el consumer group, usando persistencia directa")
+            return
+
+        self._id_lock = asyncio.Lock()
+        self._id_block.clear()
+        self._flusher_task = asyncio.create_task(self._flush_loop())
+        logger.info(f"📝 Persistencia write-behind activa (consumer {self.consumer})")
+
+    async def stop(self):
+        """Detener el flusher y persistir lo que quede en el stream"""
+        if not self._flusher_task:
+            return
+
+        self._flusher_task.cancel()
+        try:
+            await self._flusher_task
+        except asyncio.CancelledError:
+            pass
+        self._flusher_task = None
+
+        # Último vaciado (un intento: si falla, se recupera al próximo arranque)
+        try:
+            await self._drain(start_id="0", max_attempts=1)
+            await self._drain(start_id=">", max_attempts=1)
+        except Exception as e:
+            logger.error(f"❌ Error vaciando stream de mensajes al detener: {e}")
+
+        # Los IDs reservados no usados quedan como huecos en la secuencia
+        self._id_block.clear()
+
+    async def submit(self, room_id: int, user_id: int, content: str) -> Message:
+        """
+        Registrar un mensaje en el stream con ID pre-asignado (sin esperar a la DB)
+
+        Returns:
+            Message (no persistido todavía) con id y created_at definitivos
+
+        Raises:
+            RuntimeError: Si no se pudo escribir en Redis (el mensaje NO se aceptó)
+        """
+        message = Message(
+            id=await self._allocate_id(),
+            room_id=room_id,
+            user_id=user_id,
+            content=content,
+            created_at=datetime.now(),
+            updated_at=None,
+            is_deleted=False
+        )
+
+        entry_id = await async_redis_client.xadd(self.STREAM_KEY, {"message": message.to_dict()})
+        if entry_id is None:
+            raise RuntimeError("No se pudo encolar el mensaje para persistencia")
+
+        return message
+
+    async def get_stats(self) -> dict:
+        """Estadísticas del pipeline (mensajes aún no persistidos = stream_length)"""
+        return {
+            "mode": PERSISTENCE_WRITE_BEHIND if self.enabled else PERSISTENCE_DIRECT,
+            "stream_length": await async_redis_client.xlen(self.STREAM_KEY) if self.enabled else 0,
+            "flushed": self.flushed,
+            "failed_flushes": self.failed_flushes
+        }
+
+    # ==================== IDs ====================
+
+    async def _allocate_id(self) -> int:
+        """Tomar un ID del bloque local, reservando un bloque nuevo si se agotó"""
+        async with self._id_lock:
+            if not self._id_block:
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(
+                        text(
+                            "SELECT nextval(pg_get_serial_sequence('messages', 'id')) "
+                            "FROM generate_series(1, :n)"
+                        ),
+                        {"n": self.id_block_size}
+                    )
+                    self._id_block.extend(row[0] for row in result)
+            return self._id_block.popleft()
+
+    # ==================== FLUSHER ====================
+
+    async def _flush_loop(self):
+        """Leer lotes del stream y persistirlos hasta que se cancele la tarea"""
+        await self._recover()
+        last_claim = time.monotonic()
+
+        while True:
+            try:
+                read_started = time.monotonic()
+                entries = await async_redis_client.xreadgroup(
+                    self.GROUP, self.consumer, self.STREAM_KEY,
+                    count=self.batch_size,
+                    block_ms=self.flush_interval_ms
+                )
+
+                # Sin entradas antes del timeout de BLOCK: Redis falló, no girar en vacío
+                if not entries and time.monotonic() - read_started < self.flush_interval_ms / 1000:
+                    await asyncio.sleep(self.RETRY_DELAY)
+
+                # Lote incompleto: esperar un intervalo para juntar más mensajes en el mismo INSERT
+                if entries and len(entries) < self.batch_size:
+                    await asyncio.sleep(self.flush_interval_ms / 1000)
+                    entries += await async_redis_client.xreadgroup(
+                        self.GROUP, self.consumer, self.STREAM_KEY,
+                        count=self.batch_size - len(entries)
+                    )
+
+                if entries:
+                    await self._flush(entries)
+
+                if time.monotonic() - last_claim >= self.CLAIM_INTERVAL:
+                    await self._claim_orphans()
+                    last_claim = time.monotonic()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error en flusher de mensajes, reintentando: {e}")
+                await asyncio.sleep(self.RETRY_DELAY)
+
+    async def _recover(self):
+        """Reprocesar pendientes propios y reclamar los de workers caídos"""
+        await self._drain(start_id="0")
+        await self._claim_orphans()
+
+    async def _drain(self, start_id: str, max_attempts: Optional[int] = None):
+        """Persistir entradas hasta vaciar la lectura indicada ("0" = pendientes propios, ">" = nuevas)"""
+        while True:
+            entries = await async_redis_client.xreadgroup(
+                self.GROUP, self.consumer, self.STREAM_KEY,
+                count=self.batch_size,
+                start_id=start_id
+            )
+            if not entries:
+                return
+            await self._flush(entries, max_attempts=max_attempts)
+
+    async def _claim_orphans(self):
+        """Tomar entradas pendientes de consumers inactivos (worker caído) y persistirlas"""
+        while True:
+            entries = await async_redis_client.xautoclaim(
+                self.STREAM_KEY, self.GROUP, self.consumer,
+                min_idle_ms=self.claim_idle_ms,
+                count=self.batch_size
+            )
+            if not entries:
+                return
+            logger.warning(f"♻️ Recuperando {len(entries)} mensajes pendientes de otro worker")
+            await self._flush(entries)
+
+    async def _flush(self, entries: List[tuple], max_attempts: Optional[int] = None):
+        """
+        Insertar un lote y confirmarlo en el stream
+
+        Si la DB no está disponible se reintenta (el lote sigue pendiente en
+        Redis); solo se hace XACK cuando el INSERT se confirmó.
+        """
+        rows = []
+        for entry_id, fields in entries:
+            try:
+                data = json.loads(fields["message"])
+                data["created_at"] = datetime.fromisoformat(data["created_at"])
+                data["updated_at"] = None
+                rows.append(data)
+            except (KeyError, TypeError, ValueError):
+                logger.error(f"❌ Entrada inválida en stream de mensajes descartada: {entry_id}")
+
+        attempts = 0
+        inserted = 0
+        while rows:
+            try:
+                inserted = await self._insert_rows(rows)
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                attempts += 1
+                self.failed_flushes += 1
+                logger.error(f"❌ Error persistiendo lote de {len(rows)} mensajes (intento {attempts}): {e}")
+                if max_attempts is not None and attempts >= max_attempts:
+                    raise
+                await asyncio.sleep(self.RETRY_DELAY)
+
+        entry_ids = [entry_id for entry_id, _ in entries]
+        await async_redis_client.xack(self.STREAM_KEY, self.GROUP, *entry_ids)
+        await async_redis_client.xdel(self.STREAM_KEY, *entry_ids)
+        self.flushed += inserted
+        logger.debug(f"💾 {inserted} mensajes persistidos en lote")
+
+    async def _insert_rows(self, rows: List[dict]) -> int:
+        """
+        INSERT multi-fila idempotente (ON CONFLICT DO NOTHING por ID)
+
+        Returns:
+            Filas insertadas (sin contar las ya persistidas ni las descartadas por FK)
+        """
+        async with AsyncSessionLocal() as db:
+            try:
+                result = await db.execute(pg_insert(Message).values(rows).on_conflict_do_nothing(index_elements=["id"]))
+                await db.commit()
+                return result.rowcount
+            except IntegrityError:
+                await db.rollback()
+
+            # Algún mensaje viola una FK (p.ej. sala eliminada): insertar fila por fila
+            # para no bloquear el resto del lote con un mensaje que nunca podrá persistirse
+            inserted = 0
+            for row in rows:
+                try:
+                    result = await db.execute(pg_insert(Message).values(row).on_conflict_do_nothing(index_elements=["id"]))
+                    await db.commit()
+                    inserted += result.rowcount
+                except IntegrityError:
+                    await db.rollback()
+                    logger.error(f"❌ Mensaje {row['id']} descartado: viola integridad (sala/usuario inexistente)")
+            return inserted
+
+
+# Instancia global
+message_ingest = MessageIngestService()
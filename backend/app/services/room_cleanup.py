@@ -0,0 +1,171 @@
+"""
+Eliminación de salas por lotes
+
+Eliminar una sala con cientos de miles de mensajes en una sola transacción
+bloquea las tablas durante minutos. Se hace en dos fases:
+
+1. start_deletion() (dentro de la petición): borra los participantes, registra
+   la sala en el set Redis `rooms:deleting` e invalida sus cachés. Desde ese
+   momento nadie puede leer ni escribir en la sala.
+2. purge_room(): borra adjuntos y mensajes por lotes de ROOM_DELETE_BATCH_SIZE
+   (un DELETE por tabla y lote, cada lote en su propia transacción corta),
+   elimina del disco los archivos que ya no usa ningún adjunto y por último la
+   sala. Las salas pequeñas se purgan en la misma petición; las grandes en
+   segundo plano.
+
+Si el proceso se detiene a mitad, la sala sigue en `rooms:deleting` y resume()
+la retoma al arrancar. Un lock por sala evita que dos workers la purguen a la vez.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Optional, Set
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from app.database import async_engine
+from app.models.attachment import Attachment
+from app.models.chat_room import ChatRoom
+from app.models.message import Message
+from app.models.room_participant import RoomParticipant
+from app.redis_client import async_redis_client
+from app.services.message_cache import message_cache
+from app.services.room_membership import room_membership
+from app.services.unread_counter import unread_counter
+from app.services.uploads import delete_unreferenced_uploads
+
+logger = logging.getLogger(__name__)
+
+# Mensajes por lote (las salas con menos se eliminan dentro de la petición)
+ROOM_DELETE_BATCH_SIZE = int(os.getenv("ROOM_DELETE_BATCH_SIZE", "1000"))
+# Vida del lock de purga (segundos, se renueva con cada lote)
+ROOM_DELETE_LOCK_TTL = int(os.getenv("ROOM_DELETE_LOCK_TTL", "60"))
+
+
+class RoomCleanupService:
+    """Borrado de salas en dos fases: ocultar ya, purgar por lotes"""
+
+    PENDING_KEY = "rooms:deleting"
+
+    def __init__(self, batch_size: int = ROOM_DELETE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _get_lock_key(room_id: int) -> str:
+        """Generar clave Redis del lock de purga de una sala"""
+        return f"room:{room_id}:deleting"
+
+    async def start_deletion(self, room_id: int, db: AsyncSession) -> bool:
+        """
+        Primera fase: la sala deja de ser accesible
+
+        Args:
+            room_id: ID de la sala (ya validada por el caller)
+            db: Sesión de la petición
+
+        Returns:
+            True si la sala cabe en un lote (se puede purgar dentro de la petición)
+        """
+        members = set((await db.scalars(
+            select(RoomParticipant.user_id).where(RoomParticipant.room_id == room_id)
+        )).all())
+        await db.execute(delete(RoomParticipant).where(RoomParticipant.room_id == room_id))
+        await db.commit()
+
+        await async_redis_client.sadd(self.PENDING_KEY, room_id)
+        await room_membership.invalidate_room(room_id)
+        await message_cache.invalidate_room_cache(room_id)
+        await unread_counter.invalidate(members)
+
+        first_batch = (await db.scalars(
+            select(Message.id).where(Message.room_id == room_id).limit(self.batch_size + 1)
+        )).all()
+        return len(first_batch) <= self.batch_size
+
+    async def purge_room(self, room_id: int, bind: Optional[AsyncEngine] = None) -> bool:
+        """
+        Segunda fase: borrar mensajes, adjuntos, archivos y la sala
+
+        Args:
+            room_id: ID de la sala
+            bind: Engine a usar (por defecto el de la aplicación)
+
+        Returns:
+            True si la sala quedó eliminada; False si otro worker la está
+            purgando o hubo un error (sigue pendiente y se reintenta al arrancar)
+        """
+        lock_key = self._get_lock_key(room_id)
+        try:
+            acquired = await async_redis_client.client.set(lock_key, "1", nx=True, ex=ROOM_DELETE_LOCK_TTL)
+        except Exception as e:
+            # Sin Redis no hay lock, pero los DELETE son idempotentes: se purga igual
+            logger.error(f"❌ Error tomando lock de eliminación de sala {room_id}: {e}")
+            acquired = True
+        if not acquired:
+            logger.info(f"⏭️ Sala {room_id} ya se está eliminando en otro worker")
+            return False
+
+        session_factory = async_sessionmaker(bind=bind or async_engine, expire_on_commit=False)
+        messages_deleted = files_deleted = 0
+        try:
+            while True:
+                async with session_factory() as db:
+                    message_ids = (await db.scalars(
+                        select(Message.id).where(Message.room_id == room_id).limit(self.batch_size)
+                    )).all()
+
+                    if not message_ids:
+                        await db.execute(delete(RoomParticipant).where(RoomParticipant.room_id == room_id))
+                        await db.execute(delete(ChatRoom).where(ChatRoom.id == room_id))
+                        await db.commit()
+                        break
+
+                    file_urls = (await db.scalars(
+                        select(Attachment.file_url).where(Attachment.message_id.in_(message_ids))
+                    )).all()
+                    await db.execute(delete(Attachment).where(Attachment.message_id.in_(message_ids)))
+                    await db.execute(delete(Message).where(Message.id.in_(message_ids)))
+                    await db.commit()
+
+                    messages_deleted += len(message_ids)
+                    files_deleted += await delete_unreferenced_uploads(file_urls, db)
+
+                await async_redis_client.expire(lock_key, ROOM_DELETE_LOCK_TTL)
+
+            # Lo que se haya vuelto a cachear durante la purga (las versiones caducan solas)
+            await message_cache.invalidate_room_cache(room_id)
+            await room_membership.invalidate_room(room_id)
+            await async_redis_client.srem(self.PENDING_KEY, room_id)
+            logger.info(
+                f"🗑️ Sala {room_id} eliminada: {messages_deleted} mensajes, {files_deleted} archivos"
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Error eliminando sala {room_id} (queda pendiente): {e}", exc_info=True)
+            return False
+
+        finally:
+            await async_redis_client.delete(lock_key)
+
+    async def resume(self):
+        """Retomar en segundo plano las salas que quedaron a medio eliminar"""
+        for room_id in await async_redis_client.smembers(self.PENDING_KEY):
+            task = asyncio.create_task(self.purge_room(int(room_id)))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            logger.info(f"♻️ Retomando eliminación de sala {room_id}")
+
+    async def stop(self):
+        """Cancelar las purgas en curso (se retoman en el siguiente arranque)"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+# Instancia global
+room_cleanup = RoomCleanupService()
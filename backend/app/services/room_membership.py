@@ -0,0 +1,219 @@
+"""
+Servicio de autorización por sala: ¿es el usuario participante?
+
+Tres niveles, del más barato al más caro:
+1. LRU local con TTL corto (por worker): sin red
+2. Set Redis por sala con todos los participantes: un round trip (script Lua)
+3. room_participants en la DB: se lee la sala completa y se carga en Redis
+
+Cualquier cambio de participantes (add/remove, crear o eliminar sala) debe llamar
+a invalidate_room(). En el worker que hace el cambio se limpia el LRU local al
+instante; en el resto de workers la entrada local caduca tras MEMBERSHIP_LOCAL_TTL.
+"""
+
+import logging
+import os
+from typing import Union
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models.room_participant import RoomParticipant
+from app.redis_client import async_redis_client
+from app.services.local_cache import LocalTTLCache
+
+logger = logging.getLogger(__name__)
+
+# TTL del set de participantes en Redis (segundos)
+MEMBERSHIP_CACHE_TTL = int(os.getenv("MEMBERSHIP_CACHE_TTL", "3600"))
+# TTL y tamaño del LRU local de cada worker
+MEMBERSHIP_LOCAL_TTL = float(os.getenv("MEMBERSHIP_LOCAL_TTL", "5"))
+MEMBERSHIP_LOCAL_MAX_ENTRIES = int(os.getenv("MEMBERSHIP_LOCAL_MAX_ENTRIES", "10000"))
+
+# Consultar pertenencia distinguiendo "no es participante" de "sala no cargada"
+# KEYS[1]: set de la sala, ARGV[1]: user_id
+# Retorna 1/0 o -1 si el set no existe (hay que cargarlo desde la DB)
+CHECK_MEMBER_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+return redis.call('SISMEMBER', KEYS[1], ARGV[1])
+"""
+
+# Cargar el set de una sala leído de la DB, salvo que la versión haya cambiado
+# (un add/remove posterior a la lectura no se pisa con datos viejos)
+# KEYS[1]: set de la sala, KEYS[2]: versión de la sala
+# ARGV[1]: versión leída antes de consultar la DB, ARGV[2]: TTL, ARGV[3]: marcador, ARGV[4..]: user_ids
+LOAD_MEMBERS_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return -1
+end
+redis.call('DEL', KEYS[1])
+redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return #ARGV - 3
+"""
+
+DbSession = Union[AsyncSession, Session]
+
+
+class RoomMembershipService:
+    """Caché de participantes por sala (Redis + LRU local)"""
+
+    # Miembro ficticio: el set de una sala sin participantes no puede quedar vacío
+    # (Redis borra los sets vacíos y se confundiría con "sala no cargada")
+    LOADED_MARKER = "*"
+
+    # Scripts Lua (registrarlos no contacta a Redis; se cargan con el primer EVALSHA)
+    _check_member_script = async_redis_client.register_script(CHECK_MEMBER_SCRIPT)
+    _load_members_script = async_redis_client.register_script(LOAD_MEMBERS_SCRIPT)
+
+    def __init__(self):
+        # (room_id, user_id) -> es_participante
+        self._local = LocalTTLCache(MEMBERSHIP_LOCAL_TTL, MEMBERSHIP_LOCAL_MAX_ENTRIES)
+        self._hits = {"local": 0, "redis": 0, "db": 0}
+
+    @staticmethod
+    def _get_room_key(room_id: int) -> str:
+        """Generar clave Redis del set de participantes de una sala"""
+        return f"room:{room_id}:members"
+
+    @staticmethod
+    def _get_version_key(room_id: int) -> str:
+        """Generar clave Redis con la versión del set de participantes de una sala"""
+        return f"room:{room_id}:members:version"
+
+    @staticmethod
+    async def _load_room_members(room_id: int, db: DbSession) -> set:
+        """Leer los participantes de una sala (acepta sesión async o sync)"""
+        query = select(RoomParticipant.user_id).where(RoomParticipant.room_id == room_id)
+        if isinstance(db, AsyncSession):
+            return set((await db.scalars(query)).all())
+        return set(db.scalars(query).all())
+
+    async def is_member(self, room_id: int, user_id: int, db: DbSession) -> bool:
+        """
+        Verificar si un usuario es participante de una sala
+
+        Args:
+            room_id: ID de la sala
+            user_id: ID del usuario
+            db: Sesión de base de datos (solo se usa si la sala no está en Redis)
+
+        Returns:
+            True si es participante
+        """
+        cached = self._local.get((room_id, user_id))
+        if cached is not None:
+            self._hits["local"] += 1
+            return cached
+
+        room_key = self._get_room_key(room_id)
+        try:
+            result = await self._check_member_script(keys=[room_key], args=[str(user_id)])
+        except Exception as e:
+            logger.error(f"❌ Error consultando participantes de sala {room_id} en Redis: {e}")
+            result = None
+
+        if result is not None and result >= 0:
+            self._hits["redis"] += 1
+            is_member = bool(result)
+            self._local.set((room_id, user_id), is_member)
+            return is_member
+
+        # Miss (o Redis no disponible): la DB es la fuente de verdad
+        members = await self._load_and_cache(room_id, db, cache=result is not None)
+        is_member = user_id in members
+
+        self._local.set((room_id, user_id), is_member)
+        return is_member
+
+    async def get_members(self, room_id: int, db: DbSession) -> set:
+        """
+        Obtener los IDs de todos los participantes de una sala
+
+        Args:
+            room_id: ID de la sala
+            db: Sesión de base de datos (solo se usa si la sala no está en Redis)
+
+        Returns:
+            Set de user_ids (vacío si la sala no tiene participantes)
+        """
+        try:
+            cached = await async_redis_client.client.smembers(self._get_room_key(room_id))
+        except Exception as e:
+            logger.error(f"❌ Error leyendo participantes de sala {room_id} en Redis: {e}")
+            return await self._load_and_cache(room_id, db, cache=False)
+
+        if cached:
+            self._hits["redis"] += 1
+            return {int(member) for member in cached if member != self.LOADED_MARKER}
+
+        return await self._load_and_cache(room_id, db, cache=True)
+
+    async def _load_and_cache(self, room_id: int, db: DbSession, cache: bool) -> set:
+        """
+        Leer los participantes de la DB y, si cache=True, cargarlos en Redis
+
+        La versión se lee antes de la consulta: si la sala cambia mientras tanto
+        el script descarta la carga.
+        """
+        self._hits["db"] += 1
+        version = await async_redis_client.get(self._get_version_key(room_id)) or "0"
+        members = await self._load_room_members(room_id, db)
+
+        if cache:
+            try:
+                loaded = await self._load_members_script(
+                    keys=[self._get_room_key(room_id), self._get_version_key(room_id)],
+                    args=[version, MEMBERSHIP_CACHE_TTL, self.LOADED_MARKER, *[str(m) for m in members]]
+                )
+                if loaded < 0:
+                    logger.info(f"⏭️ Participantes de sala {room_id} cambiaron durante la consulta, no se cachean")
+            except Exception as e:
+                logger.error(f"❌ Error cacheando participantes de sala {room_id}: {e}")
+
+        return members
+
+    async def invalidate_room(self, room_id: int) -> bool:
+        """
+        Invalidar los participantes cacheados de una sala
+
+        Llamar DESPUÉS del commit que cambia room_participants.
+
+        Args:
+            room_id: ID de la sala
+
+        Returns:
+            True si se invalidó correctamente en Redis
+        """
+        # LRU local de este worker: se limpia siempre, aunque Redis falle
+        self._local.delete_where(lambda key: key[0] == room_id)
+
+        try:
+            # DEL + INCR de versión en una transacción MULTI: una carga en curso
+            # con datos previos al cambio se descarta
+            pipe = async_redis_client.pipeline()
+            pipe.delete(self._get_room_key(room_id))
+            pipe.incr(self._get_version_key(room_id))
+            pipe.expire(self._get_version_key(room_id), MEMBERSHIP_CACHE_TTL)
+            await pipe.execute()
+            logger.info(f"🗑️ Participantes cacheados de sala {room_id} invalidados")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error invalidando participantes de sala {room_id}: {e}")
+            return False
+
+    def get_stats(self) -> dict:
+        """Estadísticas del caché de participantes de este worker"""
+        return {
+            "local_entries": len(self._local),
+            "local_ttl": MEMBERSHIP_LOCAL_TTL,
+            "redis_ttl": MEMBERSHIP_CACHE_TTL,
+            "hits": dict(self._hits)
+        }
+
+
+# Instancia global
+room_membership = RoomMembershipService()
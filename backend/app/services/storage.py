@@ -0,0 +1,190 @@
+"""
+Backends de almacenamiento de archivos subidos
+
+Los blobs se identifican por su clave (`{sha256}{extensión}`, ver uploads.py) y
+su file_url es siempre `/uploads/{clave}`, sea cual sea el backend:
+
+- local (por defecto): archivos en UPLOAD_DIR servidos por la propia API
+- s3: bucket S3 o compatible (MinIO, Ceph...). La API solo responde
+  /uploads/{clave} con una redirección a una URL prefirmada: los bytes se
+  descargan directamente del almacenamiento y no pasan por los nodos de la API.
+  Requiere boto3 (opcional, no está en requirements.txt).
+
+STORAGE_BACKEND elige el backend. Todas las operaciones son bloqueantes: desde
+código async llamar con run_in_threadpool.
+"""
+
+import logging
+import mimetypes
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Backend de almacenamiento: local o s3
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+
+# Directorio del backend local
+UPLOAD_DIR = Path("uploads")
+
+# Backend S3 (S3_ENDPOINT_URL solo para servicios compatibles, ej: http://minio:9000)
+S3_BUCKET = os.getenv("S3_BUCKET", "chat-uploads")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID") or None
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY") or None
+# Validez de las URLs de descarga prefirmadas (segundos)
+S3_PRESIGNED_URL_TTL = int(os.getenv("S3_PRESIGNED_URL_TTL", "3600"))
+# Tamaño de cada parte de la subida multipart (bytes, mínimo 5MB en S3)
+S3_MULTIPART_CHUNK_SIZE = int(os.getenv("S3_MULTIPART_CHUNK_SIZE", str(8 * 1024 * 1024)))
+
+# Los blobs nunca cambian de contenido: se pueden cachear indefinidamente
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class StorageBackend(ABC):
+    """Interfaz de almacenamiento de blobs"""
+
+    # Directorio donde se escriben los temporales de subida antes de save()
+    staging_dir: Path
+
+    @abstractmethod
+    def size(self, key: str) -> Optional[int]:
+        """Tamaño del blob en bytes o None si no existe"""
+
+    @abstractmethod
+    def save(self, key: str, source: Path) -> None:
+        """Guardar un temporal (ya completo) como blob; el temporal se consume"""
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        """Eliminar un blob (True si existía)"""
+
+    @abstractmethod
+    def download(self, key: str, destination: Path) -> None:
+        """Copiar un blob a un archivo local"""
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Ruta en disco del blob (None si el backend no es local)"""
+        return None
+
+    def get_download_url(self, key: str) -> Optional[str]:
+        """URL de descarga directa (None si la API sirve el archivo)"""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """Blobs en un directorio local (un solo nodo o volumen compartido)"""
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(exist_ok=True)
+        # Mismo sistema de archivos que los blobs: save() es un rename atómico
+        self.staging_dir = root
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return (self.root / key).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def save(self, key: str, source: Path) -> None:
+        os.replace(source, self.root / key)
+
+    def delete(self, key: str) -> bool:
+        try:
+            (self.root / key).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+    def download(self, key: str, destination: Path) -> None:
+        shutil.copyfile(self.root / key, destination)
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self.root / key
+
+
+class S3Storage(StorageBackend):
+    """Blobs en un bucket S3 o compatible, descargados con URLs prefirmadas"""
+
+    def __init__(self, bucket: str, client=None, presigned_url_ttl: int = S3_PRESIGNED_URL_TTL):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requiere boto3 (pip install boto3)")
+
+        self.bucket = bucket
+        self.client = client or boto3.client(
+            "s3",
+            endpoint_url=S3_ENDPOINT_URL,
+            region_name=S3_REGION,
+            aws_access_key_id=S3_ACCESS_KEY_ID,
+            aws_secret_access_key=S3_SECRET_ACCESS_KEY
+        )
+        self.presigned_url_ttl = presigned_url_ttl
+        # upload_file envía el temporal por partes: memoria acotada a unas pocas partes
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=S3_MULTIPART_CHUNK_SIZE
+        )
+        self._client_error = ClientError
+        self.staging_dir = Path(tempfile.gettempdir())
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def save(self, key: str, source: Path) -> None:
+        try:
+            self.client.upload_file(
+                str(source),
+                self.bucket,
+                key,
+                ExtraArgs={
+                    "ContentType": mimetypes.guess_type(key)[0] or "application/octet-stream",
+                    "CacheControl": IMMUTABLE_CACHE_CONTROL
+                },
+                Config=self.transfer_config
+            )
+        finally:
+            source.unlink(missing_ok=True)
+
+    def delete(self, key: str) -> bool:
+        # DeleteObject no distingue si la clave existía
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        return True
+
+    def download(self, key: str, destination: Path) -> None:
+        self.client.download_file(self.bucket, key, str(destination), Config=self.transfer_config)
+
+    def get_download_url(self, key: str) -> Optional[str]:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=self.presigned_url_ttl
+        )
+
+
+def create_storage_backend() -> StorageBackend:
+    """Crear el backend configurado en STORAGE_BACKEND"""
+    if STORAGE_BACKEND == "s3":
+        logger.info(f"🪣 Almacenamiento de archivos en S3 (bucket {S3_BUCKET})")
+        return S3Storage(S3_BUCKET)
+    if STORAGE_BACKEND != "local":
+        logger.warning(f"⚠️ STORAGE_BACKEND={STORAGE_BACKEND} no soportado, usando local")
+    return LocalStorage(UPLOAD_DIR)
+
+
+# Instancia global
+storage = create_storage_backend()
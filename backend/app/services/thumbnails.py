@@ -0,0 +1,158 @@
+"""
+Vistas previas de imágenes subidas (miniatura WebP + blurhash)
+
+Tras /attachments/upload de una imagen se programa generate() como background
+task: la respuesta no espera. El trabajo de CPU (decodificar, reducir, codificar
+WebP y calcular el blurhash) se hace en un pool de procesos para no bloquear el
+event loop ni competir por el GIL con las peticiones.
+
+La miniatura se guarda en el mismo backend que el original (`{sha256}_thumb.webp`)
+y el resultado en la tabla upload_previews, una fila por blob: todos los
+adjuntos que apuntan al mismo archivo la comparten (Attachment.preview) y un
+blob deduplicado no se vuelve a procesar.
+
+Pillow es opcional: sin él (o con THUMBNAILS_ENABLED=false) no se generan
+vistas previas y los campos quedan a null.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from app.database import async_engine
+from app.models.attachment import Attachment
+from app.models.message import Message
+from app.models.upload_preview import UploadPreview
+from app.services import image_preview
+from app.services.message_cache import message_cache
+from app.services.storage import storage
+from app.services.uploads import UPLOAD_TEMP_PREFIX, UPLOAD_URL_PREFIX, get_thumbnail_key
+
+logger = logging.getLogger(__name__)
+
+# Generar vistas previas de las imágenes subidas (requiere Pillow)
+THUMBNAILS_ENABLED = os.getenv("THUMBNAILS_ENABLED", "true").lower() == "true"
+# Lado máximo de las miniaturas (píxeles)
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "320"))
+# Procesos del pool (por worker de la API)
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+
+
+class ThumbnailService:
+    """Pool de procesos que genera las vistas previas fuera de la petición"""
+
+    def __init__(self, workers: int = THUMBNAIL_WORKERS):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        """Las vistas previas están activadas y Pillow está instalado"""
+        return THUMBNAILS_ENABLED and image_preview.Image is not None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Crear el pool en el primer uso (spawn: no hereda hilos ni conexiones del worker)"""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._pool
+
+    async def generate(self, key: str, bind: Optional[AsyncEngine] = None) -> bool:
+        """
+        Generar y guardar la vista previa de una imagen subida
+
+        Args:
+            key: Clave del blob original
+            bind: Engine a usar (por defecto el de la aplicación)
+
+        Returns:
+            True si se generó; False si ya existía, está desactivado o falló
+            (nunca lanza: el adjunto funciona igual sin vista previa)
+        """
+        if not self.enabled:
+            return False
+
+        file_url = f"{UPLOAD_URL_PREFIX}{key}"
+        session_factory = async_sessionmaker(bind=bind or async_engine, expire_on_commit=False)
+        async with session_factory() as db:
+            if await db.get(UploadPreview, file_url) is not None:
+                return False
+
+        thumbnail_key = get_thumbnail_key(key)
+        fd, thumbnail_name = tempfile.mkstemp(dir=storage.staging_dir, prefix=UPLOAD_TEMP_PREFIX, suffix=".webp")
+        os.close(fd)
+        thumbnail_path = Path(thumbnail_name)
+        downloaded: Optional[Path] = None
+        try:
+            source = storage.local_path(key)
+            if source is None:
+                # Backend remoto: el proceso necesita el original en disco
+                fd, downloaded_name = tempfile.mkstemp(dir=storage.staging_dir, prefix=UPLOAD_TEMP_PREFIX)
+                os.close(fd)
+                downloaded = Path(downloaded_name)
+                await run_in_threadpool(storage.download, key, downloaded)
+                source = downloaded
+
+            loop = asyncio.get_running_loop()
+            preview = await loop.run_in_executor(
+                self._get_pool(),
+                image_preview.create_preview,
+                str(source),
+                str(thumbnail_path),
+                THUMBNAIL_SIZE
+            )
+            await run_in_threadpool(storage.save, thumbnail_key, thumbnail_path)
+
+            async with session_factory() as db:
+                db.add(UploadPreview(
+                    file_url=file_url,
+                    thumbnail_url=f"{UPLOAD_URL_PREFIX}{thumbnail_key}",
+                    **preview
+                ))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    # Otra subida del mismo contenido terminó antes
+                    return False
+
+                # Mensajes ya cacheados con este archivo: se recargan con la vista previa
+                room_ids = (await db.scalars(
+                    select(Message.room_id).join(Attachment, Attachment.message_id == Message.id)
+                    .where(Attachment.file_url == file_url).distinct()
+                )).all()
+            for room_id in room_ids:
+                await message_cache.invalidate_room_cache(room_id)
+
+            logger.info(f"🖼️ Vista previa generada para {key} ({preview['width']}x{preview['height']})")
+            return True
+
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo generar la vista previa de {key}: {e}")
+            return False
+
+        finally:
+            thumbnail_path.unlink(missing_ok=True)
+            if downloaded is not None:
+                downloaded.unlink(missing_ok=True)
+
+    async def stop(self):
+        """Detener el pool (las vistas previas pendientes se descartan)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Instancia global
+thumbnail_service = ThumbnailService()
@@ -0,0 +1,354 @@
+"""
+Contadores de mensajes no leídos por usuario y sala (badges)
+
+Cada usuario tiene un hash Redis `user:{id}:unread` con {room_id: no_leídos}:
+- Un mensaje nuevo incrementa el contador del resto de participantes de la
+  sala (un solo EVALSHA para todos)
+- Marcar como leído (REST o evento WebSocket `read`) avanza el cursor
+  last_read_message_id del participante y pone el contador a 0
+- La bandeja de entrada lee el hash con un HGETALL: nunca COUNT(*) sobre messages
+
+El hash solo se reconstruye desde la DB cuando no existe (primer acceso, TTL o
+invalidación). Los incrementos sobre un hash no cargado no se aplican: en su
+lugar suben la versión del usuario y una reconstrucción en curso con datos
+anteriores se descarta (mismo esquema que los participantes de sala).
+
+Los cambios que alteran conteos ya acumulados (eliminar/restaurar mensajes,
+agregar participantes) llaman a invalidate() y el siguiente acceso recalcula.
+"""
+
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import and_, func, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.models.message import Message
+from app.models.room_participant import RoomParticipant
+from app.redis_client import async_redis_client
+from app.services.room_membership import room_membership
+
+logger = logging.getLogger(__name__)
+
+# TTL de los contadores de cada usuario (segundos, se renueva con cada escritura)
+UNREAD_CACHE_TTL = int(os.getenv("UNREAD_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Incrementar el contador de una sala para varios usuarios
+# KEYS: pares (hash del usuario, versión del usuario), ARGV[1]: room_id, ARGV[2]: TTL
+# Retorna el número de contadores incrementados
+INCREMENT_SCRIPT = """
+local incremented = 0
+for i = 1, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('HINCRBY', KEYS[i], ARGV[1], 1)
+        redis.call('EXPIRE', KEYS[i], ARGV[2])
+        incremented = incremented + 1
+    else
+        redis.call('INCR', KEYS[i + 1])
+        redis.call('EXPIRE', KEYS[i + 1], ARGV[2])
+    end
+end
+return incremented
+"""
+
+# Fijar el contador de una sala (o solo subir la versión si el hash no está cargado)
+# KEYS[1]: hash del usuario, KEYS[2]: versión, ARGV[1]: room_id, ARGV[2]: valor, ARGV[3]: TTL
+SET_COUNT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('INCR', KEYS[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# Cargar los contadores calculados en la DB, salvo que la versión haya cambiado
+# KEYS[1]: hash del usuario, KEYS[2]: versión
+# ARGV[1]: versión leída antes de consultar la DB, ARGV[2]: TTL, ARGV[3..]: pares campo/valor
+LOAD_COUNTS_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return -1
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def _after(message, anchor_created_at, anchor_id):
+    """Condición "el mensaje es posterior al ancla" por (created_at, id)"""
+    return tuple_(message.created_at, message.id) > tuple_(anchor_created_at, anchor_id)
+
+
+class UnreadCounterService:
+    """Contadores de no leídos en Redis + cursor de lectura en room_participants"""
+
+    # Campo ficticio: el hash de un usuario sin salas no puede quedar vacío
+    LOADED_MARKER = "*"
+
+    _increment_script = async_redis_client.register_script(INCREMENT_SCRIPT)
+    _set_count_script = async_redis_client.register_script(SET_COUNT_SCRIPT)
+    _load_counts_script = async_redis_client.register_script(LOAD_COUNTS_SCRIPT)
+
+    @staticmethod
+    def _get_user_key(user_id: int) -> str:
+        """Generar clave Redis del hash de no leídos de un usuario"""
+        return f"user:{user_id}:unread"
+
+    @staticmethod
+    def _get_version_key(user_id: int) -> str:
+        """Generar clave Redis con la versión de los contadores de un usuario"""
+        return f"user:{user_id}:unread:version"
+
+    async def notify_new_message(self, room_id: int, sender_id: int, db: AsyncSession) -> int:
+        """
+        Sumar un no leído a todos los participantes de la sala salvo el autor
+
+        Llamar DESPUÉS de aceptar el mensaje (commit o XADD en write-behind).
+
+        Args:
+            room_id: ID de la sala
+            sender_id: ID del autor del mensaje
+            db: Sesión de base de datos (solo si los participantes no están en Redis)
+
+        Returns:
+            Número de contadores incrementados (-1 si falló; nunca lanza)
+        """
+        try:
+            members = await room_membership.get_members(room_id, db)
+            keys = []
+            for user_id in members:
+                if user_id != sender_id:
+                    keys += [self._get_user_key(user_id), self._get_version_key(user_id)]
+            if not keys:
+                return 0
+
+            return await self._increment_script(keys=keys, args=[room_id, UNREAD_CACHE_TTL])
+        except Exception as e:
+            # El mensaje ya está aceptado: un contador desfasado se corrige al marcar leído
+            logger.error(f"❌ Error incrementando no leídos de sala {room_id}: {e}")
+            return -1
+
+    async def get_counts(self, user_id: int, db: AsyncSession) -> Dict[int, int]:
+        """
+        Obtener los no leídos de un usuario en todas sus salas
+
+        Args:
+            user_id: ID del usuario
+            db: Sesión de base de datos (solo si el hash no está cargado)
+
+        Returns:
+            Dict {room_id: no_leídos}; las salas sin entrada tienen 0
+        """
+        user_key = self._get_user_key(user_id)
+        try:
+            cached = await async_redis_client.client.hgetall(user_key)
+        except Exception as e:
+            logger.error(f"❌ Error leyendo no leídos del usuario {user_id}: {e}")
+            return await self._count_from_db(user_id, db)
+
+        if cached:
+            return {int(room_id): int(count) for room_id, count in cached.items() if room_id != self.LOADED_MARKER}
+
+        # Miss: reconstruir desde los cursores de lectura
+        version = await async_redis_client.get(self._get_version_key(user_id)) or "0"
+        counts = await self._count_from_db(user_id, db)
+
+        fields = [self.LOADED_MARKER, 0]
+        for room_id, count in counts.items():
+            fields += [room_id, count]
+        try:
+            loaded = await self._load_counts_script(
+                keys=[user_key, self._get_version_key(user_id)],
+                args=[version, UNREAD_CACHE_TTL, *fields]
+            )
+            if loaded < 0:
+                logger.info(f"⏭️ No leídos del usuario {user_id} cambiaron durante la consulta, no se cachean")
+        except Exception as e:
+            logger.error(f"❌ Error cacheando no leídos del usuario {user_id}: {e}")
+
+        return counts
+
+    async def mark_read(
+        self,
+        room_id: int,
+        user_id: int,
+        db: AsyncSession,
+        message_id: Optional[int] = None
+    ) -> Optional[dict]:
+        """
+        Marcar una sala como leída hasta un mensaje y reiniciar su contador
+
+        El cursor solo avanza: confirmar un mensaje anterior al cursor no lo
+        retrocede. Si el cursor queda en el último mensaje de la sala (caso
+        normal) el contador pasa a 0 sin consultar messages.
+
+        Args:
+            room_id: ID de la sala (el usuario debe ser participante)
+            user_id: ID del usuario
+            db: Sesión de base de datos
+            message_id: Último mensaje leído (por defecto el más reciente de la sala)
+
+        Returns:
+            {"room_id", "last_read_message_id", "unread_count"} o None si el
+            mensaje no pertenece a la sala o el usuario no es participante
+        """
+        position = select(Message.created_at, Message.id)
+        latest = (await db.execute(
+            position.where(Message.room_id == room_id, Message.is_deleted == False)
+            .order_by(Message.created_at.desc(), Message.id.desc())
+            .limit(1)
+        )).first()
+
+        if message_id is None:
+            target = latest
+        else:
+            target = (await db.execute(
+                position.where(Message.id == message_id, Message.room_id == room_id)
+            )).first()
+            if target is None:
+                return None
+
+        # Avance atómico: solo si el cursor actual es anterior al objetivo. Con dos
+        # confirmaciones concurrentes gana la más reciente y el cursor nunca retrocede
+        moved = False
+        if target is not None:
+            cursor = aliased(Message)
+            result = await db.execute(
+                update(RoomParticipant)
+                .where(
+                    RoomParticipant.room_id == room_id,
+                    RoomParticipant.user_id == user_id,
+                    or_(
+                        RoomParticipant.last_read_message_id.is_(None),
+                        ~select(cursor.id).where(
+                            cursor.id == RoomParticipant.last_read_message_id,
+                            tuple_(cursor.created_at, cursor.id) >= tuple_(*target)
+                        ).exists()
+                    )
+                )
+                .values(last_read_message_id=target.id)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            moved = result.rowcount > 0
+
+        participant = (await db.execute(
+            select(RoomParticipant.last_read_message_id).where(
+                RoomParticipant.room_id == room_id,
+                RoomParticipant.user_id == user_id
+            )
+        )).first()
+        if participant is None:
+            return None
+
+        current = None
+        if moved:
+            current = target
+        elif participant.last_read_message_id is not None:
+            current = (await db.execute(
+                position.where(Message.id == participant.last_read_message_id)
+            )).first()
+
+        # Mensajes de otros posteriores al cursor: solo se cuentan si no se leyó hasta el final
+        unread_count = 0
+        if latest is not None and (current is None or tuple(latest) > tuple(current)):
+            query = select(func.count(Message.id)).where(
+                Message.room_id == room_id,
+                Message.is_deleted == False,
+                Message.user_id != user_id
+            )
+            if current is not None:
+                query = query.where(_after(Message, *current))
+            unread_count = await db.scalar(query)
+
+        # Solo quien movió el cursor fija el contador: una confirmación que llega
+        # tarde no pisa el valor de otra más reciente
+        if moved:
+            try:
+                await self._set_count_script(
+                    keys=[self._get_user_key(user_id), self._get_version_key(user_id)],
+                    args=[room_id, unread_count, UNREAD_CACHE_TTL]
+                )
+            except Exception as e:
+                logger.error(f"❌ Error reiniciando no leídos de sala {room_id} para usuario {user_id}: {e}")
+
+        return {
+            "room_id": room_id,
+            "last_read_message_id": participant.last_read_message_id,
+            "unread_count": unread_count
+        }
+
+    async def invalidate(self, user_ids: Iterable[int]) -> bool:
+        """
+        Invalidar los contadores de varios usuarios (se recalculan en el siguiente acceso)
+
+        Llamar DESPUÉS del commit del cambio.
+
+        Returns:
+            True si se invalidó correctamente en Redis
+        """
+        user_ids = list(user_ids)
+        if not user_ids:
+            return True
+
+        try:
+            # DEL + INCR de versión en MULTI: descarta reconstrucciones con datos previos
+            pipe = async_redis_client.pipeline()
+            for user_id in user_ids:
+                pipe.delete(self._get_user_key(user_id))
+                pipe.incr(self._get_version_key(user_id))
+                pipe.expire(self._get_version_key(user_id), UNREAD_CACHE_TTL)
+            await pipe.execute()
+            logger.info(f"🗑️ No leídos invalidados para {len(user_ids)} usuarios")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error invalidando no leídos: {e}")
+            return False
+
+    async def invalidate_room(self, room_id: int, db: AsyncSession) -> bool:
+        """Invalidar los contadores de todos los participantes de una sala"""
+        return await self.invalidate(await room_membership.get_members(room_id, db))
+
+    @staticmethod
+    async def _count_from_db(user_id: int, db: AsyncSession) -> Dict[int, int]:
+        """
+        Calcular los no leídos de todas las salas del usuario (una consulta agrupada)
+
+        Solo se usa para reconstruir el hash: mensajes de otros usuarios, no
+        eliminados y posteriores al cursor de lectura por (created_at, id).
+        """
+        read_message = aliased(Message)
+        # Cursor apuntando a un mensaje borrado físicamente: se compara por ID
+        after_cursor = or_(
+            and_(
+                read_message.id.is_(None),
+                Message.id > func.coalesce(RoomParticipant.last_read_message_id, 0)
+            ),
+            _after(Message, read_message.created_at, read_message.id)
+        )
+
+        rows = (await db.execute(
+            select(RoomParticipant.room_id, func.count(Message.id))
+            .select_from(RoomParticipant)
+            .outerjoin(read_message, read_message.id == RoomParticipant.last_read_message_id)
+            .outerjoin(Message, and_(
+                Message.room_id == RoomParticipant.room_id,
+                Message.is_deleted == False,
+                Message.user_id != user_id,
+                after_cursor
+            ))
+            .where(RoomParticipant.user_id == user_id)
+            .group_by(RoomParticipant.room_id)
+        )).all()
+
+        return {room_id: count for room_id, count in rows}
+
+
+# Instancia global
+unread_counter = UnreadCounterService()
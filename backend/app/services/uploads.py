@@ -0,0 +1,238 @@
+"""
+Archivos subidos (/attachments/upload), guardados en el backend de almacenamiento
+configurado (ver storage.py) y servidos en /uploads
+
+Almacenamiento direccionado por contenido: cada archivo se guarda una sola vez
+como `{sha256}{extensión}`. Reenviar el mismo archivo a 200 salas crea 200
+adjuntos que apuntan al mismo blob; las referencias son las filas de
+attachments con esa file_url y el blob se borra cuando no queda ninguna
+(delete_unreferenced_uploads).
+
+save_upload() copia el archivo por bloques de UPLOAD_CHUNK_SIZE a un temporal,
+calculando el SHA-256 sobre la marcha, y lo entrega al backend (rename atómico
+en local, subida multipart en S3): la memoria por subida es constante y un
+archivo a medio escribir nunca es visible en /uploads. Si el blob ya existía
+el temporal se descarta, y con find_blob() el cliente puede ahorrarse subirlo.
+
+Un blob reutilizado todavía no tiene su adjunto (el cliente lo crea después),
+así que se marca en Redis durante UPLOAD_CLAIM_TTL segundos y no se borra
+aunque en ese intervalo desaparezca el último adjunto que lo usaba.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional, Set, Union
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models.attachment import Attachment
+from app.models.upload_preview import UploadPreview
+from app.redis_client import async_redis_client
+from app.services.storage import storage
+
+logger = logging.getLogger(__name__)
+
+# Prefijo de las URLs de archivos subidos (seguido de la clave del blob)
+UPLOAD_URL_PREFIX = "/uploads/"
+
+# Tamaño de cada bloque leído/escrito al guardar una subida (bytes)
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+# Prefijo de los temporales (ocultos y nunca referenciados por un adjunto)
+UPLOAD_TEMP_PREFIX = ".upload-"
+# Segundos que un blob reutilizado queda protegido hasta que se cree su adjunto
+UPLOAD_CLAIM_TTL = int(os.getenv("UPLOAD_CLAIM_TTL", "3600"))
+
+DbSession = Union[AsyncSession, Session]
+
+
+class FileTooLargeError(Exception):
+    """El archivo supera el tamaño máximo permitido"""
+
+
+class StoredUpload(NamedTuple):
+    """Blob guardado en el backend de almacenamiento"""
+    filename: str
+    size: int
+    sha256: str
+    created: bool  # False si el contenido ya estaba almacenado
+
+
+def blob_filename(file_hash: str, extension: str) -> str:
+    """Nombre del blob: SHA-256 completo del contenido + extensión del tipo MIME"""
+    return f"{file_hash}{extension}"
+
+
+def get_thumbnail_key(key: str) -> str:
+    """Clave de la miniatura de un blob (se guarda junto al original)"""
+    return f"{Path(key).stem}_thumb.webp"
+
+
+def find_blob(file_hash: str, extension: str) -> Optional[StoredUpload]:
+    """
+    Buscar un blob ya almacenado
+
+    Returns:
+        StoredUpload (created=False) o None si no existe
+    """
+    filename = blob_filename(file_hash, extension)
+    size = storage.size(filename)
+    if size is None:
+        return None
+    return StoredUpload(filename=filename, size=size, sha256=file_hash, created=False)
+
+
+def save_upload(source: BinaryIO, extension: str, max_size: int) -> StoredUpload:
+    """
+    Guardar un archivo en el backend de almacenamiento leyéndolo por bloques
+
+    Bloqueante: desde un endpoint async llamar con run_in_threadpool.
+
+    Args:
+        source: Archivo de origen (UploadFile.file)
+        extension: Extensión del blob (según el tipo MIME)
+        max_size: Tamaño máximo en bytes
+
+    Returns:
+        StoredUpload con el nombre del blob, el tamaño y el SHA-256
+
+    Raises:
+        FileTooLargeError: En cuanto se leen más de max_size bytes
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    fd, temp_name = tempfile.mkstemp(dir=storage.staging_dir, prefix=UPLOAD_TEMP_PREFIX)
+    temp_path = Path(temp_name)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := source.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise FileTooLargeError(f"File larger than {max_size} bytes")
+                hasher.update(chunk)
+                f.write(chunk)
+
+        file_hash = hasher.hexdigest()
+        existing = find_blob(file_hash, extension)
+        if existing is not None:
+            temp_path.unlink()
+            return existing
+
+        filename = blob_filename(file_hash, extension)
+        storage.save(filename, temp_path)
+        return StoredUpload(filename=filename, size=size, sha256=file_hash, created=True)
+
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+def _get_claim_key(filename: str) -> str:
+    """Generar clave Redis que protege un blob reutilizado"""
+    return f"upload:{filename}:claimed"
+
+
+async def claim_upload(filename: str) -> bool:
+    """
+    Proteger un blob reutilizado hasta que se cree su adjunto
+
+    Returns:
+        True si se marcó en Redis
+    """
+    return await async_redis_client.set(_get_claim_key(filename), "1", ttl=UPLOAD_CLAIM_TTL)
+
+
+def get_upload_key(file_url: str) -> Optional[str]:
+    """
+    Clave del blob a partir de su file_url
+
+    Returns:
+        Clave o None si la URL no es de un archivo subido
+        (URLs externas o con separadores de ruta)
+    """
+    if not file_url.startswith(UPLOAD_URL_PREFIX):
+        return None
+
+    key = file_url[len(UPLOAD_URL_PREFIX):]
+    if not key or key != Path(key).name or key in (".", ".."):
+        return None
+    return key
+
+
+def get_upload_path(file_url: str) -> Optional[Path]:
+    """Ruta en disco de un archivo subido (solo con el backend local)"""
+    key = get_upload_key(file_url)
+    return storage.local_path(key) if key is not None else None
+
+
+async def delete_unreferenced_uploads(file_urls: Iterable[str], db: DbSession) -> int:
+    """
+    Eliminar del almacenamiento los blobs que ya no usa ningún adjunto
+
+    Llamar DESPUÉS del commit que elimina o cambia los adjuntos: un mismo blob
+    puede estar en muchos mensajes y solo se borra cuando no queda ninguna
+    referencia (ni un uso pendiente marcado con claim_upload). Con el blob se
+    borran su miniatura y su fila de upload_previews.
+
+    Args:
+        file_urls: file_url de los adjuntos eliminados
+        db: Sesión de base de datos (async o sync)
+
+    Returns:
+        Número de archivos eliminados
+    """
+    file_urls = {url for url in file_urls if get_upload_key(url) is not None}
+    if not file_urls:
+        return 0
+
+    query = select(Attachment.file_url).where(Attachment.file_url.in_(file_urls)).distinct()
+    if isinstance(db, AsyncSession):
+        still_used = set((await db.scalars(query)).all())
+    else:
+        still_used = set(db.scalars(query).all())
+
+    deleted = await _delete_blobs(file_urls - still_used)
+    if deleted:
+        previews = delete(UploadPreview).where(UploadPreview.file_url.in_(deleted))
+        if isinstance(db, AsyncSession):
+            await db.execute(previews)
+            await db.commit()
+        else:
+            db.execute(previews)
+            db.commit()
+    return len(deleted)
+
+
+async def _delete_blobs(file_urls: Set[str]) -> List[str]:
+    """Borrar blobs sin referencias (y sus miniaturas) salvo los reutilizados recientemente"""
+    if not file_urls:
+        return []
+
+    file_urls = sorted(file_urls)
+    try:
+        claims = await async_redis_client.client.mget(
+            [_get_claim_key(get_upload_key(url)) for url in file_urls]
+        )
+    except Exception as e:
+        # Sin saber si alguien los está reutilizando, es preferible no borrarlos
+        logger.error(f"❌ Error comprobando blobs reutilizados, no se eliminan: {e}")
+        return []
+
+    deleted = []
+    for file_url, claimed in zip(file_urls, claims):
+        if claimed is not None:
+            logger.info(f"⏭️ Blob {file_url} reutilizado recientemente, no se elimina")
+            continue
+        key = get_upload_key(file_url)
+        try:
+            await run_in_threadpool(storage.delete, key)
+            await run_in_threadpool(storage.delete, get_thumbnail_key(key))
+            deleted.append(file_url)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo eliminar {file_url}: {e}")
+    return deleted
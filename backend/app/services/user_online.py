@@ -4,7 +4,7 @@ Servicio para manejar estado online de usuarios en Redis
 
 import logging
 from typing import List, Set
-from app.redis_client import redis_client
+from app.redis_client import async_redis_client
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +15,7 @@ class UserOnlineService:
     ONLINE_USERS_KEY = "users:online"  # Set con IDs de usuarios online
     USER_CONNECTIONS_PREFIX = "user:connections:"  # Hash con conexiones por usuario
 
-    def set_user_online(self, user_id: int) -> bool:
+    async def set_user_online(self, user_id: int) -> bool:
         """
         Marcar usuario como online
 
@@ -26,14 +26,14 @@ class UserOnlineService:
             True si se marcó correctamente
         """
         try:
-            redis_client.sadd(self.ONLINE_USERS_KEY, str(user_id))
+            await async_redis_client.sadd(self.ONLINE_USERS_KEY, str(user_id))
             logger.info(f"✅ Usuario {user_id} marcado como online")
             return True
         except Exception as e:
             logger.error(f"❌ Error marcando usuario {user_id} como online: {e}")
             return False
 
-    def set_user_offline(self, user_id: int) -> bool:
+    async def set_user_offline(self, user_id: int) -> bool:
         """
         Marcar usuario como offline
 
@@ -44,14 +44,14 @@ class UserOnlineService:
             True si se marcó correctamente
         """
         try:
-            redis_client.srem(self.ONLINE_USERS_KEY, str(user_id))
+            await async_redis_client.srem(self.ONLINE_USERS_KEY, str(user_id))
             logger.info(f"✅ Usuario {user_id} marcado como offline")
             return True
         except Exception as e:
             logger.error(f"❌ Error marcando usuario {user_id} como offline: {e}")
             return False
 
-    def is_user_online(self, user_id: int) -> bool:
+    async def is_user_online(self, user_id: int) -> bool:
         """
         Verificar si un usuario está online
 
@@ -62,12 +62,12 @@ class UserOnlineService:
             True si está online
         """
         try:
-            return redis_client.sismember(self.ONLINE_USERS_KEY, str(user_id))
+            return await async_redis_client.sismember(self.ONLINE_USERS_KEY, str(user_id))
         except Exception as e:
             logger.error(f"❌ Error verificando si usuario {user_id} está online: {e}")
             return False
 
-    def get_online_users(self) -> Set[str]:
+    async def get_online_users(self) -> Set[str]:
         """
         Obtener todos los usuarios online
 
@@ -75,12 +75,12 @@ class UserOnlineService:
             Set con IDs de usuarios online
         """
         try:
-            return redis_client.smembers(self.ONLINE_USERS_KEY)
+            return await async_redis_client.smembers(self.ONLINE_USERS_KEY)
         except Exception as e:
             logger.error(f"❌ Error obteniendo usuarios online: {e}")
             return set()
 
-    def get_online_count(self) -> int:
+    async def get_online_count(self) -> int:
         """
         Obtener cantidad de usuarios online
 
@@ -88,12 +88,12 @@ class UserOnlineService:
             Número de usuarios online
         """
         try:
-            return redis_client.scard(self.ONLINE_USERS_KEY)
+            return await async_redis_client.scard(self.ONLINE_USERS_KEY)
         except Exception as e:
             logger.error(f"❌ Error obteniendo cantidad de usuarios online: {e}")
             return 0
 
-    def add_user_connection(self, user_id: int, connection_id: str) -> int:
+    async def add_user_connection(self, user_id: int, connection_id: str) -> int:
         """
         Agregar una conexión para un usuario (permite múltiples dispositivos)
 
@@ -106,18 +106,18 @@ class UserOnlineService:
         """
         try:
             key = f"{self.USER_CONNECTIONS_PREFIX}{user_id}"
-            result = redis_client.sadd(key, connection_id)
+            result = await async_redis_client.sadd(key, connection_id)
 
             # Marcar usuario como online si es su primera conexión
-            self.set_user_online(user_id)
+            await self.set_user_online(user_id)
 
             logger.info(f"✅ Conexión {connection_id} agregada para usuario {user_id}")
-            return redis_client.scard(key)
+            return await async_redis_client.scard(key)
         except Exception as e:
             logger.error(f"❌ Error agregando conexión para usuario {user_id}: {e}")
             return 0
 
-    def remove_user_connection(self, user_id: int, connection_id: str) -> int:
+    async def remove_user_connection(self, user_id: int, connection_id: str) -> int:
         """
         Eliminar una conexión de un usuario
 
@@ -130,15 +130,15 @@ class UserOnlineService:
         """
         try:
             key = f"{self.USER_CONNECTIONS_PREFIX}{user_id}"
-            redis_client.srem(key, connection_id)
+            await async_redis_client.srem(key, connection_id)
 
             # Obtener conexiones restantes
-            remaining = redis_client.scard(key)
+            remaining = await async_redis_client.scard(key)
 
             # Si no quedan conexiones, marcar como offline
             if remaining == 0:
-                self.set_user_offline(user_id)
-                redis_client.delete(key)  # Limpiar key vacía
+                await self.set_user_offline(user_id)
+                await async_redis_client.delete(key)  # Limpiar key vacía
 
             logger.info(f"✅ Conexión {connection_id} eliminada para usuario {user_id} ({remaining} restantes)")
             return remaining
@@ -146,7 +146,7 @@ class UserOnlineService:
             logger.error(f"❌ Error eliminando conexión para usuario {user_id}: {e}")
             return 0
 
-    def get_user_connections_count(self, user_id: int) -> int:
+    async def get_user_connections_count(self, user_id: int) -> int:
         """
         Obtener cantidad de conexiones activas de un usuario
 
@@ -158,7 +158,7 @@ class UserOnlineService:
         """
         try:
             key = f"{self.USER_CONNECTIONS_PREFIX}{user_id}"
-            return redis_client.scard(key)
+            return await async_redis_client.scard(key)
         except Exception as e:
             logger.error(f"❌ Error obteniendo conexiones de usuario {user_id}: {e}")
             return 0
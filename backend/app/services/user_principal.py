@@ -0,0 +1,127 @@
+"""
+Caché del usuario autenticado (principal) usado por get_current_principal
+
+Guarda solo lo que necesita la autorización: id, username e is_active.
+Dos niveles delante de la tabla users:
+1. LRU local con TTL corto (por worker)
+2. Opcional: clave Redis por usuario, compartida entre workers
+
+update_user / delete_user deben llamar a invalidate(). En el worker que hace el
+cambio se limpia el LRU local al instante; en el resto caduca tras PRINCIPAL_LOCAL_TTL.
+"""
+
+import logging
+import os
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.user import User
+from app.redis_client import async_redis_client
+from app.services.local_cache import LocalTTLCache
+
+logger = logging.getLogger(__name__)
+
+# TTL del nivel Redis (segundos) y si se usa
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_REDIS_CACHE = os.getenv("PRINCIPAL_REDIS_CACHE", "true").lower() == "true"
+# TTL y tamaño del LRU local de cada worker
+PRINCIPAL_LOCAL_TTL = float(os.getenv("PRINCIPAL_LOCAL_TTL", "5"))
+PRINCIPAL_LOCAL_MAX_ENTRIES = int(os.getenv("PRINCIPAL_LOCAL_MAX_ENTRIES", "10000"))
+
+
+class Principal(BaseModel):
+    """Usuario autenticado sin cargar el modelo ORM (inmutable: se comparte entre peticiones)"""
+    model_config = ConfigDict(frozen=True)
+
+    id: int
+    username: str
+    is_active: bool
+
+
+class UserPrincipalCache:
+    """Caché de principals por user_id (LRU local + Redis opcional)"""
+
+    def __init__(self):
+        # user_id -> Principal
+        self._local = LocalTTLCache(PRINCIPAL_LOCAL_TTL, PRINCIPAL_LOCAL_MAX_ENTRIES)
+        self._hits = {"local": 0, "redis": 0, "db": 0}
+
+    @staticmethod
+    def _get_user_key(user_id: int) -> str:
+        """Generar clave Redis del principal de un usuario"""
+        return f"user:{user_id}:principal"
+
+    async def get(self, user_id: int, db: AsyncSession) -> Optional[Principal]:
+        """
+        Obtener el principal de un usuario
+
+        Args:
+            user_id: ID del usuario (del token)
+            db: Sesión de base de datos (solo se usa en un miss)
+
+        Returns:
+            Principal o None si el usuario no existe
+        """
+        principal = self._local.get(user_id)
+        if principal is not None:
+            self._hits["local"] += 1
+            return principal
+
+        if PRINCIPAL_REDIS_CACHE:
+            data = await async_redis_client.get(self._get_user_key(user_id), as_json=True)
+            if data is not None:
+                self._hits["redis"] += 1
+                principal = Principal(**data)
+                self._local.set(user_id, principal)
+                return principal
+
+        # Miss: leer solo las columnas necesarias (sin instanciar el modelo ORM)
+        self._hits["db"] += 1
+        row = (await db.execute(
+            select(User.id, User.username, User.is_active).where(User.id == user_id)
+        )).first()
+        if row is None:
+            return None
+
+        principal = Principal(id=row.id, username=row.username, is_active=row.is_active)
+        if PRINCIPAL_REDIS_CACHE:
+            await async_redis_client.set(self._get_user_key(user_id), principal.model_dump(), ttl=PRINCIPAL_CACHE_TTL)
+        self._local.set(user_id, principal)
+        return principal
+
+    async def invalidate(self, user_id: int) -> bool:
+        """
+        Invalidar el principal cacheado de un usuario
+
+        Llamar DESPUÉS del commit que cambia o elimina al usuario.
+
+        Args:
+            user_id: ID del usuario
+
+        Returns:
+            True (los errores de Redis se registran en el cliente)
+        """
+        self._local.delete(user_id)
+        if not PRINCIPAL_REDIS_CACHE:
+            return True
+
+        await async_redis_client.delete(self._get_user_key(user_id))
+        logger.info(f"🗑️ Principal cacheado del usuario {user_id} invalidado")
+        return True
+
+    def get_stats(self) -> dict:
+        """Estadísticas del caché de principals de este worker"""
+        return {
+            "local_entries": len(self._local),
+            "local_ttl": PRINCIPAL_LOCAL_TTL,
+            "redis_enabled": PRINCIPAL_REDIS_CACHE,
+            "redis_ttl": PRINCIPAL_CACHE_TTL,
+            "hits": dict(self._hits)
+        }
+
+
+# Instancia global
+user_principal_cache = UserPrincipalCache()
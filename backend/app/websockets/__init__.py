@@ -1,4 +1,5 @@
 from app.websockets.manager import manager, ConnectionManager
+from app.websockets.cluster import ClusterBroadcaster
 from app.websockets.events import (
     EventType,
     WebSocketEvent,
@@ -6,17 +7,20 @@ from app.websockets.events import (
     TypingEvent,
     UserEvent,
     ErrorEvent,
-    create_event
+    create_event,
+    encode_event
 )
 
 __all__ = [
     "manager",
     "ConnectionManager",
+    "ClusterBroadcaster",
     "EventType",
     "WebSocketEvent",
     "MessageEvent",
     "TypingEvent",
     "UserEvent",
     "ErrorEvent",
-    "create_event"
+    "create_event",
+    "encode_event"
 ]
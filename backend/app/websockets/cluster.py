@@ -0,0 +1,189 @@
+"""
+Fan-out de broadcasts WebSocket entre procesos usando Redis Pub/Sub
+
+Cada worker publica los eventos de una sala en el canal `ws:room:{room_id}` y
+mantiene UNA sola suscripción Pub/Sub (un listener async) en la que se suscribe
+únicamente a las salas que tienen conexiones locales. Los mensajes recibidos se
+reparten a los sockets locales del worker.
+
+Formato del mensaje publicado: `{origin}|{exclude_connection_id}|{frame}` donde
+frame es el evento ya serializado, para no volver a codificarlo en cada worker.
+"""
+
+import asyncio
+import logging
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from app.redis_client import async_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Callback de entrega local: (room_id, frame, exclude_connection_id)
+LocalDeliveryHandler = Callable[[int, str, Optional[str]], Awaitable[None]]
+
+
+class ClusterBroadcaster:
+    """Puente entre el ConnectionManager local y los canales Pub/Sub de Redis"""
+
+    CHANNEL_PREFIX = "ws:room:"
+    RECONNECT_DELAY = 1.0  # Segundos de espera antes de reintentar el listener
+    PUBLISH_ATTEMPTS = 3  # Intentos de PUBLISH antes de darlo por fallido
+    PUBLISH_RETRY_DELAY = 0.05  # Segundos entre intentos (se duplica en cada uno)
+
+    def __init__(self):
+        # ID único de este worker (para aplicar exclude_connection_id solo en el origen)
+        self.node_id = uuid.uuid4().hex[:12]
+        self._pubsub = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self._handler: Optional[LocalDeliveryHandler] = None
+        self._rooms: set = set()
+        # Publicaciones que fallaron tras agotar los reintentos (para estadísticas)
+        self.publish_failures = 0
+
+    @classmethod
+    def _get_channel(cls, room_id: int) -> str:
+        """Generar nombre del canal Pub/Sub de una sala"""
+        return f"{cls.CHANNEL_PREFIX}{room_id}"
+
+    @property
+    def is_running(self) -> bool:
+        return self._listener_task is not None and not self._listener_task.done()
+
+    async def start(self, handler: LocalDeliveryHandler):
+        """
+        Iniciar el listener Pub/Sub de este worker
+
+        Args:
+            handler: Corrutina que entrega un evento a las conexiones locales
+        """
+        if self.is_running:
+            return
+
+        self._handler = handler
+        # Conexión dedicada del pool compartido para la suscripción
+        self._pubsub = async_redis_client.pubsub()
+        self._listener_task = asyncio.create_task(self._listen())
+        logger.info(f"📡 Broadcast en cluster activo (nodo {self.node_id})")
+
+    async def stop(self):
+        """Detener el listener y liberar la conexión Pub/Sub"""
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+
+        try:
+            if self._pubsub:
+                await self._pubsub.aclose()
+        except Exception as e:
+            logger.error(f"❌ Error cerrando Pub/Sub de cluster: {e}")
+        finally:
+            self._pubsub = None
+            self._rooms.clear()
+
+    async def subscribe_room(self, room_id: int):
+        """Suscribir este worker al canal de una sala (al tener su primera conexión local)"""
+        if room_id in self._rooms or not self._pubsub:
+            return
+        self._rooms.add(room_id)
+        try:
+            await self._pubsub.subscribe(self._get_channel(room_id))
+        except Exception as e:
+            logger.error(f"❌ Error suscribiendo a sala {room_id}: {e}")
+
+    async def unsubscribe_room(self, room_id: int):
+        """Dejar de escuchar una sala (cuando ya no tiene conexiones locales)"""
+        if room_id not in self._rooms or not self._pubsub:
+            return
+        self._rooms.discard(room_id)
+        try:
+            await self._pubsub.unsubscribe(self._get_channel(room_id))
+        except Exception as e:
+            logger.error(f"❌ Error desuscribiendo sala {room_id}: {e}")
+
+    async def publish(
+        self,
+        room_id: int,
+        frame: str,
+        exclude_connection_id: Optional[str] = None
+    ) -> Optional[int]:
+        """
+        Publicar un evento ya serializado para todos los workers suscritos a la sala
+
+        Los errores de Redis se reintentan PUBLISH_ATTEMPTS veces.
+
+        Returns:
+            Número de workers que recibieron el evento (0 = ningún worker tiene
+            la sala abierta) o None si Redis falló en todos los intentos
+        """
+        envelope = f"{self.node_id}|{exclude_connection_id or ''}|{frame}"
+        delay = self.PUBLISH_RETRY_DELAY
+        for attempt in range(1, self.PUBLISH_ATTEMPTS + 1):
+            try:
+                return await async_redis_client.client.publish(self._get_channel(room_id), envelope)
+            except Exception as e:
+                if attempt == self.PUBLISH_ATTEMPTS:
+                    logger.error(f"❌ Error publicando evento de sala {room_id} tras {attempt} intentos: {e}")
+                    break
+                logger.warning(f"⚠️ Error publicando evento de sala {room_id} (intento {attempt}), reintentando: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+        self.publish_failures += 1
+        return None
+
+    async def _listen(self):
+        """Loop del listener: recibir eventos de Redis y entregarlos localmente"""
+        while True:
+            try:
+                if not self._pubsub.subscribed:
+                    # Sin salas locales: no hay nada que leer todavía
+                    await asyncio.sleep(0.1)
+                    continue
+
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=1.0
+                )
+                if message is None or message.get("type") != "message":
+                    continue
+
+                await self._dispatch(message["channel"], message["data"])
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Error en listener Pub/Sub, reintentando: {e}")
+                await asyncio.sleep(self.RECONNECT_DELAY)
+                await self._resubscribe()
+
+    async def _dispatch(self, channel: str, raw: str):
+        """Decodificar un sobre recibido y entregarlo a las conexiones locales"""
+        try:
+            room_id = int(channel[len(self.CHANNEL_PREFIX):])
+            origin, exclude, frame = raw.split("|", 2)
+        except (TypeError, ValueError):
+            logger.warning("⚠️ Evento de cluster con formato inválido descartado")
+            return
+
+        # El exclude_connection_id solo tiene sentido en el worker que originó el evento
+        if origin != self.node_id or not exclude:
+            exclude = None
+
+        try:
+            await self._handler(room_id, frame, exclude)
+        except Exception as e:
+            logger.error(f"❌ Error entregando evento de cluster: {e}")
+
+    async def _resubscribe(self):
+        """Recrear la suscripción tras un error de conexión"""
+        try:
+            await self._pubsub.reset()
+            if self._rooms:
+                await self._pubsub.subscribe(*[self._get_channel(r) for r in self._rooms])
+        except Exception as e:
+            logger.error(f"❌ Error re-suscribiendo canales de cluster: {e}")
@@ -2,6 +2,13 @@ from enum import Enum
 from typing import Optional, Any
 from pydantic import BaseModel
 from datetime import datetime
+import json
+
+# orjson es opcional: si está instalado se usa para serializar eventos (bastante más rápido)
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
 
 class EventType(str, Enum):
     """Tipos de eventos WebSocket"""
@@ -10,6 +17,7 @@ class EventType(str, Enum):
     MESSAGE_SENT = "message_sent"
     MESSAGE_DELETED = "message_deleted"
     MESSAGE_UPDATED = "message_updated"
+    MESSAGE_READ = "message_read"
 
     # Usuario
     USER_JOINED = "user_joined"
@@ -95,3 +103,21 @@ def create_event(event_type: EventType, **kwargs) -> dict:
         "data": kwargs,
         "timestamp": datetime.now().isoformat()
     }
+
+def encode_event(event: dict) -> str:
+    """
+    Serializar un evento a texto JSON
+
+    Se llama una sola vez por evento: el mismo texto se envía a todos los
+    destinatarios en lugar de ejecutar json.dumps por cada socket.
+
+    Args:
+        event: Evento (diccionario)
+
+    Returns:
+        Frame de texto listo para enviar
+    """
+    if orjson is not None:
+        return orjson.dumps(event).decode("utf-8")
+    # Mismo formato que WebSocket.send_json de Starlette
+    return json.dumps(event, separators=(",", ":"), ensure_ascii=False)
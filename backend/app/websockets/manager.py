@@ -1,14 +1,25 @@
 from typing import Dict, List, Set
-from fastapi import WebSocket, WebSocketDisconnect
+from fastapi import WebSocket
+import asyncio
 import json
 import logging
+import os
 from datetime import datetime
 
-from app.websockets.events import EventType, create_event
+from app.websockets.events import EventType, create_event, encode_event
+from app.websockets.cluster import ClusterBroadcaster
+from app.websockets.outbound import OutboundQueue, OVERFLOW_POLICIES
 from app.services.user_online import user_online_service
 
 logger = logging.getLogger(__name__)
 
+# Modo de broadcast: "local" (un solo proceso) o "redis" (varios workers/nodos vía Pub/Sub)
+WS_BROADCAST_MODE = os.getenv("WS_BROADCAST_MODE", "local").lower()
+
+# Cola de salida por conexión: tamaño máximo y política ante consumidores lentos
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", 256))
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest").lower()  # drop_oldest | disconnect
+
 class ConnectionManager:
     """
     Gestor de conexiones WebSocket
@@ -19,22 +30,59 @@ class ConnectionManager:
             websocket_id: {
                 "websocket": WebSocket,
                 "user_id": int,
-                "username": str
+                "username": str,
+                "outbound": OutboundQueue
             }
         }
     }
+
+    Los envíos nunca se esperan directamente: cada conexión tiene su propia
+    cola acotada drenada por una tarea escritora (ver app/websockets/outbound.py).
     """
 
-    def __init__(self):
-        # Conexiones activas: {room_id: {connection_id: {websocket, user_id, username}}}
+    def __init__(
+        self,
+        broadcast_mode: str = WS_BROADCAST_MODE,
+        send_queue_size: int = WS_SEND_QUEUE_SIZE,
+        overflow_policy: str = WS_OVERFLOW_POLICY
+    ):
+        # Conexiones activas: {room_id: {connection_id: {websocket, user_id, username, outbound}}}
         self.active_connections: Dict[int, Dict[str, dict]] = {}
+        # Colas de salida indexadas por WebSocket (para send_personal_message)
+        self._outbound_by_ws: Dict[WebSocket, OutboundQueue] = {}
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"WS_OVERFLOW_POLICY inválida: {overflow_policy} (usar {', '.join(OVERFLOW_POLICIES)})")
+        self.send_queue_size = send_queue_size
+        self.overflow_policy = overflow_policy
+        # Mensajes descartados de conexiones ya cerradas (para estadísticas)
+        self._dropped_messages = 0
+        # Tareas de desconexión en curso (evitar que el GC las cancele)
+        self._pending_disconnects: Set[asyncio.Task] = set()
         # Contador para IDs únicos de conexión
         self._connection_counter = 0
+        # Broadcast entre procesos (solo se usa en modo "redis")
+        self.broadcast_mode = broadcast_mode
+        self.cluster = ClusterBroadcaster()
+
+    @property
+    def cluster_enabled(self) -> bool:
+        """Indica si los broadcasts se distribuyen entre workers vía Redis"""
+        return self.broadcast_mode == "redis"
+
+    async def start(self):
+        """Iniciar el listener Pub/Sub de este worker (solo en modo cluster)"""
+        if self.cluster_enabled:
+            await self.cluster.start(self._broadcast_local)
+
+    async def stop(self):
+        """Detener el listener Pub/Sub de este worker"""
+        if self.cluster_enabled:
+            await self.cluster.stop()
 
     def _generate_connection_id(self) -> str:
         """Generar ID único para una conexión"""
         self._connection_counter += 1
-        return f"conn_{self._connection_counter}_{datetime.now().timestamp()}"
+        return f"conn_{self.cluster.node_id}_{self._connection_counter}_{datetime.now().timestamp()}"
 
     async def connect(
         self,
@@ -63,16 +111,31 @@ class ConnectionManager:
         # Inicializar sala si no existe
         if room_id not in self.active_connections:
             self.active_connections[room_id] = {}
+            # Primera conexión local: escuchar el canal de la sala
+            if self.cluster_enabled:
+                await self.cluster.subscribe_room(room_id)
+
+        # Crear cola de salida con su tarea escritora
+        outbound = OutboundQueue(
+            websocket,
+            connection_id,
+            maxsize=self.send_queue_size,
+            overflow_policy=self.overflow_policy,
+            on_failure=lambda conn_id: self._schedule_disconnect(room_id, conn_id)
+        )
+        outbound.start()
+        self._outbound_by_ws[websocket] = outbound
 
         # Guardar conexión
         self.active_connections[room_id][connection_id] = {
             "websocket": websocket,
             "user_id": user_id,
-            "username": username
+            "username": username,
+            "outbound": outbound
         }
 
         # Registrar conexión en Redis (manejo de estado online)
-        user_online_service.add_user_connection(user_id, connection_id)
+        await user_online_service.add_user_connection(user_id, connection_id)
 
         logger.info(
             f"✅ Usuario {username} (ID: {user_id}) conectado a sala {room_id}. "
@@ -123,18 +186,25 @@ class ConnectionManager:
         user_id = connection_info["user_id"]
         username = connection_info["username"]
 
-        # Eliminar conexión
+        # Eliminar conexión y detener su tarea escritora
         del self.active_connections[room_id][connection_id]
+        outbound = connection_info["outbound"]
+        self._outbound_by_ws.pop(connection_info["websocket"], None)
+        self._dropped_messages += outbound.dropped
+        await outbound.close()
 
         # Eliminar conexión de Redis (actualiza estado online si es necesario)
-        user_online_service.remove_user_connection(user_id, connection_id)
+        await user_online_service.remove_user_connection(user_id, connection_id)
 
         # Si la sala quedó vacía, eliminarla
         if not self.active_connections[room_id]:
             del self.active_connections[room_id]
             logger.info(f"🗑️ Sala {room_id} eliminada (sin usuarios)")
-        else:
-            # Notificar a la sala que el usuario se fue
+            if self.cluster_enabled:
+                await self.cluster.unsubscribe_room(room_id)
+
+        # Notificar a la sala que el usuario se fue (en cluster puede haber usuarios en otros workers)
+        if room_id in self.active_connections or self.cluster_enabled:
             await self.broadcast(
                 room_id,
                 create_event(
@@ -153,10 +223,18 @@ class ConnectionManager:
         """
         Enviar mensaje a un cliente específico
 
+        Si el cliente está registrado se usa su cola de salida (respeta el orden
+        con los broadcasts); si no, se envía directamente.
+
         Args:
             message: Mensaje a enviar (diccionario)
             websocket: WebSocket del cliente
         """
+        outbound = self._outbound_by_ws.get(websocket)
+        if outbound is not None:
+            outbound.enqueue(encode_event(message))
+            return
+
         try:
             await websocket.send_json(message)
         except Exception as e:
@@ -167,46 +245,104 @@ class ConnectionManager:
         room_id: int,
         message: dict,
         exclude_connection_id: str = None
-    ):
+    ) -> bool:
         """
         Enviar mensaje a todos los clientes de una sala
 
+        El evento se serializa una única vez y el mismo frame se envía a todos
+        los destinatarios. En modo cluster el frame se publica en Redis y cada
+        worker (incluido este) lo entrega a sus conexiones locales; que ningún
+        worker tenga la sala abierta (0 receptores) no es un error.
+
         Args:
             room_id: ID de la sala
             message: Mensaje a enviar (diccionario)
             exclude_connection_id: ID de conexión a excluir (opcional)
+
+        Returns:
+            False si la publicación en Redis falló (ya reintentada) y el evento
+            solo llegó a las conexiones de este worker
+        """
+        frame = encode_event(message)
+
+        if self.cluster_enabled and self.cluster.is_running:
+            receivers = await self.cluster.publish(room_id, frame, exclude_connection_id)
+            if receivers is not None:
+                return True
+            # Redis no disponible: al menos entregar a las conexiones de este worker
+            logger.error(f"❌ Broadcast de cluster falló para sala {room_id}, entregado solo localmente")
+            await self._broadcast_local(room_id, frame, exclude_connection_id)
+            return False
+
+        await self._broadcast_local(room_id, frame, exclude_connection_id)
+        return True
+
+    async def _broadcast_local(
+        self,
+        room_id: int,
+        frame: str,
+        exclude_connection_id: str = None
+    ):
+        """
+        Enviar un frame ya serializado a los clientes de una sala conectados a este worker
+
+        Args:
+            room_id: ID de la sala
+            frame: Evento serializado (ver encode_event)
+            exclude_connection_id: ID de conexión a excluir (opcional)
         """
         if room_id not in self.active_connections:
+            if self.cluster_enabled:
+                # Normal en cluster: el evento llegó antes/después de que la sala se vaciara aquí
+                return
             logger.warning(f"⚠️ Intento de broadcast a sala inexistente: {room_id}")
             return
 
         # Obtener lista de conexiones
         connections = self.active_connections[room_id].copy()
 
-        # Enviar a cada conexión
+        # Encolar para cada conexión (no bloquea: cada tarea escritora envía por su cuenta)
         disconnected = []
         for conn_id, conn_info in connections.items():
             # Excluir conexión si se especificó
             if exclude_connection_id and conn_id == exclude_connection_id:
                 continue
 
-            try:
-                await conn_info["websocket"].send_json(message)
-            except WebSocketDisconnect:
-                logger.warning(f"⚠️ WebSocket desconectado durante broadcast: {conn_id}")
-                disconnected.append(conn_id)
-            except Exception as e:
-                logger.error(f"❌ Error enviando mensaje a {conn_id}: {e}")
+            if not conn_info["outbound"].enqueue(frame):
                 disconnected.append(conn_id)
 
-        # Limpiar conexiones desconectadas
+        # Limpiar conexiones caídas o demasiado lentas
         for conn_id in disconnected:
-            await self.disconnect(room_id, conn_id)
+            await self._drop_connection(room_id, conn_id)
 
         logger.info(
             f"📢 Broadcast a sala {room_id}: {len(connections) - len(disconnected)} destinatarios"
         )
 
+    def _schedule_disconnect(self, room_id: int, connection_id: str):
+        """Programar la desconexión de un cliente cuya tarea escritora falló"""
+        task = asyncio.create_task(self._drop_connection(room_id, connection_id))
+        self._pending_disconnects.add(task)
+        task.add_done_callback(self._pending_disconnects.discard)
+
+    async def _drop_connection(self, room_id: int, connection_id: str):
+        """
+        Sacar de la sala una conexión caída o lenta y cerrar su socket
+
+        Cerrar el socket hace que el loop de recepción del endpoint termine.
+        """
+        connection_info = self.active_connections.get(room_id, {}).get(connection_id)
+        if connection_info is None:
+            return
+
+        websocket = connection_info["websocket"]
+        await self.disconnect(room_id, connection_id)
+
+        try:
+            await websocket.close(code=1013, reason="Client too slow")
+        except Exception:
+            pass  # El cliente ya se había ido
+
     def get_room_users(self, room_id: int) -> List[dict]:
         """
         Obtener lista de usuarios en una sala
@@ -261,7 +397,7 @@ class ConnectionManager:
             total += len(room_connections)
         return total
 
-    def get_stats(self) -> dict:
+    async def get_stats(self) -> dict:
         """
         Obtener estadísticas de conexiones
 
@@ -269,9 +405,23 @@ class ConnectionManager:
             Diccionario con estadísticas
         """
         return {
+            "broadcast_mode": self.broadcast_mode,
+            "node_id": self.cluster.node_id,
+            "cluster_publish_failures": self.cluster.publish_failures,
             "total_connections": self.get_total_connections(),
             "total_rooms": len(self.active_connections),
-            "users_online": user_online_service.get_online_count(),
+            "overflow_policy": self.overflow_policy,
+            "pending_outbound": sum(
+                conn["outbound"].pending
+                for connections in self.active_connections.values()
+                for conn in connections.values()
+            ),
+            "dropped_messages": self._dropped_messages + sum(
+                conn["outbound"].dropped
+                for connections in self.active_connections.values()
+                for conn in connections.values()
+            ),
+            "users_online": await user_online_service.get_online_count(),
             "rooms": {
                 room_id: {
                     "connections": len(connections),
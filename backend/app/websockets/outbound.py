@@ -0,0 +1,124 @@
+"""
+Cola de salida por conexión WebSocket
+
+Cada conexión tiene una cola acotada y una tarea escritora propia, de modo que
+un broadcast solo encola (O(1) por destinatario) y un cliente lento no frena al
+resto de la sala ni al loop del emisor.
+"""
+
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Políticas cuando la cola de un consumidor lento se llena
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # Descartar el mensaje más antiguo pendiente
+OVERFLOW_DISCONNECT = "disconnect"    # Desconectar al cliente lento
+
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DISCONNECT)
+
+
+class OutboundQueue:
+    """Cola acotada + tarea escritora de una conexión WebSocket"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        connection_id: str,
+        maxsize: int,
+        overflow_policy: str = OVERFLOW_DROP_OLDEST,
+        on_failure: Optional[Callable[[str], None]] = None
+    ):
+        """
+        Args:
+            websocket: WebSocket del cliente
+            connection_id: ID de la conexión (para logs y callback)
+            maxsize: Número máximo de mensajes pendientes
+            overflow_policy: drop_oldest o disconnect
+            on_failure: Callback invocado si el envío falla o la cola desborda con política disconnect
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de desborde inválida: {overflow_policy}")
+
+        self.websocket = websocket
+        self.connection_id = connection_id
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._on_failure = on_failure
+        self._writer: Optional[asyncio.Task] = None
+        self._failed = False
+
+    @property
+    def pending(self) -> int:
+        """Mensajes encolados aún no enviados"""
+        return self._queue.qsize()
+
+    def start(self):
+        """Lanzar la tarea escritora"""
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+
+    def enqueue(self, frame: str) -> bool:
+        """
+        Encolar un frame ya serializado sin bloquear
+
+        Returns:
+            False si la conexión debe descartarse (falló o desbordó con política disconnect)
+        """
+        if self._failed:
+            return False
+
+        try:
+            self._queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        if self.overflow_policy == OVERFLOW_DISCONNECT:
+            logger.warning(f"⚠️ Cola llena para {self.connection_id}, desconectando cliente lento")
+            self._fail()
+            return False
+
+        # drop_oldest: sacrificar el mensaje más antiguo para hacer lugar
+        try:
+            self._queue.get_nowait()
+            self.dropped += 1
+        except asyncio.QueueEmpty:
+            pass
+        self._queue.put_nowait(frame)
+        return True
+
+    async def close(self):
+        """Detener la tarea escritora descartando lo pendiente"""
+        if self._writer and not self._writer.done() and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+        self._writer = None
+
+    async def _write_loop(self):
+        """Enviar los mensajes de la cola en orden"""
+        while True:
+            frame = await self._queue.get()
+            try:
+                await self.websocket.send_text(frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Error enviando a {self.connection_id}: {e}")
+                self._fail()
+                return
+
+    def _fail(self):
+        """Marcar la conexión como caída y notificar al manager (una sola vez)"""
+        if self._failed:
+            return
+        self._failed = True
+        if self._on_failure:
+            self._on_failure(self.connection_id)
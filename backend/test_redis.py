@@ -4,13 +4,14 @@ Script para probar la conexión a Redis
 Ejecutar: python test_redis.py
 """
 
+import asyncio
 import sys
 import os
 
 # Agregar el directorio raíz al path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app.redis_client import redis_client
+from app.redis_client import redis_client, async_redis_client
 from app.services.message_cache import message_cache
 
 def test_redis_connection():
@@ -68,7 +69,7 @@ def test_basic_operations():
 
     return True
 
-def test_message_cache():
+async def test_message_cache():
     """Probar caché de mensajes"""
     print("\n💬 Probando caché de mensajes...")
 
@@ -86,20 +87,34 @@ def test_message_cache():
             "is_deleted": False
         }
 
-        success = message_cache.cache_message(room_id, message_data)
+        # Sin caché poblado desde la DB el mensaje no se cachea (evita cachés parciales)
+        await message_cache.invalidate_room_cache(room_id)
+        assert not await message_cache.cache_message(room_id, message_data), "Se cacheó sin caché poblado"
+
+        # Poblar caché como lo haría una lectura de la DB
+        version = await message_cache.get_cache_version(room_id)
+        success = await message_cache.update_cache_with_db_messages(room_id, [message_data], version=version)
+        assert success, "Error poblando caché"
+
+        # Una reconstrucción con una versión vieja se descarta
+        stale = await message_cache.update_cache_with_db_messages(room_id, [], version="-1")
+        assert not stale, "Se aceptó una reconstrucción con versión vieja"
+
+        # Cachear un mensaje nuevo
+        success = await message_cache.cache_message(room_id, {**message_data, "id": 2, "content": "Mensaje nuevo"})
         assert success, "Error cacheando mensaje"
         print("✅ Mensaje cacheado correctamente")
 
         # Obtener mensajes del caché
-        cached = message_cache.get_cached_messages(room_id)
+        cached = await message_cache.get_cached_messages(room_id)
         assert cached is not None, "No se pudo obtener caché"
-        assert len(cached) == 1, "Número incorrecto de mensajes"
-        assert cached[0]["content"] == "Mensaje de prueba", "Contenido incorrecto"
+        assert len(cached) == 2, "Número incorrecto de mensajes"
+        assert cached[0]["content"] == "Mensaje nuevo", "Contenido incorrecto"
         print("✅ Mensajes obtenidos del caché correctamente")
 
         # Invalidar caché
-        message_cache.invalidate_room_cache(room_id)
-        cached = message_cache.get_cached_messages(room_id)
+        await message_cache.invalidate_room_cache(room_id)
+        cached = await message_cache.get_cached_messages(room_id)
         assert cached is None, "Caché no se invalidó"
         print("✅ Invalidación de caché funciona")
 
@@ -109,12 +124,12 @@ def test_message_cache():
 
     return True
 
-def test_cache_stats():
+async def test_cache_stats():
     """Probar estadísticas del caché"""
     print("\n📊 Probando estadísticas...")
 
     try:
-        stats = message_cache.get_cache_stats()
+        stats = await message_cache.get_cache_stats()
         assert "redis_connected" in stats, "Stats inválidas"
         assert stats["redis_connected"], "Redis no conectado según stats"
         print(f"✅ Stats obtenidas: {stats}")
@@ -124,6 +139,29 @@ def test_cache_stats():
 
     return True
 
+async def test_async_client():
+    """Probar cliente asyncio (pool compartido)"""
+    print("\n⚡ Probando cliente asyncio...")
+
+    try:
+        assert await async_redis_client.ping(), "Redis asyncio no respondió al ping"
+        await async_redis_client.set("test:async", {"ok": True})
+        assert await async_redis_client.get("test:async", as_json=True) == {"ok": True}, "Error en set/get asyncio"
+        await async_redis_client.delete("test:async")
+        print(f"✅ Cliente asyncio funciona (max_connections={async_redis_client.max_connections})")
+    except Exception as e:
+        print(f"❌ Error en cliente asyncio: {e}")
+        return False
+
+    return True
+
+async def run_async_tests(test_funcs):
+    """Ejecutar pruebas async en un mismo event loop y cerrar el pool al final"""
+    try:
+        return [await test_func() for test_func in test_funcs]
+    finally:
+        await async_redis_client.close()
+
 def main():
     """Ejecutar todas las pruebas"""
     print("=" * 60)
@@ -132,7 +170,11 @@ def main():
 
     tests = [
         ("Conexión a Redis", test_redis_connection),
-        ("Operaciones básicas", test_basic_operations),
+        ("Operaciones básicas", test_basic_operations)
+    ]
+
+    async_tests = [
+        ("Cliente asyncio", test_async_client),
         ("Caché de mensajes", test_message_cache),
         ("Estadísticas", test_cache_stats)
     ]
@@ -142,6 +184,9 @@ def main():
         result = test_func()
         results.append((name, result))
 
+    async_results = asyncio.run(run_async_tests([func for _, func in async_tests]))
+    results.extend((name, result) for (name, _), result in zip(async_tests, async_results))
+
     # Resumen
     print("\n" + "=" * 60)
     print("📋 RESUMEN DE PRUEBAS")
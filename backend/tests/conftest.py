@@ -2,13 +2,19 @@
 # IMPORTANTE: Esto debe estar ANTES de cualquier import de app
 import os
 os.environ["TESTING"] = "1"
+# Sin LRU local de participantes ni de principals: cada test recrea la DB y los IDs se repiten
+# (Redis se limpia con flushdb, la memoria del proceso no)
+os.environ["MEMBERSHIP_LOCAL_TTL"] = "0"
+os.environ["PRINCIPAL_LOCAL_TTL"] = "0"
 
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from app.main import app
-from app.database import get_db
+from app.database import get_db, get_async_db
 from app.models import Base
 
 # Crear base de datos persistente para tests (SQLite)
@@ -23,6 +29,14 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine async sobre el mismo archivo SQLite (routers migrados a get_async_db)
+# NullPool: TestClient usa un event loop por test y las conexiones no se pueden compartir entre loops
+async_engine = create_async_engine(
+    f"sqlite+aiosqlite:///{tempfile.gettempdir()}/test_chat.db",
+    poolclass=NullPool
+)
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 @pytest.fixture(scope="function")
 def db_session():
     """Crea una sesión de base de datos para cada test"""
@@ -56,6 +70,16 @@ def client(db_session):
         finally:
             pass
 
+    # Sobrescribir la dependency get_async_db para usar la DB de prueba
+    async def override_get_async_db():
+        async with TestingAsyncSessionLocal() as session:
+            try:
+                yield session
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+
     # Override de get_current_user para tests
     async def override_get_current_user(credentials, db = None):
         from fastapi import HTTPException, status as http_status
@@ -90,6 +114,7 @@ def client(db_session):
 
     from app.auth.dependencies import get_current_user
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
     app.dependency_overrides[get_current_user] = override_get_current_user
 
     with TestClient(app) as test_client:
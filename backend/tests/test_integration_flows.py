@@ -495,3 +495,898 @@ def test_user_rooms_management(client, db_session):
     # 7. Alice obtiene sus salas → debe tener 2
     alice_rooms_response = client.get("/chat-rooms/my-rooms", headers=alice_headers)
     assert len(alice_rooms_response.json()) == 2
+
+
+# ============================================================================
+# FLUJO 8: Últimos Mensajes desde Caché (read-through)
+# ============================================================================
+
+def test_latest_messages_served_from_cache(client, db_session):
+    """
+    Flujo de lectura de últimos mensajes con caché Redis:
+    1. Primera lectura (miss) consulta DB y puebla el caché
+    2. Mensajes nuevos se agregan al caché y se sirven desde él
+    3. Editar, agregar adjuntos o eliminar invalida el caché
+    4. Una sala sin mensajes también se cachea y no vuelve a consultar la DB
+    """
+    from app.redis_client import redis_client
+    from app.models.message import Message
+
+    # 1. Crear usuario, sala y mensajes
+    alice = create_test_user(client, "alice", "alice@example.com", "securepass123")
+    alice_login = login_user(client, "alice", "securepass123")
+    alice_headers = get_auth_headers(alice_login["access_token"])
+
+    room_response = client.post("/chat-rooms/", json={
+        "name": "Sala con Caché",
+        "is_group": True
+    }, headers=alice_headers)
+    room_id = room_response.json()["id"]
+    cache_key = f"messages:room:{room_id}"
+
+    # Sala vacía: la primera lectura deja el caché con solo el marcador
+    assert client.get(f"/messages/room/{room_id}/latest", headers=alice_headers).json() == []
+    assert redis_client.client.lrange(cache_key, 0, -1) == ["*"]
+
+    # La siguiente se sirve desde Redis: un mensaje escrito directo en la DB no se ve
+    hidden = Message(room_id=room_id, user_id=alice["id"], content="Oculto")
+    db_session.add(hidden)
+    db_session.commit()
+    assert client.get(f"/messages/room/{room_id}/latest", headers=alice_headers).json() == []
+    db_session.delete(hidden)
+    db_session.commit()
+
+    message_ids = []
+    for i in range(3):
+        response = client.post("/messages/", json={
+            "room_id": room_id,
+            "content": f"Mensaje {i}"
+        }, headers=alice_headers)
+        message_ids.append(response.json()["id"])
+
+    # 2. Primera lectura: miss → DB, el caché queda con todos los mensajes de la sala
+    latest = client.get(f"/messages/room/{room_id}/latest?limit=2", headers=alice_headers)
+    assert latest.status_code == status.HTTP_200_OK
+    assert [m["content"] for m in latest.json()] == ["Mensaje 1", "Mensaje 2"]
+    assert redis_client.llen(cache_key) == 3
+
+    # 3. Mensaje nuevo: se agrega al caché y se sirve en orden cronológico
+    client.post("/messages/", json={"room_id": room_id, "content": "Mensaje 3"}, headers=alice_headers)
+    assert redis_client.llen(cache_key) == 4
+    latest = client.get(f"/messages/room/{room_id}/latest?limit=10", headers=alice_headers)
+    assert [m["content"] for m in latest.json()] == ["Mensaje 0", "Mensaje 1", "Mensaje 2", "Mensaje 3"]
+
+    # 4. Editar invalida el caché y la siguiente lectura ve el contenido nuevo
+    client.put(f"/messages/{message_ids[2]}", json={"content": "Editado"}, headers=alice_headers)
+    assert not redis_client.exists(cache_key)
+    latest = client.get(f"/messages/room/{room_id}/latest?limit=2", headers=alice_headers)
+    assert [m["content"] for m in latest.json()] == ["Editado", "Mensaje 3"]
+
+    # 5. Los adjuntos se incluyen en el caché
+    client.post("/attachments/", json={
+        "message_id": message_ids[2],
+        "file_url": "https://example.com/foto.png",
+        "file_type": "image/png"
+    }, headers=alice_headers)
+    client.get(f"/messages/room/{room_id}/latest", headers=alice_headers)
+    latest = client.get(f"/messages/room/{room_id}/latest", headers=alice_headers)
+    assert redis_client.exists(cache_key)
+    assert latest.json()[2]["attachments"][0]["file_url"] == "https://example.com/foto.png"
+
+    # 6. Eliminar un mensaje lo saca de los últimos mensajes
+    client.delete(f"/messages/{message_ids[0]}", headers=alice_headers)
+    latest = client.get(f"/messages/room/{room_id}/latest", headers=alice_headers)
+    assert "Mensaje 0" not in [m["content"] for m in latest.json()]
+
+
+# ============================================================================
+# FLUJO 9: Historial Paginado con Cursor (scroll infinito)
+# ============================================================================
+
+def test_message_history_keyset_pagination(client, db_session):
+    """
+    Flujo de scroll infinito sobre el historial de una sala:
+    1. Primera página (la más reciente) con next_cursor
+    2. Páginas anteriores con before_id hasta agotar el historial
+    3. Ponerse al día con after_id
+    4. Listado general con límite y cursor
+    """
+    create_test_user(client, "alice", "alice@example.com", "securepass123")
+    alice_login = login_user(client, "alice", "securepass123")
+    alice_headers = get_auth_headers(alice_login["access_token"])
+
+    room_response = client.post("/chat-rooms/", json={
+        "name": "Sala con Historial",
+        "is_group": True
+    }, headers=alice_headers)
+    room_id = room_response.json()["id"]
+
+    message_ids = []
+    for i in range(5):
+        response = client.post("/messages/", json={
+            "room_id": room_id,
+            "content": f"Mensaje {i}"
+        }, headers=alice_headers)
+        message_ids.append(response.json()["id"])
+
+    # 1. Página más reciente (orden cronológico dentro de la página)
+    page = client.get(f"/messages/room/{room_id}/history?limit=2", headers=alice_headers).json()
+    assert [m["content"] for m in page["messages"]] == ["Mensaje 3", "Mensaje 4"]
+    assert page["has_more"] is True
+    assert page["next_cursor"] == message_ids[3]
+
+    # 2. Páginas anteriores con before_id
+    page = client.get(
+        f"/messages/room/{room_id}/history?limit=2&before_id={page['next_cursor']}",
+        headers=alice_headers
+    ).json()
+    assert [m["content"] for m in page["messages"]] == ["Mensaje 1", "Mensaje 2"]
+    assert page["has_more"] is True
+
+    page = client.get(
+        f"/messages/room/{room_id}/history?limit=2&before_id={page['next_cursor']}",
+        headers=alice_headers
+    ).json()
+    assert [m["content"] for m in page["messages"]] == ["Mensaje 0"]
+    assert page["has_more"] is False
+    assert page["next_cursor"] is None
+
+    # 3. Ponerse al día desde un mensaje conocido
+    page = client.get(
+        f"/messages/room/{room_id}/history?limit=3&after_id={message_ids[1]}",
+        headers=alice_headers
+    ).json()
+    assert [m["content"] for m in page["messages"]] == ["Mensaje 2", "Mensaje 3", "Mensaje 4"]
+    assert page["has_more"] is False
+
+    # Cursor inexistente o ambos cursores → 400
+    response = client.get(f"/messages/room/{room_id}/history?before_id=999999", headers=alice_headers)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    response = client.get(
+        f"/messages/room/{room_id}/history?before_id={message_ids[1]}&after_id={message_ids[0]}",
+        headers=alice_headers
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # Un mensaje de otra sala no sirve como cursor (no revela su posición)
+    other_room_id = client.post("/chat-rooms/", json={"name": "Otra", "is_group": True}, headers=alice_headers).json()["id"]
+    foreign_id = client.post("/messages/", json={"room_id": other_room_id, "content": "Ajeno"}, headers=alice_headers).json()["id"]
+    for url in (
+        f"/messages/room/{room_id}/history?before_id={foreign_id}",
+        f"/messages/?room_id={room_id}&after_id={foreign_id}"
+    ):
+        response = client.get(url, headers=alice_headers)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.json()["detail"] == "Cursor message not found"
+
+    # 4. Listado general: más recientes primero, con límite y cursor
+    messages = client.get(f"/messages/?room_id={room_id}&limit=2", headers=alice_headers).json()
+    assert [m["content"] for m in messages] == ["Mensaje 4", "Mensaje 3"]
+    messages = client.get(
+        f"/messages/?room_id={room_id}&limit=2&before_id={message_ids[3]}",
+        headers=alice_headers
+    ).json()
+    assert [m["content"] for m in messages] == ["Mensaje 2", "Mensaje 1"]
+    messages = client.get(
+        f"/messages/?room_id={room_id}&limit=2&after_id={message_ids[2]}",
+        headers=alice_headers
+    ).json()
+    assert [m["content"] for m in messages] == ["Mensaje 4", "Mensaje 3"]
+
+
+# ============================================================================
+# FLUJO 10: Caché de Participantes (autorización por sala)
+# ============================================================================
+
+def test_room_membership_cache_invalidation(client, db_session):
+    """
+    Las comprobaciones de acceso se cachean (Redis + LRU local) y los cambios
+    de participantes se ven inmediatamente:
+    1. Un no participante recibe 403 (resultado negativo cacheado)
+    2. Al agregarlo obtiene acceso sin esperar al TTL
+    3. Al removerlo vuelve a recibir 403
+    4. Al eliminar la sala nadie conserva acceso
+    """
+    from app.services.room_membership import room_membership
+
+    create_test_user(client, "alice", "alice@example.com", "securepass123")
+    bob = create_test_user(client, "bob", "bob@example.com", "securepass123")
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+    bob_headers = get_auth_headers(login_user(client, "bob", "securepass123")["access_token"])
+
+    room_response = client.post("/chat-rooms/", json={
+        "name": "Sala Privada",
+        "is_group": True
+    }, headers=alice_headers)
+    room_id = room_response.json()["id"]
+
+    # 1. Bob no es participante (dos veces: la segunda sale del caché)
+    for _ in range(2):
+        response = client.get(f"/messages/room/{room_id}/latest", headers=bob_headers)
+        assert response.status_code == 403
+    assert room_membership.get_stats()["hits"]["redis"] >= 1
+
+    # 2. Alice agrega a Bob: acceso inmediato
+    client.post(f"/chat-rooms/{room_id}/participants?user_id={bob['id']}", headers=alice_headers)
+    response = client.get(f"/messages/room/{room_id}/latest", headers=bob_headers)
+    assert response.status_code == 200
+
+    # 3. Alice remueve a Bob: 403 inmediato
+    client.delete(f"/chat-rooms/{room_id}/participants/{bob['id']}", headers=alice_headers)
+    response = client.get(f"/messages/room/{room_id}/history", headers=bob_headers)
+    assert response.status_code == 403
+
+    # 4. Alice elimina la sala
+    client.delete(f"/chat-rooms/{room_id}", headers=alice_headers)
+    response = client.get(f"/messages/room/{room_id}/latest", headers=alice_headers)
+    assert response.status_code == 403
+
+
+# ============================================================================
+# FLUJO 11: Caché del Usuario Autenticado (principal)
+# ============================================================================
+
+def test_authenticated_user_cache_invalidation(client, db_session):
+    """
+    get_current_principal cachea id/username/is_active por usuario:
+    1. Peticiones repetidas se sirven desde el caché (sin consultar users)
+    2. Al desactivar al usuario el cambio se aplica en la siguiente petición
+    3. Al eliminarlo, su token deja de ser válido
+    """
+    from app.services.user_principal import user_principal_cache
+
+    alice = create_test_user(client, "alice", "alice@example.com", "securepass123")
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+
+    # 1. Dos peticiones autenticadas: la segunda no va a la DB
+    db_hits = user_principal_cache.get_stats()["hits"]["db"]
+    for _ in range(2):
+        response = client.get("/chat-rooms/my-rooms", headers=alice_headers)
+        assert response.status_code == 200
+    assert user_principal_cache.get_stats()["hits"]["db"] == db_hits + 1
+
+    # 2. Desactivar: 403 inmediato aunque el principal estuviera cacheado
+    client.put(f"/users/{alice['id']}", json={"is_active": False})
+    response = client.get("/chat-rooms/my-rooms", headers=alice_headers)
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Inactive user"
+
+    # 3. Eliminar: el token ya no identifica a ningún usuario
+    client.delete(f"/users/{alice['id']}")
+    response = client.get("/chat-rooms/my-rooms", headers=alice_headers)
+    assert response.status_code == 401
+
+
+# ============================================================================
+# FLUJO 12: Bandeja de Entrada (inbox)
+# ============================================================================
+
+def test_room_inbox(client, db_session):
+    """
+    La bandeja de entrada devuelve en una sola petición cada sala del usuario con:
+    1. Vista previa del último mensaje (sin contar los eliminados)
+    2. Número de mensajes de otros usuarios no leídos
+    3. Orden por última actividad y paginación
+    """
+    create_test_user(client, "alice", "alice@example.com", "securepass123")
+    bob = create_test_user(client, "bob", "bob@example.com", "securepass123")
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+    bob_headers = get_auth_headers(login_user(client, "bob", "securepass123")["access_token"])
+
+    quiet_room = client.post("/chat-rooms/", json={"name": "Sala Tranquila", "is_group": True}, headers=alice_headers).json()
+    busy_room = client.post("/chat-rooms/", json={"name": "Sala Activa", "is_group": True}, headers=alice_headers).json()
+    client.post(f"/chat-rooms/{busy_room['id']}/participants?user_id={bob['id']}", headers=alice_headers)
+
+    client.post("/messages/", json={"room_id": quiet_room["id"], "content": "Nota personal"}, headers=alice_headers)
+    client.post("/messages/", json={"room_id": busy_room["id"], "content": "Hola Bob"}, headers=alice_headers)
+    client.post("/messages/", json={"room_id": busy_room["id"], "content": "Hola Alice"}, headers=bob_headers)
+    deleted = client.post("/messages/", json={"room_id": busy_room["id"], "content": "Me arrepentí"}, headers=bob_headers).json()
+    client.delete(f"/messages/{deleted['id']}?soft_delete=true", headers=bob_headers)
+
+    response = client.get("/chat-rooms/inbox", headers=alice_headers)
+    assert response.status_code == 200
+    inbox = response.json()
+    rooms = {room["id"]: room for room in inbox}
+
+    # 1. Último mensaje visible y su autor
+    assert rooms[busy_room["id"]]["last_message"]["content"] == "Hola Alice"
+    assert rooms[busy_room["id"]]["last_message"]["username"] == "bob"
+
+    # 2. Solo cuentan los mensajes de otros usuarios (y no eliminados)
+    assert rooms[busy_room["id"]]["unread_count"] == 1
+    assert rooms[quiet_room["id"]]["unread_count"] == 0
+
+    # 3. Más reciente primero y paginación
+    assert inbox[0]["id"] == busy_room["id"]
+    page = client.get("/chat-rooms/inbox?limit=1&offset=1", headers=alice_headers).json()
+    assert [room["id"] for room in page] == [inbox[1]["id"]]
+
+
+# ============================================================================
+# FLUJO 13: Cursores de Lectura y Contadores de No Leídos
+# ============================================================================
+
+def test_unread_counters_and_read_cursor(client, db_session):
+    """
+    Los no leídos salen de contadores en Redis:
+    1. Cada mensaje suma uno al resto de participantes (no al autor)
+    2. Marcar hasta un mensaje intermedio deja pendientes los posteriores
+    3. Marcar sin message_id lee hasta el final y el cursor nunca retrocede
+    4. Un mensaje de otra sala no se puede usar como cursor
+    """
+    from app.redis_client import redis_client
+
+    alice = create_test_user(client, "alice", "alice@example.com", "securepass123")
+    bob = create_test_user(client, "bob", "bob@example.com", "securepass123")
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+    bob_headers = get_auth_headers(login_user(client, "bob", "securepass123")["access_token"])
+
+    room = client.post("/chat-rooms/", json={"name": "Sala", "is_group": True}, headers=alice_headers).json()
+    other_room = client.post("/chat-rooms/", json={"name": "Otra", "is_group": True}, headers=bob_headers).json()
+    client.post(f"/chat-rooms/{room['id']}/participants?user_id={bob['id']}", headers=alice_headers)
+
+    def unread(headers):
+        inbox = client.get("/chat-rooms/inbox", headers=headers).json()
+        return {r["id"]: r["unread_count"] for r in inbox}[room["id"]]
+
+    # 1. Dos mensajes de Bob: Alice tiene 2 pendientes, Bob ninguno
+    first = client.post("/messages/", json={"room_id": room["id"], "content": "Uno"}, headers=bob_headers).json()
+    client.post("/messages/", json={"room_id": room["id"], "content": "Dos"}, headers=bob_headers)
+    assert unread(alice_headers) == 2
+    assert unread(bob_headers) == 0
+
+    # Con el hash ya cargado, el siguiente mensaje solo incrementa el contador en Redis
+    last = client.post("/messages/", json={"room_id": room["id"], "content": "Tres"}, headers=bob_headers).json()
+    assert redis_client.client.hget(f"user:{alice['id']}:unread", str(room["id"])) == "3"
+    assert unread(alice_headers) == 3
+
+    # 2. Leído hasta el primero: quedan los dos siguientes
+    response = client.post(f"/messages/room/{room['id']}/read?message_id={first['id']}", headers=alice_headers)
+    assert response.status_code == 200
+    assert response.json() == {"room_id": room["id"], "last_read_message_id": first["id"], "unread_count": 2}
+    assert unread(alice_headers) == 2
+
+    # 3. Leído hasta el final; confirmar después un mensaje anterior no retrocede el cursor
+    response = client.post(f"/messages/room/{room['id']}/read", headers=alice_headers)
+    assert response.json()["last_read_message_id"] == last["id"]
+    assert response.json()["unread_count"] == 0
+    # (y, como no mueve el cursor, tampoco pisa el contador en Redis)
+    unread_key = f"user:{alice['id']}:unread"
+    redis_client.client.hset(unread_key, str(room["id"]), 5)
+    response = client.post(f"/messages/room/{room['id']}/read?message_id={first['id']}", headers=alice_headers)
+    assert response.json() == {"room_id": room["id"], "last_read_message_id": last["id"], "unread_count": 0}
+    assert redis_client.client.hget(unread_key, str(room["id"])) == "5"
+    redis_client.client.hset(unread_key, str(room["id"]), 0)
+    assert unread(alice_headers) == 0
+
+    # Sin caché, la reconstrucción desde la DB respeta el cursor
+    redis_client.delete(unread_key)
+    assert unread(alice_headers) == 0
+
+    # 4. Cursor con un mensaje de otra sala
+    foreign = client.post("/messages/", json={"room_id": other_room["id"], "content": "Ajeno"}, headers=bob_headers).json()
+    response = client.post(f"/messages/room/{room['id']}/read?message_id={foreign['id']}", headers=alice_headers)
+    assert response.status_code == 404
+
+
+# ============================================================================
+# FLUJO 14: Listas de Contactos (una consulta + caché)
+# ============================================================================
+
+def test_contact_lists_cached_and_invalidated(client, db_session):
+    """
+    Las listas de contactos incluyen los datos del otro usuario y se cachean:
+    1. Solicitud a un usuario privado: aparece en /sent y en /pending
+    2. Las listas se sirven desde Redis y se paginan
+    3. Aceptar o eliminar un contacto refresca las listas de ambos usuarios
+    4. Sin limit se devuelve la lista completa
+    """
+    from app.redis_client import redis_client
+
+    alice = create_test_user(client, "alice", "alice@example.com", "securepass123")
+    bob = create_test_user(client, "bob", "bob@example.com", "securepass123")
+    carol = create_test_user(client, "carol", "carol@example.com", "securepass123")
+    client.put(f"/users/{bob['id']}", json={"is_public": False})
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+    bob_headers = get_auth_headers(login_user(client, "bob", "securepass123")["access_token"])
+
+    # 1. Bob es privado (pendiente); Carol es pública (aceptada al instante)
+    request = client.post("/contacts/", json={"contact_id": bob["id"]}, headers=alice_headers).json()
+    client.post("/contacts/", json={"contact_id": carol["id"]}, headers=alice_headers)
+
+    sent = client.get("/contacts/sent", headers=alice_headers).json()
+    assert [c["contact"]["username"] for c in sent] == ["bob"]
+    pending = client.get("/contacts/pending", headers=bob_headers).json()
+    assert [c["contact"]["username"] for c in pending] == ["alice"]
+    assert pending[0]["id"] == request["id"]
+
+    # 2. Las páginas leídas quedan en el hash del usuario
+    my_contacts = client.get("/contacts/my-contacts", headers=alice_headers).json()
+    assert [c["contact"]["username"] for c in my_contacts] == ["carol"]
+    assert redis_client.client.hexists(f"contacts:{alice['id']}", "accepted:all:0")
+    assert client.get("/contacts/my-contacts", headers=alice_headers).json() == my_contacts
+
+    # 3. Bob acepta: desaparece de las pendientes y ambos son contactos
+    response = client.put(f"/contacts/{request['id']}", json={"status": "accepted"}, headers=bob_headers)
+    assert response.status_code == 200
+    assert client.get("/contacts/sent", headers=alice_headers).json() == []
+    assert client.get("/contacts/pending", headers=bob_headers).json() == []
+    my_contacts = client.get("/contacts/my-contacts", headers=alice_headers).json()
+    # La solicitud a Bob se creó antes: más recientes primero
+    assert [c["contact"]["username"] for c in my_contacts] == ["carol", "bob"]
+    bob_contacts = client.get("/contacts/my-contacts", headers=bob_headers).json()
+    assert [c["contact"]["username"] for c in bob_contacts] == ["alice"]
+
+    page = client.get("/contacts/my-contacts?limit=1&offset=1", headers=alice_headers).json()
+    assert [c["contact"]["username"] for c in page] == ["bob"]
+
+    # Eliminar el contacto también lo quita de la lista de Bob
+    client.delete(f"/contacts/{request['id']}", headers=alice_headers)
+    assert client.get("/contacts/my-contacts", headers=bob_headers).json() == []
+    my_contacts = client.get("/contacts/my-contacts", headers=alice_headers).json()
+    assert [c["contact"]["username"] for c in my_contacts] == ["carol"]
+
+    # 4. Sin limit la lista llega completa aunque tenga cientos de contactos
+    from app.models.contact import Contact
+    from app.models.user import User
+    friends = [User(username=f"amigo{i}", email=f"amigo{i}@example.com", password_hash="x") for i in range(150)]
+    db_session.add_all(friends)
+    db_session.flush()
+    db_session.add_all([Contact(user_id=alice["id"], contact_id=friend.id, status="accepted") for friend in friends])
+    db_session.commit()
+    redis_client.delete(f"contacts:{alice['id']}")
+    assert len(client.get("/contacts/my-contacts", headers=alice_headers).json()) == 151
+    assert len(client.get("/contacts/my-contacts?limit=100", headers=alice_headers).json()) == 100
+
+
+# ============================================================================
+# FLUJO 15: Búsqueda de Usuarios para Contactos
+# ============================================================================
+
+def test_search_users_ranked_and_paginated(client, db_session):
+    """
+    La búsqueda de usuarios:
+    1. Ordena por coincidencia exacta, prefijo de username, prefijo de email y subcadena
+    2. Excluye relaciones de contacto existentes en ambos sentidos
+    3. Pagina con cursor (username del último resultado)
+    4. Con menos de 3 caracteres solo busca prefijos y trata % y _ como texto
+    """
+    alice = create_test_user(client, "alice", "alice@example.com", "securepass123")
+    create_test_user(client, "mariana", "mariana@example.com", "securepass123")
+    create_test_user(client, "anabel", "anabel@example.com", "securepass123")
+    create_test_user(client, "bob", "anabob@example.com", "securepass123")
+    create_test_user(client, "ana", "ana@example.com", "securepass123")
+    create_test_user(client, "anakin", "anakin@example.com", "securepass123")
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+    anakin_headers = get_auth_headers(login_user(client, "anakin", "securepass123")["access_token"])
+
+    # Anakin ya envió una solicitud a Alice: no debe aparecer en su búsqueda
+    client.post("/contacts/", json={"contact_id": alice["id"]}, headers=anakin_headers)
+
+    def search(params):
+        response = client.get(f"/contacts/search-public-users?{params}", headers=alice_headers)
+        assert response.status_code == 200
+        return [user["username"] for user in response.json()]
+
+    # 1 y 2. Ranking y exclusión
+    assert search("query=ana") == ["ana", "anabel", "bob", "mariana"]
+
+    # 3. Paginación keyset
+    assert search("query=ana&limit=2") == ["ana", "anabel"]
+    assert search("query=ana&limit=2&after=anabel") == ["bob", "mariana"]
+    response = client.get("/contacts/search-public-users?query=ana&after=nadie", headers=alice_headers)
+    assert response.status_code == 400
+
+    # 4. Consultas cortas y comodines
+    assert search("query=an") == ["ana", "anabel", "bob"]
+    assert search("query=%25") == []
+
+
+# ============================================================================
+# FLUJO 16: Eliminación de Salas por Lotes
+# ============================================================================
+
+def test_delete_room_in_batches_cleans_files_and_cache(client, db_session, monkeypatch):
+    """
+    Eliminar una sala:
+    1. Sala pequeña: se borra en la misma petición (204) con mensajes, adjuntos y caché
+    2. Los archivos subidos se eliminan salvo que otro adjunto los siga usando
+    3. Sala grande: responde 202 y se purga por lotes en segundo plano
+    """
+    from app.redis_client import redis_client
+    from app.models.chat_room import ChatRoom
+    from app.models.message import Message
+    from app.models.attachment import Attachment
+    from app.services.room_cleanup import room_cleanup
+    from app.services.uploads import get_upload_path
+
+    create_test_user(client, "alice", "alice@example.com", "securepass123")
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+
+    room = client.post("/chat-rooms/", json={"name": "Temporal", "is_group": True}, headers=alice_headers).json()
+    other_room = client.post("/chat-rooms/", json={"name": "Otra", "is_group": True}, headers=alice_headers).json()
+
+    def upload(name):
+        response = client.post(
+            "/attachments/upload",
+            files={"file": (name, b"\x89PNG" + name.encode(), "image/png")},
+            headers=alice_headers
+        )
+        return response.json()["file_url"]
+
+    own_file = upload("propia.png")
+    shared_file = upload("compartida.png")
+    for room_id, urls in ((room["id"], [own_file, shared_file]), (other_room["id"], [shared_file])):
+        client.post("/messages/", json={
+            "room_id": room_id,
+            "content": "Con adjuntos",
+            "attachments": [{"file_url": url, "file_type": "image"} for url in urls]
+        }, headers=alice_headers)
+    client.get(f"/messages/room/{room['id']}/latest", headers=alice_headers)
+    assert redis_client.exists(f"messages:room:{room['id']}")
+
+    # 1. Sala pequeña: borrado completo dentro de la petición
+    response = client.delete(f"/chat-rooms/{room['id']}", headers=alice_headers)
+    assert response.status_code == 204
+    db_session.expire_all()
+    assert db_session.get(ChatRoom, room["id"]) is None
+    assert db_session.query(Message).filter(Message.room_id == room["id"]).count() == 0
+    assert db_session.query(Attachment).count() == 1
+    assert not redis_client.exists(f"messages:room:{room['id']}")
+    assert not redis_client.sismember("rooms:deleting", room["id"])
+
+    # 2. Solo se conserva el archivo que sigue usando la otra sala
+    assert not get_upload_path(own_file).exists()
+    assert get_upload_path(shared_file).exists()
+
+    # 3. Sala grande (más mensajes que un lote): 202 y purga en segundo plano
+    monkeypatch.setattr(room_cleanup, "batch_size", 2)
+    for i in range(5):
+        client.post("/messages/", json={"room_id": other_room["id"], "content": f"Mensaje {i}"}, headers=alice_headers)
+
+    response = client.delete(f"/chat-rooms/{other_room['id']}", headers=alice_headers)
+    assert response.status_code == 202
+    assert response.json() == {"room_id": other_room["id"], "status": "deleting"}
+
+    # TestClient ejecuta las background tasks antes de devolver la respuesta
+    db_session.expire_all()
+    assert db_session.get(ChatRoom, other_room["id"]) is None
+    assert db_session.query(Message).count() == 0
+    assert not get_upload_path(shared_file).exists()
+    assert client.get(f"/chat-rooms/{other_room['id']}", headers=alice_headers).status_code == 404
+
+
+# ============================================================================
+# FLUJO 17: Subida de Archivos por Bloques
+# ============================================================================
+
+def test_upload_streams_to_disk_and_rejects_large_files(client, monkeypatch):
+    """
+    Subir archivos:
+    1. El archivo se copia por bloques y el nombre incluye su SHA-256
+    2. Un archivo demasiado grande se rechaza sin dejar temporales
+    3. Si el tamaño no se conoce de antemano, se corta al superar el límite
+    """
+    import hashlib
+    import io
+    from app.routers import attachments
+    from app.services import uploads
+    from app.services.storage import UPLOAD_DIR
+    from app.services.uploads import UPLOAD_TEMP_PREFIX, get_upload_path
+
+    create_test_user(client, "alice", "alice@example.com", "securepass123")
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+
+    def upload(content):
+        return client.post(
+            "/attachments/upload",
+            files={"file": ("foto.PNG", content, "image/png")},
+            headers=alice_headers
+        )
+
+    def temp_files():
+        return list(UPLOAD_DIR.glob(f"{UPLOAD_TEMP_PREFIX}*"))
+
+    # 1. Varios bloques: contenido íntegro y hash en el nombre
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_SIZE", 1024)
+    content = bytes(range(256)) * 20
+    response = upload(content)
+    assert response.status_code == 201
+    data = response.json()
+    assert data["file_size"] == len(content)
+    assert data["file_type"] == "image"
+    assert hashlib.sha256(content).hexdigest()[:16] in data["file_url"]
+    assert data["file_url"].endswith(".png")
+    path = get_upload_path(data["file_url"])
+    assert path.read_bytes() == content
+    path.unlink()
+
+    # 2. Demasiado grande: 400 y nada en disco
+    monkeypatch.setattr(attachments, "MAX_FILE_SIZE", 2048)
+    response = upload(content)
+    assert response.status_code == 400
+    assert "File too large" in response.json()["detail"]
+    assert temp_files() == []
+
+    # 3. Tamaño desconocido: la copia se corta en el primer bloque que supera el límite
+    source = io.BytesIO(content)
+    with pytest.raises(uploads.FileTooLargeError):
+        uploads.save_upload(source, ".png", 2048)
+    assert source.tell() == 3 * 1024
+    assert temp_files() == []
+
+
+# ============================================================================
+# FLUJO 18: Almacenamiento Deduplicado de Adjuntos
+# ============================================================================
+
+def test_uploads_are_content_addressed_and_reference_counted(client):
+    """
+    Archivos direccionados por contenido:
+    1. Subir dos veces el mismo contenido reutiliza el mismo blob
+    2. Con el hash se reutiliza sin volver a enviar el archivo
+    3. El blob se borra al eliminar el último adjunto que lo usa
+    4. Un blob reutilizado recientemente no se borra aunque pierda sus adjuntos
+    """
+    import hashlib
+    from app.redis_client import redis_client
+    from app.services.storage import UPLOAD_DIR
+    from app.services.uploads import get_upload_path
+
+    create_test_user(client, "alice", "alice@example.com", "securepass123")
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+    room = client.post("/chat-rooms/", json={"name": "Memes", "is_group": True}, headers=alice_headers).json()
+
+    content = b"%PDF-1.4 mismo meme"
+    digest = hashlib.sha256(content).hexdigest()
+
+    def upload(name):
+        response = client.post(
+            "/attachments/upload",
+            files={"file": (name, content, "application/pdf")},
+            headers=alice_headers
+        )
+        assert response.status_code == 201
+        return response.json()
+
+    def attach(file_url):
+        message = client.post("/messages/", json={"room_id": room["id"], "content": "Adjunto"}, headers=alice_headers).json()
+        return client.post("/attachments/", json={
+            "message_id": message["id"], "file_url": file_url, "file_type": "document"
+        }, headers=alice_headers).json()
+
+    # 1. Mismo contenido: mismo blob, nombrado por su hash completo
+    first = upload("informe.pdf")
+    second = upload("copia.PDF")
+    assert first["file_url"] == second["file_url"] == f"/uploads/{digest}.pdf"
+    assert first["sha256"] == digest
+    assert first["deduplicated"] is False
+    assert second["deduplicated"] is True
+    assert second["file_name"] == "copia.PDF"
+    assert len(list(UPLOAD_DIR.glob(f"{digest}*"))) == 1
+
+    # 2. Solo metadatos: 404 si el contenido no existe
+    by_hash = {"sha256": digest, "content_type": "application/pdf", "file_name": "reenvio.pdf"}
+    response = client.post("/attachments/upload/by-hash", json=by_hash, headers=alice_headers)
+    assert response.status_code == 200
+    assert response.json()["file_url"] == first["file_url"]
+    assert response.json()["file_size"] == len(content)
+    assert response.json()["deduplicated"] is True
+
+    unknown = {**by_hash, "sha256": "0" * 64}
+    response = client.post("/attachments/upload/by-hash", json=unknown, headers=alice_headers)
+    assert response.status_code == 404
+
+    # 3. Dos adjuntos, un blob: se conserva hasta que se elimina el último
+    redis_client.delete(f"upload:{digest}.pdf:claimed")
+    first_attachment = attach(first["file_url"])
+    second_attachment = attach(first["file_url"])
+    path = get_upload_path(first["file_url"])
+
+    assert client.delete(f"/attachments/{first_attachment['id']}", headers=alice_headers).status_code == 204
+    assert path.exists()
+    assert client.delete(f"/attachments/{second_attachment['id']}", headers=alice_headers).status_code == 204
+    assert not path.exists()
+
+    # 4. Reutilizado y todavía sin adjunto: se conserva
+    upload("informe.pdf")
+    attachment = attach(first["file_url"])
+    assert upload("otra_vez.pdf")["deduplicated"] is True
+    assert client.delete(f"/attachments/{attachment['id']}", headers=alice_headers).status_code == 204
+    assert path.exists()
+    path.unlink()
+
+
+# ============================================================================
+# FLUJO 19: Vistas Previas de Imágenes
+# ============================================================================
+
+def test_image_previews_generated_in_background(client, db_session, monkeypatch):
+    """
+    Vistas previas de imágenes:
+    1. Sin vista previa los campos del adjunto son null
+    2. Al subir una imagen se genera en segundo plano miniatura WebP + blurhash
+       y los mensajes ya cacheados se recargan con ella
+    3. Los documentos no tienen vista previa
+    4. JPEG grandes (decodificados a escala reducida): se guardan las dimensiones
+       reales, intercambiadas si la orientación EXIF gira la imagen
+    5. Al eliminar el último adjunto se borran el blob, la miniatura y la vista previa
+    """
+    pytest.importorskip("PIL")
+    import io
+    from PIL import Image
+    from app.redis_client import redis_client
+    from app.models.upload_preview import UploadPreview
+    from app.services import thumbnails
+    from app.services.uploads import get_upload_path
+
+    create_test_user(client, "alice", "alice@example.com", "securepass123")
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+    room = client.post("/chat-rooms/", json={"name": "Fotos", "is_group": True}, headers=alice_headers).json()
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 480), (200, 40, 90)).save(buffer, "PNG")
+
+    def upload(content, name, content_type):
+        response = client.post(
+            "/attachments/upload",
+            files={"file": (name, content, content_type)},
+            headers=alice_headers
+        )
+        assert response.status_code == 201
+        return response.json()
+
+    def latest_attachment():
+        messages = client.get(f"/messages/room/{room['id']}/latest", headers=alice_headers).json()
+        return messages[-1]["attachments"][0]
+
+    # 1. Subida con vistas previas desactivadas: mensaje cacheado sin vista previa
+    monkeypatch.setattr(thumbnails, "THUMBNAILS_ENABLED", False)
+    image = upload(buffer.getvalue(), "foto.png", "image/png")
+    message = client.post("/messages/", json={
+        "room_id": room["id"],
+        "content": "Mira",
+        "attachments": [{"file_url": image["file_url"], "file_type": "image"}]
+    }, headers=alice_headers).json()
+    assert message["attachments"][0]["thumbnail_url"] is None
+    assert latest_attachment()["blurhash"] is None
+
+    # 2. Misma imagen con vistas previas: se generan y el caché de la sala se recarga
+    monkeypatch.setattr(thumbnails, "THUMBNAILS_ENABLED", True)
+    upload(buffer.getvalue(), "otra.png", "image/png")
+
+    attachment = latest_attachment()
+    assert attachment["thumbnail_url"].endswith("_thumb.webp")
+    assert len(attachment["blurhash"]) == 28
+    assert (attachment["width"], attachment["height"]) == (640, 480)
+
+    thumbnail_path = get_upload_path(attachment["thumbnail_url"])
+    with Image.open(thumbnail_path) as thumbnail:
+        assert thumbnail.format == "WEBP"
+        assert thumbnail.size == (320, 240)
+
+    response = client.get(f"/attachments/{attachment['id']}", headers=alice_headers)
+    assert response.json()["thumbnail_url"] == attachment["thumbnail_url"]
+
+    # 3. Documentos: sin vista previa
+    document = upload(b"%PDF-1.4 documento", "doc.pdf", "application/pdf")
+    db_session.expire_all()
+    assert db_session.get(UploadPreview, document["file_url"]) is None
+    get_upload_path(document["file_url"]).unlink()
+
+    # 4. JPEG grandes: dimensiones del original, no las de la decodificación reducida
+    for orientation, expected in ((1, (4000, 3000)), (6, (3000, 4000))):
+        exif = Image.Exif()
+        exif[0x0112] = orientation
+        photo = io.BytesIO()
+        Image.new("RGB", (4000, 3000), (10, 120, 200 + orientation)).save(photo, "JPEG", exif=exif)
+        jpeg = upload(photo.getvalue(), "camara.jpg", "image/jpeg")
+
+        db_session.expire_all()
+        preview = db_session.get(UploadPreview, jpeg["file_url"])
+        assert (preview.width, preview.height) == expected
+        with Image.open(get_upload_path(preview.thumbnail_url)) as thumbnail:
+            assert thumbnail.size == tuple(320 * side // max(expected) for side in expected)
+        get_upload_path(preview.thumbnail_url).unlink()
+        get_upload_path(jpeg["file_url"]).unlink()
+
+    # 5. Eliminar el único adjunto borra todo lo asociado al blob (sin reutilización pendiente)
+    redis_client.delete(f"upload:{get_upload_path(image['file_url']).name}:claimed")
+    assert client.delete(f"/attachments/{attachment['id']}", headers=alice_headers).status_code == 204
+    db_session.expire_all()
+    assert db_session.get(UploadPreview, image["file_url"]) is None
+    assert not get_upload_path(image["file_url"]).exists()
+    assert not thumbnail_path.exists()
+
+
+# ============================================================================
+# FLUJO 20: Descarga de Archivos con Caché HTTP y Rangos
+# ============================================================================
+
+def test_upload_download_etag_and_ranges(client, monkeypatch):
+    """
+    Descargar archivos subidos:
+    1. ETag fuerte = SHA-256 del contenido y Cache-Control immutable
+    2. If-None-Match con el ETag: 304 sin cuerpo
+    3. Range / If-Range: descargas parciales y reanudables
+    4. Archivos sin nombre por contenido: ETag por tamaño/fecha, sin immutable
+    5. Detrás de nginx el envío se delega con X-Accel-Redirect
+    """
+    import hashlib
+    from app.routers import uploads as uploads_router
+    from app.services.uploads import get_upload_path
+
+    create_test_user(client, "alice", "alice@example.com", "securepass123")
+    alice_headers = get_auth_headers(login_user(client, "alice", "securepass123")["access_token"])
+
+    content = b"%PDF-1.4 " + bytes(range(256)) * 4
+    digest = hashlib.sha256(content).hexdigest()
+    file_url = client.post(
+        "/attachments/upload",
+        files={"file": ("manual.pdf", content, "application/pdf")},
+        headers=alice_headers
+    ).json()["file_url"]
+
+    # 1. Descarga completa
+    response = client.get(file_url)
+    assert response.status_code == 200
+    assert response.content == content
+    assert response.headers["etag"] == f'"{digest}"'
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["content-type"] == "application/pdf"
+    assert response.headers["accept-ranges"] == "bytes"
+
+    head = client.head(file_url)
+    assert head.status_code == 200
+    assert head.headers["content-length"] == str(len(content))
+    assert head.content == b""
+
+    # 2. Revalidación: 304 con el ETag exacto, débil o en una lista
+    for if_none_match in (f'"{digest}"', f'W/"{digest}"', f'"otro", "{digest}"', "*"):
+        response = client.get(file_url, headers={"If-None-Match": if_none_match})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == f'"{digest}"'
+    assert client.get(file_url, headers={"If-None-Match": '"otro"'}).status_code == 200
+
+    # 3. Rangos: parcial, reanudación con If-Range y rango inválido
+    response = client.get(file_url, headers={"Range": "bytes=0-8"})
+    assert response.status_code == 206
+    assert response.content == b"%PDF-1.4 "
+    assert response.headers["content-range"] == f"bytes 0-8/{len(content)}"
+
+    response = client.get(file_url, headers={"Range": "bytes=9-", "If-Range": f'"{digest}"'})
+    assert response.status_code == 206
+    assert response.content == content[9:]
+
+    response = client.get(file_url, headers={"Range": "bytes=9-", "If-Range": '"otro"'})
+    assert response.status_code == 200
+    assert response.content == content
+
+    assert client.get(file_url, headers={"Range": f"bytes={len(content) + 10}-"}).status_code == 416
+
+    # 4. Nombre antiguo (no derivado del contenido)
+    legacy_path = get_upload_path(file_url).with_name("20240101_abcdef_1234.pdf")
+    legacy_path.write_bytes(content)
+    response = client.get("/uploads/20240101_abcdef_1234.pdf")
+    assert response.status_code == 200
+    assert response.headers["etag"] != f'"{digest}"'
+    assert "immutable" not in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    assert client.get("/uploads/20240101_abcdef_1234.pdf", headers={"If-None-Match": etag}).status_code == 304
+
+    # Inexistentes o fuera del directorio
+    assert client.get("/uploads/no_existe.pdf").status_code == 404
+    assert client.get("/uploads/..%2Fapp%2Fmain.py").status_code == 404
+
+    # 5. X-Accel-Redirect: la API solo valida y responde cabeceras
+    monkeypatch.setattr(uploads_router, "UPLOADS_ACCEL_REDIRECT_PREFIX", "/internal-uploads/")
+    response = client.get(file_url)
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == f"/internal-uploads/{digest}.pdf"
+    assert response.headers["etag"] == f'"{digest}"'
+    assert client.get(file_url, headers={"If-None-Match": f'"{digest}"'}).status_code == 304
+
+    legacy_path.unlink()
+    get_upload_path(file_url).unlink()
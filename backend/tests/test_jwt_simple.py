@@ -37,3 +37,31 @@ def test_jwt_authentication_works(client, db_session):
     assert response.status_code == 201, f"Expected 201, got {response.status_code}: {response.text}"
     room_data = response.json()
     print(f"   Sala creada: {room_data['name']} (ID: {room_data['id']})")
+
+
+def test_verify_token_cache_respects_expiration():
+    """
+    Test del caché de tokens verificados:
+    1. La segunda verificación del mismo token sale del caché
+    2. Un token expirado no se acepta ni se cachea
+    3. Un token alterado no se acepta
+    """
+    import time
+    from datetime import timedelta
+    from app.auth.jwt import create_access_token, verify_token, get_verify_stats
+
+    # 1. Mismo token dos veces
+    token = create_access_token({"sub": "42", "username": "cached"})
+    hits = get_verify_stats()["hits"]
+    assert verify_token(token).user_id == 42
+    assert verify_token(token).username == "cached"
+    assert get_verify_stats()["hits"] == hits + 1
+
+    # 2. Token que expira en 1 segundo: tras expirar deja de ser válido
+    short_token = create_access_token({"sub": "7"}, expires_delta=timedelta(seconds=1))
+    assert verify_token(short_token).user_id == 7
+    time.sleep(2)
+    assert verify_token(short_token) is None
+
+    # 3. Firma alterada
+    assert verify_token(token[:-2] + ("AA" if not token.endswith("AA") else "BB")) is None
@@ -0,0 +1,164 @@
+"""
+Persistencia write-behind de mensajes (stream de Redis + INSERT por lotes)
+
+Requiere PostgreSQL (secuencias, ON CONFLICT): se omite salvo que DATABASE_URL
+apunte a uno, p.ej.
+
+    DATABASE_URL=postgresql://postgres@localhost/chat_test pytest tests/test_message_ingest.py
+
+Las tablas se crean y se eliminan en esa base de datos en cada test.
+"""
+import asyncio
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+
+from app.database import SessionLocal, async_engine, engine
+from app.models import Base
+from app.models.chat_room import ChatRoom
+from app.models.message import Message
+from app.models.user import User
+from app.redis_client import async_redis_client
+from app.services.message_ingest import PERSISTENCE_WRITE_BEHIND, MessageIngestService
+
+pytestmark = [
+    pytest.mark.skipif(async_engine.dialect.name != "postgresql", reason="write-behind requiere PostgreSQL"),
+    pytest.mark.asyncio
+]
+
+
+@pytest_asyncio.fixture
+async def chat_room():
+    """Esquema limpio, stream vacío y una sala con su autor: (room_id, user_id)"""
+    Base.metadata.create_all(bind=engine)
+    await async_redis_client.delete(MessageIngestService.STREAM_KEY)
+    with SessionLocal() as db:
+        user = User(username="alice", email="alice@example.com", password_hash="x")
+        room = ChatRoom(name="Sala", is_group=True)
+        db.add_all([user, room])
+        db.commit()
+        ids = (room.id, user.id)
+
+    yield ids
+
+    await async_redis_client.delete(MessageIngestService.STREAM_KEY)
+    # Pools ligados al event loop de este test
+    await async_redis_client.close()
+    await async_engine.dispose()
+    Base.metadata.drop_all(bind=engine)
+
+
+def persisted_ids(room_id: int) -> list:
+    with SessionLocal() as db:
+        return db.scalars(select(Message.id).where(Message.room_id == room_id).order_by(Message.id)).all()
+
+
+def create_service(**kwargs) -> MessageIngestService:
+    options = dict(mode=PERSISTENCE_WRITE_BEHIND, batch_size=50, flush_interval_ms=10, id_block_size=10)
+    options.update(kwargs)
+    return MessageIngestService(**options)
+
+
+async def without_flusher(service: MessageIngestService):
+    """Arrancar el servicio sin su flusher en segundo plano (worker que no llega a persistir)"""
+    service._flush_loop = asyncio.Event().wait
+    await service.start()
+    assert service.enabled
+
+
+async def wait_until(predicate, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timeout esperando el flusher"
+        await asyncio.sleep(0.05)
+
+
+async def test_ids_are_reserved_in_blocks_from_the_sequence(chat_room):
+    """Los IDs pre-asignados vienen de la secuencia: únicos y sin chocar con inserts directos"""
+    room_id, user_id = chat_room
+    service = create_service()
+    await without_flusher(service)
+
+    submitted = [await service.submit(room_id, user_id, f"m{i}") for i in range(15)]
+    ids = [message.id for message in submitted]
+    assert len(set(ids)) == 15
+    # Bloque de 10 consecutivos: el segundo bloque empieza después del primero
+    assert ids[:10] == list(range(ids[0], ids[0] + 10))
+
+    # Un INSERT directo (API REST) toma el siguiente valor libre de la secuencia
+    with SessionLocal() as db:
+        direct = Message(room_id=room_id, user_id=user_id, content="REST")
+        db.add(direct)
+        db.commit()
+        assert direct.id not in ids
+
+    await service.stop()
+    assert sorted(persisted_ids(room_id)) == sorted(ids + [direct.id])
+
+
+async def test_flusher_inserts_batches_and_stop_drains_the_stream(chat_room):
+    """El flusher persiste en lote; lo que queda en el stream se persiste al detener"""
+    room_id, user_id = chat_room
+
+    service = create_service()
+    await service.start()
+    first = [await service.submit(room_id, user_id, f"lote {i}") for i in range(30)]
+    await wait_until(lambda: len(persisted_ids(room_id)) == 30)
+    assert (await service.get_stats())["stream_length"] == 0
+    await service.stop()
+    assert service.flushed == 30
+
+    # Worker que se detiene con mensajes aún en el stream: stop() los vacía
+    service = create_service()
+    await without_flusher(service)
+    pending = [await service.submit(room_id, user_id, f"pendiente {i}") for i in range(20)]
+    assert len(persisted_ids(room_id)) == 30
+    await service.stop()
+
+    assert persisted_ids(room_id) == sorted(m.id for m in first + pending)
+    assert service.flushed == 20
+    assert await async_redis_client.xlen(MessageIngestService.STREAM_KEY) == 0
+
+
+async def test_orphaned_entries_are_claimed_by_another_worker(chat_room):
+    """Entradas leídas por un worker que cayó antes del XACK: otro las reclama y persiste"""
+    room_id, user_id = chat_room
+
+    crashed = create_service()
+    crashed.consumer = "worker-caido"
+    await without_flusher(crashed)
+    submitted = [await crashed.submit(room_id, user_id, f"huérfano {i}") for i in range(5)]
+    # Las lee (quedan en su lista de pendientes) y cae sin confirmarlas
+    read = await async_redis_client.xreadgroup(crashed.GROUP, crashed.consumer, crashed.STREAM_KEY, count=10)
+    assert len(read) == 5
+    crashed._flusher_task.cancel()
+
+    survivor = create_service(claim_idle_ms=0)
+    await survivor.start()
+    await wait_until(lambda: len(persisted_ids(room_id)) == 5)
+    await survivor.stop()
+
+    assert persisted_ids(room_id) == [m.id for m in submitted]
+    assert survivor.flushed == 5
+    pending = await async_redis_client.client.xpending(MessageIngestService.STREAM_KEY, MessageIngestService.GROUP)
+    assert pending["pending"] == 0
+
+
+async def test_rows_violating_foreign_keys_are_discarded_without_blocking_the_batch(chat_room):
+    """Un mensaje de una sala inexistente se descarta; el resto del lote se persiste"""
+    room_id, user_id = chat_room
+    service = create_service()
+    await without_flusher(service)
+
+    valid = [await service.submit(room_id, user_id, f"ok {i}") for i in range(3)]
+    await service.submit(room_id + 1000, user_id, "sala eliminada")
+    valid.append(await service.submit(room_id, user_id, "ok 3"))
+    await service.stop()
+
+    assert persisted_ids(room_id) == [m.id for m in valid]
+    with SessionLocal() as db:
+        assert db.scalar(select(func.count(Message.id))) == 4
+    # Solo cuentan las filas realmente insertadas
+    assert service.flushed == 4
+    assert await async_redis_client.xlen(MessageIngestService.STREAM_KEY) == 0
@@ -0,0 +1,72 @@
+"""
+Regresión de planes de consulta: las consultas calientes deben usar sus índices
+
+Se ejecuta EXPLAIN QUERY PLAN (SQLite de tests) sobre las mismas formas de
+consulta que usan los routers. Si alguien cambia un filtro u orden y deja de
+coincidir con el índice, el plan pasa a SCAN / TEMP B-TREE y el test falla.
+"""
+from sqlalchemy import select, tuple_
+
+from app.models.message import Message
+from app.models.room_participant import RoomParticipant
+from app.models.contact import Contact
+from app.models.attachment import Attachment
+
+
+def explain(db_session, stmt) -> str:
+    """Devolver el plan de SQLite de una sentencia como un único string"""
+    sql = stmt.compile(bind=db_session.get_bind(), compile_kwargs={"literal_binds": True})
+    rows = db_session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return "\n".join(row[-1] for row in rows)
+
+
+def test_room_history_uses_partial_index(db_session):
+    """Historial de sala (latest / history): índice parcial sin ordenación extra"""
+    stmt = select(Message.id).where(
+        Message.room_id == 1,
+        Message.is_deleted == False
+    ).order_by(Message.created_at.desc(), Message.id.desc()).limit(50)
+
+    plan = explain(db_session, stmt)
+    assert "ix_messages_room_created_live" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_room_history_keyset_uses_partial_index(db_session):
+    """Página anterior con cursor (created_at, id): mismo índice"""
+    stmt = select(Message.id).where(
+        Message.room_id == 1,
+        Message.is_deleted == False,
+        tuple_(Message.created_at, Message.id) < tuple_("2025-01-01 00:00:00", 100)
+    ).order_by(Message.created_at.desc(), Message.id.desc()).limit(51)
+
+    plan = explain(db_session, stmt)
+    assert "ix_messages_room_created_live" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_participant_lookups_use_indexes(db_session):
+    """Comprobación de acceso (room_id, user_id) y salas de un usuario (user_id)"""
+    access = explain(db_session, select(RoomParticipant.id).where(
+        RoomParticipant.room_id == 1,
+        RoomParticipant.user_id == 2
+    ))
+    assert access.startswith("SEARCH room_participants") and "SCAN" not in access
+
+    rooms = explain(db_session, select(RoomParticipant.room_id).where(RoomParticipant.user_id == 2))
+    assert "ix_room_participants_user_room" in rooms
+
+
+def test_pending_contacts_use_index(db_session):
+    """Solicitudes de contacto recibidas pendientes"""
+    plan = explain(db_session, select(Contact.id).where(
+        Contact.contact_id == 1,
+        Contact.status == "pending"
+    ))
+    assert "ix_contacts_contact_status" in plan
+
+
+def test_message_attachments_use_index(db_session):
+    """Adjuntos de un mensaje"""
+    plan = explain(db_session, select(Attachment.id).where(Attachment.message_id == 1))
+    assert "ix_attachments_message_id" in plan
@@ -0,0 +1,27 @@
+"""
+Cliente Redis asyncio bajo concurrencia
+
+Requiere Redis (mismo servidor que el resto de tests).
+"""
+import asyncio
+
+import pytest
+
+from app.redis_client import AsyncRedisClient
+
+
+@pytest.mark.asyncio
+async def test_pool_queues_bursts_instead_of_failing():
+    """Más operaciones concurrentes que conexiones: esperan turno y ninguna falla"""
+    client = AsyncRedisClient(max_connections=4, pool_timeout=10)
+    try:
+        results = await asyncio.gather(*[
+            client.set(f"test:pool:{i}", i, ttl=60) for i in range(400)
+        ])
+        assert all(results)
+
+        values = await asyncio.gather(*[client.get(f"test:pool:{i}") for i in range(400)])
+        assert values == [str(i) for i in range(400)]
+    finally:
+        await client.delete(*[f"test:pool:{i}" for i in range(400)])
+        await client.close()
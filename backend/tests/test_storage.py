@@ -0,0 +1,73 @@
+"""
+Backend S3 de almacenamiento contra un S3 simulado (moto)
+
+Se omite si boto3/moto no están instalados (son dependencias opcionales).
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+
+@pytest.fixture
+def s3_storage(monkeypatch, tmp_path):
+    """S3Storage sobre un bucket simulado, instalado como backend global"""
+    from app.routers import uploads as uploads_router
+    from app.services import storage as storage_module, uploads
+    from app.services.storage import S3Storage
+
+    with moto.mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="test-uploads")
+        backend = S3Storage("test-uploads", client=client, presigned_url_ttl=600)
+        backend.staging_dir = tmp_path
+        monkeypatch.setattr(storage_module, "storage", backend)
+        monkeypatch.setattr(uploads, "storage", backend)
+        monkeypatch.setattr(uploads_router, "storage", backend)
+        yield backend
+
+
+def test_s3_storage_saves_streams_and_deletes(s3_storage, monkeypatch, tmp_path):
+    """Subida por partes desde el temporal, deduplicación y borrado"""
+    import io
+    from app.services import uploads
+
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_SIZE", 1024)
+    content = b"\x89PNG" + bytes(range(256)) * 50
+
+    stored = uploads.save_upload(io.BytesIO(content), ".png", 1024 * 1024)
+    assert stored.created is True
+    assert s3_storage.size(stored.filename) == len(content)
+    assert list(tmp_path.iterdir()) == []
+
+    head = s3_storage.client.head_object(Bucket="test-uploads", Key=stored.filename)
+    assert head["ContentType"] == "image/png"
+    assert "immutable" in head["CacheControl"]
+
+    again = uploads.save_upload(io.BytesIO(content), ".png", 1024 * 1024)
+    assert again.created is False
+    assert uploads.find_blob(stored.sha256, ".png").size == len(content)
+
+    assert s3_storage.local_path(stored.filename) is None
+    assert s3_storage.delete(stored.filename) is True
+    assert s3_storage.size(stored.filename) is None
+    assert uploads.find_blob(stored.sha256, ".png") is None
+
+
+def test_s3_download_redirects_to_presigned_url(s3_storage):
+    """La API no sirve los bytes: redirige a una URL prefirmada"""
+    from app.routers import uploads as uploads_router
+
+    app = FastAPI()
+    app.include_router(uploads_router.router)
+    client = TestClient(app)
+
+    response = client.get("/uploads/abc123.png", follow_redirects=False)
+    assert response.status_code == 307
+    location = response.headers["location"]
+    assert "test-uploads" in location and "abc123.png" in location
+    assert "Signature" in location or "X-Amz-Signature" in location
+
+    assert client.get("/uploads/..", follow_redirects=False).status_code == 404
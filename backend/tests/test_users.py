@@ -239,3 +239,88 @@ def test_login_inactive_user(client):
     })
     assert response.status_code == status.HTTP_403_FORBIDDEN
     assert "Account is inactive" in response.json()["detail"]
+
+def test_password_hashing_runs_in_pool(client):
+    """Test que registro y login pasan por el pool de bcrypt y se reportan en /auth/stats"""
+    before = client.get("/auth/stats").json()["completed"]
+
+    client.post("/users/", json={
+        "username": "testuser",
+        "email": "test@example.com",
+        "password": "password123"
+    })
+    response = client.post("/users/login", json={
+        "username": "testuser",
+        "password": "password123"
+    })
+    assert response.status_code == status.HTTP_200_OK
+
+    stats = client.get("/auth/stats").json()
+    assert stats["completed"] >= before + 2
+    assert stats["in_flight"] == 0
+    assert stats["rejected"] == 0
+
+def test_password_pool_counts_failures_separately():
+    """Test que una operación de bcrypt que lanza cuenta como failed y no como completed"""
+    import asyncio
+    from app.auth.password import get_hasher_stats, verify_password_async
+
+    before = get_hasher_stats()
+    with pytest.raises(ValueError):
+        asyncio.run(verify_password_async("password123", "no-es-un-hash"))
+
+    stats = get_hasher_stats()
+    assert stats["failed"] == before["failed"] + 1
+    assert stats["completed"] == before["completed"]
+    assert stats["in_flight"] == 0
+
+def test_password_pool_full_returns_503(client, monkeypatch):
+    """Test que con el pool de bcrypt lleno el registro responde 503 con Retry-After"""
+    from app.auth import password
+
+    monkeypatch.setattr(password, "PASSWORD_HASH_MAX_PENDING", 0)
+    before = client.get("/auth/stats").json()["rejected"]
+
+    response = client.post("/users/", json={
+        "username": "testuser",
+        "email": "test@example.com",
+        "password": "password123"
+    })
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["Retry-After"] == "1"
+    assert response.json()["detail"] == "Server busy, please retry"
+    assert client.get("/auth/stats").json()["rejected"] == before + 1
+
+def test_password_pool_slot_held_until_thread_finishes():
+    """Test que cancelar la petición no libera el hueco mientras bcrypt sigue en su hilo"""
+    import asyncio
+    import threading
+    import time
+    from app.auth.password import _run_in_pool, get_hasher_stats
+
+    started, release = threading.Event(), threading.Event()
+
+    def slow_operation():
+        started.set()
+        release.wait(5)
+        return True
+
+    async def cancel_while_running():
+        task = asyncio.create_task(_run_in_pool(slow_operation))
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # El hilo sigue ocupado: el hueco no se ha liberado
+        assert get_hasher_stats()["in_flight"] == 1
+
+    before = get_hasher_stats()
+    asyncio.run(cancel_while_running())
+    release.set()
+
+    deadline = time.monotonic() + 5
+    while get_hasher_stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stats = get_hasher_stats()
+    assert stats["in_flight"] == 0
+    assert stats["completed"] == before["completed"] + 1
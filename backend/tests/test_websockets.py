@@ -0,0 +1,223 @@
+"""
+ConnectionManager y colas de salida WebSocket sin servidor HTTP
+
+Los sockets son dobles en memoria; el modo cluster usa el Redis de los tests
+(dos managers en el mismo proceso hacen de dos workers).
+"""
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+
+from app.redis_client import async_redis_client
+from app.websockets.events import EventType, create_event
+from app.websockets.manager import ConnectionManager
+from app.websockets.outbound import OVERFLOW_DISCONNECT, OVERFLOW_DROP_OLDEST, OutboundQueue
+
+
+class FakeWebSocket:
+    """WebSocket en memoria: guarda los eventos enviados y el código de cierre"""
+
+    def __init__(self):
+        self.events = []
+        self.close_code = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, frame: str):
+        self.events.append(json.loads(frame))
+
+    async def send_json(self, message: dict):
+        self.events.append(message)
+
+    async def close(self, code: int = 1000, reason: str = None):
+        self.close_code = code
+
+    def markers(self) -> list:
+        """Marcadores de los eventos typing recibidos, en orden"""
+        return [event["data"]["marker"] for event in self.events if event["type"] == EventType.TYPING.value]
+
+    def received(self, marker: str) -> int:
+        """Cuántos eventos typing con este marcador llegaron"""
+        return sum(
+            1 for event in self.events
+            if event["type"] == EventType.TYPING.value and event["data"].get("marker") == marker
+        )
+
+
+class BrokenWebSocket(FakeWebSocket):
+    """Cliente que se fue: cualquier envío falla"""
+
+    async def send_text(self, frame: str):
+        raise RuntimeError("socket cerrado")
+
+
+class StalledWebSocket(FakeWebSocket):
+    """Cliente que no lee: los envíos nunca terminan"""
+
+    async def send_text(self, frame: str):
+        await asyncio.Event().wait()
+
+
+async def wait_until(predicate, timeout: float = 3.0):
+    """Esperar a que se cumpla una condición (tareas escritoras y Pub/Sub son asíncronas)"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timeout esperando la entrega"
+        await asyncio.sleep(0.02)
+
+
+def marked_event(marker: str) -> dict:
+    return create_event(EventType.TYPING, user_id=1, username="alice", marker=marker)
+
+
+def marked_frame(marker: str) -> str:
+    return json.dumps(marked_event(marker))
+
+
+@pytest_asyncio.fixture(autouse=True)
+async def release_redis_pool():
+    """El pool global (estado online, Pub/Sub) queda ligado al event loop de cada test"""
+    yield
+    await async_redis_client.close()
+
+
+@pytest_asyncio.fixture
+async def cluster():
+    """Dos managers en modo redis, como dos workers de la API"""
+    workers = [ConnectionManager(broadcast_mode="redis") for _ in range(2)]
+    for worker in workers:
+        await worker.start()
+    yield workers
+    for worker in workers:
+        for room_id, connections in list(worker.active_connections.items()):
+            for connection_id in list(connections):
+                await worker.disconnect(room_id, connection_id)
+        await worker.stop()
+
+
+@pytest.mark.asyncio
+async def test_cluster_broadcast_fans_out_between_workers(cluster):
+    """Fan-out entre workers, exclude_connection_id solo en el origen y desuscripción"""
+    worker_a, worker_b = cluster
+    room_id = 9101
+    socket_a, socket_b = FakeWebSocket(), FakeWebSocket()
+    conn_a = await worker_a.connect(socket_a, room_id, 1, "alice")
+    conn_b = await worker_b.connect(socket_b, room_id, 2, "bob")
+
+    # Excluir la conexión del emisor: solo la del otro worker lo recibe
+    assert await worker_a.broadcast(room_id, marked_event("uno"), exclude_connection_id=conn_a) is True
+    await wait_until(lambda: socket_b.received("uno") == 1)
+    await asyncio.sleep(0.1)
+    assert socket_a.received("uno") == 0
+
+    # Sin exclusión: cada socket lo recibe una sola vez (no por local + Pub/Sub)
+    assert await worker_b.broadcast(room_id, marked_event("dos")) is True
+    await wait_until(lambda: socket_a.received("dos") == 1 and socket_b.received("dos") == 1)
+    await asyncio.sleep(0.1)
+    assert (socket_a.received("dos"), socket_b.received("dos")) == (1, 1)
+
+    # Al irse la última conexión local el worker deja de escuchar la sala
+    await worker_b.disconnect(room_id, conn_b)
+    assert await worker_a.cluster.publish(room_id, json.dumps(marked_event("tres"))) == 1
+    await wait_until(lambda: socket_a.received("tres") == 1)
+    assert socket_b.received("tres") == 0
+
+
+@pytest.mark.asyncio
+async def test_cluster_publish_distinguishes_no_subscribers_from_failure(cluster, monkeypatch):
+    """0 receptores no es un error; un fallo de Redis se reintenta y se informa"""
+    worker_a, _ = cluster
+    room_id = 9102
+
+    # Sala sin sockets en ningún worker: 0 receptores, broadcast correcto
+    assert await worker_a.cluster.publish(room_id, "{}") == 0
+    assert await worker_a.broadcast(room_id, marked_event("nadie")) is True
+    assert worker_a.cluster.publish_failures == 0
+
+    socket_a = FakeWebSocket()
+    await worker_a.connect(socket_a, room_id, 1, "alice")
+
+    attempts = []
+
+    async def failing_publish(channel, message):
+        attempts.append(channel)
+        raise ConnectionError("Redis caído")
+
+    monkeypatch.setattr(worker_a.cluster, "PUBLISH_RETRY_DELAY", 0)
+    monkeypatch.setattr(async_redis_client.client, "publish", failing_publish)
+
+    # Redis falla en todos los intentos: None, entrega local y broadcast informa el fallo
+    assert await worker_a.cluster.publish(room_id, "{}") is None
+    assert await worker_a.broadcast(room_id, marked_event("local")) is False
+    await wait_until(lambda: socket_a.received("local") == 1)
+    assert len(attempts) == 2 * worker_a.cluster.PUBLISH_ATTEMPTS
+    assert (await worker_a.get_stats())["cluster_publish_failures"] == 2
+
+
+@pytest.mark.asyncio
+async def test_outbound_queue_drop_oldest_keeps_newest_frames():
+    """drop_oldest: con la cola llena se descarta el más antiguo y se acepta el nuevo"""
+    socket = FakeWebSocket()
+    queue = OutboundQueue(socket, "conn_1", maxsize=2, overflow_policy=OVERFLOW_DROP_OLDEST)
+
+    assert all(queue.enqueue(marked_frame(marker)) for marker in ("a", "b", "c"))
+    assert (queue.pending, queue.dropped) == (2, 1)
+
+    queue.start()
+    await wait_until(lambda: queue.pending == 0 and len(socket.events) == 2)
+    assert socket.markers() == ["b", "c"]
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_outbound_queue_disconnect_policy_fails_once():
+    """disconnect: desbordar marca la conexión como caída y avisa una sola vez"""
+    failures = []
+    queue = OutboundQueue(
+        FakeWebSocket(), "conn_1", maxsize=2,
+        overflow_policy=OVERFLOW_DISCONNECT,
+        on_failure=failures.append
+    )
+
+    assert queue.enqueue(marked_frame("a")) and queue.enqueue(marked_frame("b"))
+    assert queue.enqueue(marked_frame("c")) is False
+    assert queue.enqueue(marked_frame("d")) is False
+    assert failures == ["conn_1"]
+    assert queue.dropped == 0
+
+
+@pytest.mark.asyncio
+async def test_manager_evicts_failed_and_slow_connections():
+    """Una tarea escritora que falla o un consumidor lento se sacan de la sala y se cierran"""
+    manager = ConnectionManager(broadcast_mode="local", send_queue_size=2, overflow_policy=OVERFLOW_DISCONNECT)
+    room_id = 9201
+    healthy, broken, stalled = FakeWebSocket(), BrokenWebSocket(), StalledWebSocket()
+    await manager.connect(healthy, room_id, 1, "alice")
+
+    # El primer envío (confirmación de conexión) falla: el manager la desconecta solo
+    broken_id = await manager.connect(broken, room_id, 2, "bob")
+    await wait_until(lambda: broken_id not in manager.active_connections.get(room_id, {}))
+    assert broken.close_code == 1013
+
+    # Consumidor que no lee: al desbordar su cola se expulsa en el broadcast
+    # (el cliente sano lee cada evento antes del siguiente)
+    stalled_id = await manager.connect(stalled, room_id, 3, "carol")
+    for marker in ("uno", "dos", "tres"):
+        await manager.broadcast(room_id, marked_event(marker))
+        await wait_until(lambda: healthy.received(marker) == 1)
+    assert stalled_id not in manager.active_connections[room_id]
+    assert stalled.close_code == 1013
+
+    # El resto de la sala sigue recibiendo, incluido el aviso de salida
+    assert healthy.markers() == ["uno", "dos", "tres"]
+    def left():
+        return sorted(event["data"]["username"] for event in healthy.events if event["type"] == EventType.USER_LEFT.value)
+
+    await wait_until(lambda: left() == ["bob", "carol"])
+    assert manager.get_room_connection_count(room_id) == 1
+
+    for connection_id in list(manager.active_connections[room_id]):
+        await manager.disconnect(room_id, connection_id)